@@ -0,0 +1,326 @@
+"""
+Synthetic benchmarks for the long term memory subsystem. None of them need an
+API key or network access.
+
+ANN index recall and latency on clustered random embeddings, entirely in memory:
+
+    python benchmark_memory.py index --sizes 10000 100000 1000000 --dim 1536
+
+int8 codes and Matryoshka prefixes with exact re-rank: resident memory and recall@k against float32:
+
+    python benchmark_memory.py shortlist --sizes 10000 100000 --rerank 1 4 10
+
+End-to-end embed/store/retrieve through the real engines against a scratch
+SQLite database, using the local hashing embedding provider:
+
+    python benchmark_memory.py store --db /tmp/bench/agents.db --sizes 10000 100000 --index int8
+
+The resident line shows the private memory of the float32 matrix and the index; with --hybrid 0 every query goes
+through the index, e.g. prefix against flat at 100k memories:
+
+    python benchmark_memory.py store --db /tmp/bench-prefix/agents.db --sizes 100000 --index prefix --hybrid 0
+"""
+
+import argparse
+import os
+import random
+import time
+from functools import lru_cache
+from typing import Callable, Iterable, List, Sequence, Tuple
+import numpy as np
+from engines.embedding_store import EMBEDDING_DTYPE, MemoryMatrix
+
+GENERATE_CHUNK_SIZE = 65536
+
+
+def synthetic_embeddings(count: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Gaussian clusters around random centres, a rough stand-in for topic structure in real memories."""
+    rng = np.random.default_rng(seed)
+    clusters = max(16, int(np.sqrt(count)))
+    centres = rng.standard_normal((clusters, dim), dtype=np.float32)
+    embeddings = np.empty((count, dim), dtype=EMBEDDING_DTYPE)
+    for start in range(0, count, GENERATE_CHUNK_SIZE):
+        size = min(GENERATE_CHUNK_SIZE, count - start)
+        labels = rng.integers(0, clusters, size)
+        embeddings[start:start + size] = centres[labels] + 0.75 * rng.standard_normal((size, dim), dtype=np.float32)
+    return embeddings
+
+
+def front_load(embeddings: np.ndarray, scale: float) -> np.ndarray:
+    """
+    Shrink later dimensions by 1 / sqrt(1 + j / scale) so the leading ones carry most of the signal, as in
+    Matryoshka-trained models like text-embedding-3. Isotropic random data is the worst case for prefix search.
+    """
+    weights = 1 / np.sqrt(1 + np.arange(embeddings.shape[1], dtype=np.float32) / scale)
+    return embeddings * weights.astype(EMBEDDING_DTYPE)
+
+
+def synthetic_queries(embeddings: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """Noisy copies of stored memories, like a short-term monologue revisiting an old theme."""
+    rng = np.random.default_rng(seed)
+    picks = embeddings[rng.integers(0, len(embeddings), count)]
+    return picks + 0.5 * rng.standard_normal(picks.shape, dtype=np.float32)
+
+
+def synthetic_memory_matrix(embeddings: np.ndarray, seed: int = 2) -> MemoryMatrix:
+    rng = np.random.default_rng(seed)
+    return MemoryMatrix(
+        ids=np.arange(1, len(embeddings) + 1, dtype=np.int64),
+        embeddings=embeddings,
+        norms=np.linalg.norm(embeddings, axis=1).astype(np.float32),
+        significance=rng.uniform(1, 10, len(embeddings)).astype(np.float32),
+    )
+
+
+def in_memory_fetch(matrix: MemoryMatrix) -> Callable[[np.ndarray], MemoryMatrix]:
+    """Fetch function over a matrix whose ids are 1..n, mirroring load_memory_matrix(db, ids)."""
+    def fetch(ids: np.ndarray) -> MemoryMatrix:
+        rows = np.sort(ids) - 1
+        return MemoryMatrix(
+            ids=matrix.ids[rows],
+            embeddings=matrix.embeddings[rows],
+            norms=matrix.norms[rows],
+            significance=matrix.significance[rows],
+        )
+    return fetch
+
+
+def time_queries(search: Callable, queries: Iterable) -> Tuple[List, np.ndarray]:
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.array(latencies)
+
+
+def format_latency(latencies: np.ndarray) -> str:
+    return f"p50 {np.percentile(latencies, 50):8.2f} ms  p95 {np.percentile(latencies, 95):8.2f} ms"
+
+
+def benchmark_index(sizes: Sequence[int], dim: int, queries: int, top_k: int, nprobe: int):
+    from engines.memory_index import IVFIndex, default_nlist, exact_search, recall_at_k
+
+    print(f"IVF index vs brute force, dim={dim}, top_k={top_k}, nprobe={nprobe}, {queries} queries")
+    for size in sizes:
+        matrix = synthetic_memory_matrix(synthetic_embeddings(size, dim))
+        query_vectors = synthetic_queries(matrix.embeddings, queries)
+
+        exact, flat_latencies = time_queries(lambda q: exact_search(matrix, q, top_k), query_vectors)
+
+        index = IVFIndex(path="", nprobe=nprobe, min_train_rows=0)
+        start = time.perf_counter()
+        sample_size = min(size, default_nlist(size) * 64)
+        sample = matrix.embeddings[np.random.default_rng(3).choice(size, sample_size, replace=False)]
+        index.train(sample, size)
+        index.add_vectors(matrix.ids, matrix.embeddings)
+        build_seconds = time.perf_counter() - start
+
+        fetch = in_memory_fetch(matrix)
+        approximate, ivf_latencies = time_queries(lambda q: index.search_vectors(q, top_k, fetch), query_vectors)
+
+        print(f"\n{size:>9,} memories ({len(index.centroids)} lists, built in {build_seconds:.1f}s)")
+        print(f"  brute force  {format_latency(flat_latencies)}")
+        print(f"  ivf          {format_latency(ivf_latencies)}  recall@{top_k} {recall_at_k(approximate, exact):.3f}")
+
+
+def benchmark_shortlist(
+    sizes: Sequence[int],
+    dim: int,
+    queries: int,
+    top_k: int,
+    rerank_factors: Sequence[int],
+    prefix_dimensions: int,
+    front_load_scale: float,
+):
+    from engines.memory_index import INT8_TRAIN_SAMPLES, Int8Index, PrefixIndex, exact_search, recall_at_k
+    from engines.quantization import ScalarQuantizer
+
+    print(f"Shortlist backends vs float32 brute force, dim={dim}, top_k={top_k}, {queries} queries")
+    for size in sizes:
+        embeddings = synthetic_embeddings(size, dim)
+        if front_load_scale:
+            embeddings = front_load(embeddings, front_load_scale)
+        matrix = synthetic_memory_matrix(embeddings)
+        query_vectors = synthetic_queries(matrix.embeddings, queries)
+        exact, flat_latencies = time_queries(lambda q: exact_search(matrix, q, top_k), query_vectors)
+        fetch = in_memory_fetch(matrix)
+
+        int8_index = Int8Index(min_train_rows=0)
+        sample = matrix.embeddings[np.random.default_rng(3).choice(size, min(size, INT8_TRAIN_SAMPLES), replace=False)]
+        int8_index.quantizer = ScalarQuantizer.train(sample)
+        prefix_index = PrefixIndex(dimensions=prefix_dimensions)
+
+        print(f"\n{size:>9,} memories")
+        print(f"  brute force     {format_latency(flat_latencies)}")
+        for label, index in (("int8", int8_index), (f"prefix {prefix_dimensions}", prefix_index)):
+            start = time.perf_counter()
+            index.add_vectors(matrix.ids, matrix.embeddings)
+            build_seconds = time.perf_counter() - start
+            report = index.memory_report(dim)
+            print(
+                f"  {label:<14}  resident {report['code_bytes'] / 2 ** 20:8.1f} MiB vs float32 "
+                f"{report['float_bytes'] / 2 ** 20:8.1f} MiB ({report['ratio']:.1f}x smaller, encoded in {build_seconds:.1f}s)"
+            )
+            for factor in rerank_factors:
+                index.rerank_factor = factor
+                approximate, latencies = time_queries(lambda q: index.search_vectors(q, top_k, fetch), query_vectors)
+                print(
+                    f"    x{factor:<3} re-rank  {format_latency(latencies)}  "
+                    f"recall@{top_k} {recall_at_k(approximate, exact):.3f}"
+                )
+
+
+@lru_cache(maxsize=1)
+def example_vocabulary() -> List[str]:
+    from db.db_seed import load_all_examples
+    from engines.prompts import get_example_tweets
+
+    corpus = " ".join(load_all_examples()) + " " + get_example_tweets()
+    return sorted(set(word.lower() for word in corpus.split() if word.isalpha()))
+
+
+def synthetic_texts(count: int, seed: int = 0) -> List[str]:
+    """Random word salads over the vocabulary of the seed examples, so the texts share themes and words."""
+    vocabulary = example_vocabulary()
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(vocabulary, k=rng.randint(8, 40))) for _ in range(count)]
+
+
+def resident_report() -> str:
+    """Private memory held by the memory cache and the index, the mapped store's page cache is shared."""
+    from engines.memory_cache import get_memory_cache
+    from engines.memory_index import IVFIndex, ShortlistIndex, get_memory_index
+    from engines.memory_mmap import MappedMemoryStore
+
+    cache = get_memory_cache()
+    index = get_memory_index()
+    matrix_bytes = 0 if isinstance(cache, MappedMemoryStore) else sum(array.nbytes for array in cache.matrix)
+    index_bytes = 0
+    if isinstance(index, ShortlistIndex):
+        index_bytes = index.codes.nbytes + index.ids.nbytes
+    elif isinstance(index, IVFIndex) and index.trained:
+        index_bytes = index.centroids.nbytes + index.ids.nbytes + index.lists.nbytes
+    return (
+        f"float32 matrix {matrix_bytes / 2 ** 20:8.1f} MiB ({type(cache).__name__})  "
+        f"{index.name} index {index_bytes / 2 ** 20:8.1f} MiB"
+    )
+
+
+def benchmark_store(sizes: Sequence[int], queries: int, top_k: int):
+    from sqlalchemy import insert
+    from db.db_setup import DB_PATH, SessionLocal, create_database
+    from engines.embedding_provider import get_embedding_provider
+    from engines.embedding_store import encode_embedding
+    from engines.long_term_mem import create_embedding, create_embeddings, retrieve_relevant_memories, store_memory
+    from models import LongTermMemory
+
+    print(f"Memory subsystem with the '{get_embedding_provider().name}' embedding provider on {DB_PATH}")
+    create_database()
+    db = SessionLocal()
+    try:
+        stored = db.query(LongTermMemory).count()
+        for size in sizes:
+            if size <= stored:
+                continue
+            texts = synthetic_texts(size - stored, seed=size)
+
+            start = time.perf_counter()
+            embeddings = create_embeddings(texts, None)
+            embed_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            rows = []
+            for content, embedding in zip(texts, embeddings):
+                embedding_blob, embedding_norm = encode_embedding(embedding)
+                rows.append({
+                    "content": content,
+                    "embedding": embedding_blob,
+                    "embedding_norm": embedding_norm,
+                    "significance_score": random.uniform(7, 10),
+                })
+            db.execute(insert(LongTermMemory), rows)
+            db.commit()
+            insert_seconds = time.perf_counter() - start
+            stored = size
+
+            query_texts = synthetic_texts(queries, seed=-size)
+            query_embeddings = create_embeddings(query_texts, None)
+            start = time.perf_counter()
+            retrieve_relevant_memories(db, query_embeddings[0], top_k, query_text=query_texts[0])
+            cold_ms = (time.perf_counter() - start) * 1000
+            _, latencies = time_queries(
+                lambda i: retrieve_relevant_memories(db, query_embeddings[i], top_k, query_text=query_texts[i]),
+                range(len(query_texts)),
+            )
+
+            start = time.perf_counter()
+            store_memory(db, query_texts[0], create_embedding(query_texts[0], None), 8)
+            store_ms = (time.perf_counter() - start) * 1000
+
+            print(f"\n{size:>9,} memories")
+            print(f"  embed     {len(texts) / embed_seconds:10,.0f} texts/s")
+            print(f"  insert    {len(texts) / insert_seconds:10,.0f} rows/s")
+            print(f"  retrieve  cold {cold_ms:8.2f} ms  warm {format_latency(latencies)}")
+            print(f"  store     {store_ms:8.2f} ms")
+            print(f"  resident  {resident_report()}")
+            stored += 1
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    index_parser = subparsers.add_parser("index", help="ANN index recall and latency against brute force")
+    index_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    index_parser.add_argument("--dim", type=int, default=1536)
+    index_parser.add_argument("--queries", type=int, default=100)
+    index_parser.add_argument("--top-k", type=int, default=5)
+    index_parser.add_argument("--nprobe", type=int, default=16)
+
+    shortlist_parser = subparsers.add_parser(
+        "shortlist", help="int8 and prefix backends: memory and recall against float32"
+    )
+    shortlist_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    shortlist_parser.add_argument("--dim", type=int, default=1536)
+    shortlist_parser.add_argument("--queries", type=int, default=100)
+    shortlist_parser.add_argument("--top-k", type=int, default=5)
+    shortlist_parser.add_argument("--prefix-dimensions", type=int, default=256)
+    shortlist_parser.add_argument(
+        "--front-load", type=float, default=64,
+        help="Concentrate signal in the leading dimensions like a Matryoshka model; 0 for isotropic data",
+    )
+    shortlist_parser.add_argument(
+        "--rerank", type=int, nargs="+", default=[1, 4, 10],
+        help="Shortlist sizes as multiples of top-k; 1 is the compact encoding alone without re-ranking",
+    )
+
+    store_parser = subparsers.add_parser("store", help="Embed, insert and retrieve through the memory engines")
+    store_parser.add_argument("--db", required=True, help="Scratch SQLite database, grown in place across sizes")
+    store_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    store_parser.add_argument("--queries", type=int, default=50)
+    store_parser.add_argument("--top-k", type=int, default=5)
+    store_parser.add_argument("--provider", default="hashing")
+    store_parser.add_argument("--index", default="ivf", help="Memory index backend (flat, ivf, int8, prefix)")
+    store_parser.add_argument("--hybrid", default="1", help="0 to search by vector only, so queries hit the index")
+
+    args = parser.parse_args()
+    if args.benchmark == "index":
+        benchmark_index(args.sizes, args.dim, args.queries, args.top_k, args.nprobe)
+    elif args.benchmark == "shortlist":
+        benchmark_shortlist(
+            args.sizes, args.dim, args.queries, args.top_k, args.rerank, args.prefix_dimensions, args.front_load
+        )
+    elif args.benchmark == "store":
+        # The engines read their configuration at import time
+        os.environ["SQLITE_DB_PATH"] = args.db
+        os.environ["EMBEDDING_PROVIDER"] = args.provider
+        os.environ["MEMORY_INDEX"] = args.index
+        os.environ["MEMORY_HYBRID"] = args.hybrid
+        benchmark_store(args.sizes, args.queries, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
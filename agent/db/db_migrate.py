@@ -0,0 +1,109 @@
+import json
+import numpy as np
+from sqlalchemy import text
+from db.db_setup import engine, create_database
+from engines.embedding_store import encode_embedding, decode_embedding
+
+BATCH_SIZE = 500
+
+
+# Columns added to existing tables after the database was first created
+ADDED_COLUMNS = {
+    "long_term_memories": {
+        "embedding_norm": "FLOAT",
+        "embedding_codes": "BLOB",
+        "embedding_prefix": "BLOB",
+        "member_count": "INTEGER NOT NULL DEFAULT 1",
+    },
+    "memory_state": {
+        "consolidated_id": "INTEGER NOT NULL DEFAULT 0",
+    },
+}
+
+
+def add_missing_columns():
+    """Add columns introduced after the database was first created."""
+    with engine.begin() as conn:
+        for table, added in ADDED_COLUMNS.items():
+            columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+            for column, column_type in added.items():
+                if column not in columns:
+                    conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def migrate_embeddings_to_blob() -> int:
+    """
+    Convert long term memory embeddings stored as stringified lists into packed
+    float32 blobs with a precomputed norm. Rows are rewritten in place in batches.
+
+    Returns:
+        int: Number of rows converted
+    """
+    converted = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text(
+                    "SELECT id, embedding FROM long_term_memories "
+                    "WHERE typeof(embedding) = 'text' LIMIT :limit"
+                ),
+                {"limit": BATCH_SIZE},
+            ).fetchall()
+            if not rows:
+                break
+            updates = []
+            for memory_id, embedding in rows:
+                embedding_blob, embedding_norm = encode_embedding(json.loads(embedding))
+                updates.append({"id": memory_id, "embedding": embedding_blob, "norm": embedding_norm})
+            conn.execute(
+                text("UPDATE long_term_memories SET embedding = :embedding, embedding_norm = :norm WHERE id = :id"),
+                updates,
+            )
+            converted += len(updates)
+
+    # Blobs written without a norm (e.g. by an older writer) only need the norm filled in
+    with engine.begin() as conn:
+        rows = conn.execute(
+            text("SELECT id, embedding FROM long_term_memories WHERE embedding_norm IS NULL")
+        ).fetchall()
+        if rows:
+            conn.execute(
+                text("UPDATE long_term_memories SET embedding_norm = :norm WHERE id = :id"),
+                [
+                    {"id": memory_id, "norm": float(np.linalg.norm(decode_embedding(embedding)))}
+                    for memory_id, embedding in rows
+                ],
+            )
+    return converted
+
+
+def populate_fts_index() -> bool:
+    """
+    Index memories written before the full-text table and its triggers existed.
+
+    Returns:
+        bool: True if the index had to be rebuilt
+    """
+    with engine.begin() as conn:
+        indexed = conn.exec_driver_sql("SELECT count(*) FROM long_term_memories_fts_docsize").scalar()
+        stored = conn.exec_driver_sql("SELECT count(*) FROM long_term_memories").scalar()
+        if indexed == stored:
+            return False
+        conn.exec_driver_sql("INSERT INTO long_term_memories_fts (long_term_memories_fts) VALUES ('rebuild')")
+        return True
+
+
+def migrate_database():
+    """Bring an existing database up to the current schema."""
+    create_database()
+    add_missing_columns()
+    converted = migrate_embeddings_to_blob()
+    if converted:
+        print(f"Converted {converted} long term memory embeddings to float32 blobs.")
+    if populate_fts_index():
+        print("Rebuilt the long term memory full-text index.")
+
+
+if __name__ == "__main__":
+    migrate_database()
+    print("Database migrated successfully.")
@@ -6,8 +6,9 @@ import requests
 from sqlalchemy.orm import Session
 from models import User, Post, Comment, Like, LongTermMemory
 from db.db_setup import SessionLocal, engine
-from openai import OpenAI
 from dotenv import load_dotenv
+from engines.embedding_store import encode_embedding
+from engines.long_term_mem import create_embeddings
 
 load_dotenv()
 
@@ -30,14 +31,14 @@ def load_example_content(filename="examples.txt"):
         print("Looking for file in:", current_dir)
         raise
 
-def create_embedding(text):
-    """Create embedding using OpenAI API."""
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-    response = client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    return response.data[0].embedding
+EXAMPLE_FILES = ["examples.txt", "examples2.txt"]
+
+def load_all_examples():
+    """Load the examples from every example file, dropping duplicates."""
+    examples = []
+    for filename in EXAMPLE_FILES:
+        examples.extend(load_example_content(filename))
+    return list(dict.fromkeys(examples))
 
 def seed_database():
     db = SessionLocal()
@@ -99,16 +100,18 @@ def seed_database():
             db.add(like)
     db.commit()
 
-    # Create long-term memories using remaining examples
+    # Create long-term memories using remaining examples, embedded in one request
     if remaining_examples:
         num_memories = min(3, len(remaining_examples))
         memory_examples = random.sample(remaining_examples, num_memories)
+        embeddings = create_embeddings(memory_examples, os.getenv('OPENAI_API_KEY'))
         
-        for content in memory_examples:
-            embedding = create_embedding(content)
+        for content, embedding in zip(memory_examples, embeddings):
+            embedding_blob, embedding_norm = encode_embedding(embedding)
             memory = LongTermMemory(
                 content=content,
-                embedding=str(embedding),
+                embedding=embedding_blob,
+                embedding_norm=embedding_norm,
                 significance_score=random.uniform(7.0, 10.0)
             )
             db.add(memory)
@@ -15,9 +15,83 @@ engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread
 # Create SessionLocal
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Changes kept in memory_changes for caches that are catching up
+MEMORY_CHANGE_LOG_ROWS = 100000
+
+# SQLite objects that are not expressed as SQLAlchemy models. Every statement is
+# idempotent so it can be re-applied to existing databases by db_migrate.
+SQLITE_DDL = [
+    # Generation counter bumped by every write to long_term_memories, used by
+    # in-process caches to detect writes made by other code paths or processes,
+    # and the highest memory id the consolidation job has already processed
+    """CREATE TABLE IF NOT EXISTS memory_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        generation INTEGER NOT NULL DEFAULT 0,
+        consolidated_id INTEGER NOT NULL DEFAULT 0
+    )""",
+    "INSERT OR IGNORE INTO memory_state (id, generation) VALUES (1, 0)",
+    # Which memory every generation changed, so caches can apply updates and deletes to just those rows. Only the
+    # last MEMORY_CHANGE_LOG_ROWS changes are kept; a cache that fell further behind reloads everything
+    """CREATE TABLE IF NOT EXISTS memory_changes (
+        generation INTEGER PRIMARY KEY,
+        memory_id INTEGER NOT NULL
+    )""",
+    # Superseded by the long_term_memories_change_* triggers, which bump the generation and log the change
+    "DROP TRIGGER IF EXISTS long_term_memories_generation_insert",
+    "DROP TRIGGER IF EXISTS long_term_memories_generation_update",
+    "DROP TRIGGER IF EXISTS long_term_memories_generation_delete",
+    f"""CREATE TRIGGER IF NOT EXISTS long_term_memories_change_insert
+    AFTER INSERT ON long_term_memories BEGIN
+        UPDATE memory_state SET generation = generation + 1 WHERE id = 1;
+        INSERT OR REPLACE INTO memory_changes (generation, memory_id)
+        SELECT generation, new.id FROM memory_state WHERE id = 1;
+        DELETE FROM memory_changes
+        WHERE generation <= (SELECT generation FROM memory_state WHERE id = 1) - {MEMORY_CHANGE_LOG_ROWS};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS long_term_memories_change_update
+    AFTER UPDATE ON long_term_memories BEGIN
+        UPDATE memory_state SET generation = generation + 1 WHERE id = 1;
+        INSERT OR REPLACE INTO memory_changes (generation, memory_id)
+        SELECT generation, new.id FROM memory_state WHERE id = 1;
+        DELETE FROM memory_changes
+        WHERE generation <= (SELECT generation FROM memory_state WHERE id = 1) - {MEMORY_CHANGE_LOG_ROWS};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS long_term_memories_change_delete
+    AFTER DELETE ON long_term_memories BEGIN
+        UPDATE memory_state SET generation = generation + 1 WHERE id = 1;
+        INSERT OR REPLACE INTO memory_changes (generation, memory_id)
+        SELECT generation, old.id FROM memory_state WHERE id = 1;
+        DELETE FROM memory_changes
+        WHERE generation <= (SELECT generation FROM memory_state WHERE id = 1) - {MEMORY_CHANGE_LOG_ROWS};
+    END""",
+    # Full-text index over long term memory content for lexical (BM25) retrieval. It is an
+    # external content table, the text itself is only stored once in long_term_memories
+    """CREATE VIRTUAL TABLE IF NOT EXISTS long_term_memories_fts USING fts5(
+        content, content='long_term_memories', content_rowid='id'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS long_term_memories_fts_insert
+    AFTER INSERT ON long_term_memories BEGIN
+        INSERT INTO long_term_memories_fts (rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS long_term_memories_fts_delete
+    AFTER DELETE ON long_term_memories BEGIN
+        INSERT INTO long_term_memories_fts (long_term_memories_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS long_term_memories_fts_update
+    AFTER UPDATE OF content ON long_term_memories BEGIN
+        INSERT INTO long_term_memories_fts (long_term_memories_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+        INSERT INTO long_term_memories_fts (rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
 def create_database():
     """Create all tables in the database."""
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for statement in SQLITE_DDL:
+            conn.exec_driver_sql(statement)
 
 def get_db():
     """Dependency to get DB session."""
@@ -0,0 +1,245 @@
+# Database Snapshots
+# Objective: Bootstrap a new agent from an existing one without any embedding calls. A snapshot is a single .npz
+# file (no pickled objects) holding long_term_memories column by column, with all embeddings in one float32 matrix,
+# plus the most recent posts:
+#
+#   python -m db.db_snapshot export snapshot.npz --posts 1000
+#   SQLITE_DB_PATH=./data/new.db python -m db.db_snapshot import snapshot.npz
+#
+# Import bulk-loads into an empty database, where the full-text index fills through its triggers, and then builds
+# the configured memory index (MEMORY_INDEX).
+
+import argparse
+import json
+import time
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from sqlalchemy.orm import Session
+from models import LongTermMemory, Post
+from db.db_setup import SessionLocal, create_database, engine
+from engines.embedding_provider import get_embedding_provider
+from engines.embedding_store import EMBEDDING_DTYPE, decode_embedding_matrix
+
+SNAPSHOT_FORMAT = 1
+EXPORT_CHUNK_SIZE = 20000
+IMPORT_CHUNK_SIZE = 5000
+DEFAULT_POST_COUNT = 1000
+
+
+def pack_strings(values: Sequence[Optional[str]]) -> Dict[str, np.ndarray]:
+    """
+    Pack strings into one utf-8 byte array with offsets, so no object arrays are needed.
+    None is kept apart from the empty string through a mask.
+    """
+    encoded = [(value or "").encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return {
+        "data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "offsets": offsets,
+        "null": np.array([value is None for value in values], dtype=bool),
+    }
+
+
+def unpack_strings(data: np.ndarray, offsets: np.ndarray, null: np.ndarray) -> List[Optional[str]]:
+    raw = data.tobytes()
+    return [
+        None if is_null else raw[start:end].decode("utf-8")
+        for start, end, is_null in zip(offsets[:-1].tolist(), offsets[1:].tolist(), null.tolist())
+    ]
+
+
+def string_columns(prefix: str, values: Sequence[Optional[str]]) -> Dict[str, np.ndarray]:
+    return {f"{prefix}_{part}": array for part, array in pack_strings(values).items()}
+
+
+def read_string_column(snapshot, prefix: str) -> List[Optional[str]]:
+    return unpack_strings(snapshot[f"{prefix}_data"], snapshot[f"{prefix}_offsets"], snapshot[f"{prefix}_null"])
+
+
+def export_snapshot(db: Session, path: str, post_count: int = DEFAULT_POST_COUNT) -> Dict[str, int]:
+    """
+    Write long term memories and the most recent posts to a columnar snapshot.
+
+    Args:
+        db (Session): Database session
+        path (str): Destination .npz file
+        post_count (int): Number of most recent posts to include
+
+    Returns:
+        Dict[str, int]: Number of memories and posts written
+    """
+    memory_columns = (
+        "id", "content", "embedding", "embedding_norm", "significance_score", "member_count", "created_at"
+    )
+    chunks: Dict[str, list] = {column: [] for column in memory_columns}
+    last_id = 0
+    with engine.connect() as conn:
+        while True:
+            # created_at is read as stored text so it round-trips exactly
+            rows = conn.exec_driver_sql(
+                f"SELECT {', '.join(memory_columns)} FROM long_term_memories WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, EXPORT_CHUNK_SIZE),
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            for column, values in zip(memory_columns, zip(*rows)):
+                chunks[column].extend(values)
+        posts = conn.exec_driver_sql(
+            "SELECT content, username, type, tweet_id, created_at FROM posts ORDER BY id DESC LIMIT ?",
+            (post_count,),
+        ).fetchall()[::-1]
+        consolidated_id = conn.exec_driver_sql("SELECT consolidated_id FROM memory_state WHERE id = 1").scalar()
+
+    embeddings = decode_embedding_matrix(chunks["embedding"])
+    norms = np.array([np.nan if norm is None else norm for norm in chunks["embedding_norm"]], dtype=np.float64)
+    missing = np.isnan(norms)
+    if missing.any():
+        norms[missing] = np.linalg.norm(embeddings[missing], axis=1)
+    provider = get_embedding_provider()
+    meta = {
+        "format": SNAPSHOT_FORMAT,
+        "embedding_provider": provider.name,
+        "embedding_model": provider.model,
+        "dimensions": int(embeddings.shape[1]) if len(embeddings) else 0,
+        "consolidated_id": int(consolidated_id or 0),
+    }
+    post_columns = list(zip(*posts)) if posts else [[] for _ in range(5)]
+
+    with open(path, "wb") as f:
+        np.savez(
+            f,
+            meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+            memory_ids=np.array(chunks["id"], dtype=np.int64),
+            memory_embeddings=embeddings.astype(EMBEDDING_DTYPE, copy=False),
+            memory_norms=norms,
+            memory_significance=np.array(chunks["significance_score"], dtype=np.float64),
+            memory_member_count=np.array([count or 1 for count in chunks["member_count"]], dtype=np.int32),
+            **string_columns("memory_content", chunks["content"]),
+            **string_columns("memory_created_at", chunks["created_at"]),
+            **string_columns("post_content", post_columns[0]),
+            **string_columns("post_username", post_columns[1]),
+            **string_columns("post_type", post_columns[2]),
+            **string_columns("post_tweet_id", [None if value is None else str(value) for value in post_columns[3]]),
+            **string_columns("post_created_at", post_columns[4]),
+        )
+    return {"memories": len(chunks["id"]), "posts": len(posts)}
+
+
+def import_snapshot(db: Session, path: str) -> Dict[str, int]:
+    """
+    Bulk-load a snapshot into an empty database and build the memory index.
+
+    Args:
+        db (Session): Database session
+        path (str): Snapshot .npz file
+
+    Returns:
+        Dict[str, int]: Number of memories and posts loaded
+    """
+    from engines.memory_index import get_memory_index
+
+    create_database()
+    if db.query(LongTermMemory.id).first() is not None or db.query(Post.id).first() is not None:
+        raise ValueError("Snapshots can only be imported into a database without memories or posts")
+
+    with np.load(path, allow_pickle=False) as snapshot:
+        meta = json.loads(snapshot["meta"].tobytes().decode("utf-8"))
+        if meta["format"] != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format {meta['format']}")
+        provider = get_embedding_provider()
+        # An empty snapshot records 0 dimensions and fits any provider
+        if meta["dimensions"] and meta["dimensions"] != provider.dimensions:
+            raise ValueError(
+                f"Snapshot embeddings have {meta['dimensions']} dimensions, "
+                f"but EMBEDDING_PROVIDER {provider.name} produces {provider.dimensions}"
+            )
+        if meta["embedding_model"] != provider.model:
+            print(
+                f"Warning: snapshot embeddings come from {meta['embedding_model']}, "
+                f"but EMBEDDING_PROVIDER uses {provider.model}"
+            )
+
+        ids = snapshot["memory_ids"].tolist()
+        embeddings = snapshot["memory_embeddings"]
+        norms = snapshot["memory_norms"].tolist()
+        significance = snapshot["memory_significance"].tolist()
+        member_count = snapshot["memory_member_count"].tolist()
+        content = read_string_column(snapshot, "memory_content")
+        created_at = read_string_column(snapshot, "memory_created_at")
+        posts = list(zip(*(
+            read_string_column(snapshot, f"post_{column}")
+            for column in ("content", "username", "type", "tweet_id", "created_at")
+        )))
+
+    with engine.begin() as conn:
+        for start in range(0, len(ids), IMPORT_CHUNK_SIZE):
+            end = start + IMPORT_CHUNK_SIZE
+            conn.exec_driver_sql(
+                "INSERT INTO long_term_memories "
+                "(id, content, embedding, embedding_norm, significance_score, member_count, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, coalesce(?, CURRENT_TIMESTAMP))",
+                [
+                    (memory_id, memory_content, row.tobytes(), norm, score, count, created)
+                    for memory_id, memory_content, row, norm, score, count, created in zip(
+                        ids[start:end], content[start:end], embeddings[start:end],
+                        norms[start:end], significance[start:end], member_count[start:end], created_at[start:end],
+                    )
+                ],
+            )
+        conn.exec_driver_sql(
+            "UPDATE memory_state SET consolidated_id = ? WHERE id = 1", (meta.get("consolidated_id", 0),)
+        )
+
+        if posts:
+            usernames = sorted({username for _, username, _, _, _ in posts if username})
+            if usernames:
+                conn.exec_driver_sql(
+                    "INSERT OR IGNORE INTO users (username, email) VALUES (?, ?)",
+                    [(username, f"{username}@example.com") for username in usernames],
+                )
+            user_ids = dict(conn.exec_driver_sql("SELECT username, id FROM users").fetchall())
+            conn.exec_driver_sql(
+                "INSERT INTO posts (content, user_id, username, type, tweet_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, coalesce(?, CURRENT_TIMESTAMP))",
+                [
+                    (post_content, user_ids.get(username), username, post_type or "text", tweet_id, created)
+                    for post_content, username, post_type, tweet_id, created in posts
+                ],
+            )
+
+    db.expire_all()
+    get_memory_index().rebuild(db)
+    return {"memories": len(ids), "posts": len(posts)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import columnar snapshots of agent memory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write memories and recent posts to a snapshot")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--posts", type=int, default=DEFAULT_POST_COUNT, help="Most recent posts to include")
+    import_parser = subparsers.add_parser("import", help="Load a snapshot into an empty database")
+    import_parser.add_argument("path")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        if args.command == "export":
+            counts = export_snapshot(db, args.path, args.posts)
+            action = "Exported"
+        else:
+            counts = import_snapshot(db, args.path)
+            action = "Imported"
+        print(
+            f"{action} {counts['memories']} memories and {counts['posts']} posts "
+            f"in {time.perf_counter() - start:.1f}s ({args.path})"
+        )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
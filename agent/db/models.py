@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
@@ -71,7 +71,11 @@ class LongTermMemory(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     content = Column(String, nullable=False)
-    embedding = Column(String, nullable=False)  # Store as JSON string
+    embedding = Column(LargeBinary, nullable=False)  # Packed little-endian float32
+    embedding_norm = Column(Float)  # L2 norm of the embedding, precomputed for cosine scoring
+    embedding_codes = Column(LargeBinary)  # int8 codes of the normalised embedding, see engines/quantization.py
+    embedding_prefix = Column(LargeBinary)  # Renormalised leading dimensions of the embedding, float32
+    member_count = Column(Integer, nullable=False, default=1, server_default="1")  # Memories merged into this one, itself included
     significance_score = Column(Float, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -84,6 +88,47 @@ class ShortTermMemory(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     # Add any other fields you might need for short-term memory
 
+class EmbeddingCacheEntry(Base):
+    __tablename__ = "embedding_cache"
+
+    model = Column(String, primary_key=True)
+    dimensions = Column(Integer, primary_key=True)  # 0 for the model's default dimensions
+    text_hash = Column(String, primary_key=True)  # sha256 hex digest of the embedded text
+    embedding = Column(LargeBinary, nullable=False)  # Packed little-endian float32
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class EmbeddingCodebook(Base):
+    __tablename__ = "embedding_codebooks"
+
+    name = Column(String, primary_key=True)
+    dimensions = Column(Integer, nullable=False)
+    params = Column(LargeBinary, nullable=False)  # Packed float32 quantizer parameters
+    trained_rows = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class LLMResponseCacheEntry(Base):
+    __tablename__ = "llm_response_cache"
+
+    cache_key = Column(String, primary_key=True)  # sha256 hex digest of provider, endpoint, model, params and prompt
+    provider = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    response = Column(Text, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class SignificanceLabel(Base):
+    __tablename__ = "significance_labels"
+
+    text_hash = Column(String, primary_key=True)  # sha256 hex digest of the scored text
+    content = Column(Text, nullable=False)
+    llm_score = Column(Float, nullable=False)
+    local_score = Column(Float)  # Pre-scorer prediction when the text was scored, NULL before it was trained
+    band = Column(String)  # low, middle or high: where the prediction fell, NULL before the pre-scorer was trained
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
 class TweetPost(Base):
     __tablename__ = "tweet_posts"
 
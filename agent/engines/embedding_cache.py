@@ -0,0 +1,140 @@
+# Embedding Cache
+# Objective: Never pay twice for the same embedding. Embeddings are cached in SQLite keyed by
+# (model, dimensions, sha256(text)), evicted least-recently-used once the table grows past
+# EMBEDDING_CACHE_MAX_ENTRIES, and hit/miss counters are kept for the life of the process.
+
+import hashlib
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+from sqlalchemy import func, text, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from models import EmbeddingCacheEntry
+from db.db_setup import SessionLocal
+from engines.embedding_store import decode_embedding, encode_embedding
+
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+# Stay well below SQLite's bound parameter limit (three parameters per key)
+LOOKUP_BATCH_SIZE = 300
+
+
+def text_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed embedding cache shared by every embedding call site."""
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES, session_factory=SessionLocal):
+        self.max_entries = max_entries
+        self.session_factory = session_factory
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model: str, dimensions: Optional[int], texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """
+        Look up cached embeddings.
+
+        Args:
+            model (str): Embedding model name
+            dimensions (Optional[int]): Requested dimensions, None for the model default
+            texts (Sequence[str]): Texts to look up
+
+        Returns:
+            List[Optional[List[float]]]: Embedding per text, None where it is not cached
+        """
+        dims = dimensions or 0
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[str, bytes] = {}
+        try:
+            with self.session_factory() as db:
+                unique_hashes = list(dict.fromkeys(hashes))
+                for start in range(0, len(unique_hashes), LOOKUP_BATCH_SIZE):
+                    batch = unique_hashes[start:start + LOOKUP_BATCH_SIZE]
+                    rows = db.query(EmbeddingCacheEntry.text_hash, EmbeddingCacheEntry.embedding).filter(
+                        EmbeddingCacheEntry.model == model,
+                        EmbeddingCacheEntry.dimensions == dims,
+                        EmbeddingCacheEntry.text_hash.in_(batch),
+                    )
+                    found.update({row.text_hash: row.embedding for row in rows})
+                if found:
+                    keys = [(model, dims, h) for h in found]
+                    for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                        db.query(EmbeddingCacheEntry).filter(
+                            tuple_(
+                                EmbeddingCacheEntry.model,
+                                EmbeddingCacheEntry.dimensions,
+                                EmbeddingCacheEntry.text_hash,
+                            ).in_(keys[start:start + LOOKUP_BATCH_SIZE])
+                        ).update(
+                            {
+                                EmbeddingCacheEntry.hits: EmbeddingCacheEntry.hits + 1,
+                                EmbeddingCacheEntry.last_used_at: datetime.now(timezone.utc),
+                            },
+                            synchronize_session=False,
+                        )
+                    db.commit()
+        except SQLAlchemyError as e:
+            print(f"Embedding cache lookup failed: {e}")
+
+        results = [decode_embedding(found[h]).tolist() if h in found else None for h in hashes]
+        hit_count = sum(result is not None for result in results)
+        self.hits += hit_count
+        self.misses += len(results) - hit_count
+        return results
+
+    def get(self, model: str, dimensions: Optional[int], content: str) -> Optional[List[float]]:
+        return self.get_many(model, dimensions, [content])[0]
+
+    def put_many(self, model: str, dimensions: Optional[int], texts: Sequence[str], embeddings: Sequence[Sequence[float]]):
+        """Store embeddings for the given texts and evict the least recently used entries over the limit."""
+        dims = dimensions or 0
+        entries = {}
+        for content, embedding in zip(texts, embeddings):
+            entries[text_hash(content)] = encode_embedding(embedding)[0]
+        if not entries:
+            return
+        try:
+            with self.session_factory() as db:
+                now = datetime.now(timezone.utc)
+                for h, blob in entries.items():
+                    db.merge(EmbeddingCacheEntry(
+                        model=model, dimensions=dims, text_hash=h, embedding=blob, hits=0, last_used_at=now
+                    ))
+                db.commit()
+                self._evict(db)
+        except SQLAlchemyError as e:
+            print(f"Embedding cache write failed: {e}")
+
+    def put(self, model: str, dimensions: Optional[int], content: str, embedding: Sequence[float]):
+        self.put_many(model, dimensions, [content], [embedding])
+
+    def _evict(self, db):
+        count = db.query(func.count()).select_from(EmbeddingCacheEntry).scalar()
+        excess = count - self.max_entries
+        if excess > 0:
+            db.execute(
+                text(
+                    "DELETE FROM embedding_cache WHERE rowid IN "
+                    "(SELECT rowid FROM embedding_cache ORDER BY last_used_at ASC, rowid ASC LIMIT :excess)"
+                ),
+                {"excess": excess},
+            )
+            db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters for this process."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_cache = EmbeddingCache()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide embedding cache."""
+    return _cache
@@ -0,0 +1,121 @@
+# Embedding Provider
+# Objective: One interface for turning text into embedding vectors, so the memory subsystem can run against
+# OpenAI in production and against a local deterministic backend for tests and benchmarks with no network.
+
+# EMBEDDING_PROVIDER selects the backend:
+#   openai  - text-embedding-3-small over the OpenAI API (default)
+#   hashing - signed feature hashing of word, word-bigram and character n-grams into the same 1536 dimensions.
+#             Deterministic across processes and machines, similar texts get similar vectors, zero cost.
+
+import os
+import re
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from openai import OpenAI
+from engines.rate_limiter import get_rate_limiter
+from engines.resilience import call_with_retries
+from engines.token_count import estimate_total_tokens
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_DIMENSIONS = 1536
+
+TOKEN_PATTERN = re.compile(r"[@$#]?\w+")
+
+
+@lru_cache(maxsize=None)
+def get_openai_client(openai_api_key: str) -> OpenAI:
+    """Reuse one OpenAI client (and its connection pool) per API key. Retries are left to engines/resilience.py."""
+    return OpenAI(api_key=openai_api_key, max_retries=0)
+
+
+class OpenAIEmbeddingProvider:
+    """OpenAI embeddings API."""
+
+    name = "openai"
+    model = "text-embedding-3-small"
+    dimensions = EMBEDDING_DIMENSIONS
+    cacheable = True
+    # OpenAI accepts up to 2048 inputs and 300k tokens per embeddings request
+    max_batch_items = 2048
+    max_batch_tokens = 250_000
+
+    def embed_batch(self, texts: List[str], api_key: Optional[str]) -> List[Sequence[float]]:
+        """Embed one request's worth of texts, returned in input order."""
+        def create_embeddings():
+            # The raw response carries the x-ratelimit-* headers the rate limiter learns from
+            raw = get_openai_client(api_key).embeddings.with_raw_response.create(input=texts, model=self.model)
+            get_rate_limiter().observe_headers("openai", "/embeddings", raw.headers)
+            return raw.parse()
+
+        response = call_with_retries(
+            "openai", create_embeddings, endpoint="/embeddings", tokens=estimate_total_tokens(texts)
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+class HashingEmbeddingProvider:
+    """Local deterministic embeddings from hashed n-gram features."""
+
+    name = "hashing"
+    model = "hashing-ngram-v1"
+    dimensions = EMBEDDING_DIMENSIONS
+    # Computing the vector is cheaper than looking it up
+    cacheable = False
+    max_batch_items = 4096
+    max_batch_tokens = 10 ** 9
+
+    WORD_WEIGHT = 1.0
+    BIGRAM_WEIGHT = 0.5
+    CHAR_NGRAM_WEIGHT = 0.25
+    CHAR_NGRAM_SIZES = (3, 4)
+
+    def features(self, text: str) -> Dict[str, float]:
+        words = TOKEN_PATTERN.findall(text.lower())
+        features: Dict[str, float] = {}
+        for word in words:
+            features[f"w:{word}"] = features.get(f"w:{word}", 0.0) + self.WORD_WEIGHT
+            padded = f"<{word}>"
+            for size in self.CHAR_NGRAM_SIZES:
+                for start in range(len(padded) - size + 1):
+                    key = f"c:{padded[start:start + size]}"
+                    features[key] = features.get(key, 0.0) + self.CHAR_NGRAM_WEIGHT
+        for first, second in zip(words, words[1:]):
+            key = f"b:{first} {second}"
+            features[key] = features.get(key, 0.0) + self.BIGRAM_WEIGHT
+        return features
+
+    def embed_text(self, text: str) -> np.ndarray:
+        features = self.features(text)
+        if not features:
+            return np.zeros(self.dimensions, dtype=np.float32)
+        hashes = np.fromiter(
+            (zlib.crc32(key.encode("utf-8")) for key in features), dtype=np.uint32, count=len(features)
+        )
+        # The top bit picks the sign so colliding features tend to cancel instead of pile up
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        weights = signs * np.fromiter(features.values(), dtype=np.float64, count=len(features))
+        vector = np.bincount(hashes % self.dimensions, weights=weights, minlength=self.dimensions)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).astype(np.float32)
+
+    def embed_batch(self, texts: List[str], api_key: Optional[str] = None) -> List[Sequence[float]]:
+        return [self.embed_text(text) for text in texts]
+
+
+EMBEDDING_PROVIDERS = {
+    OpenAIEmbeddingProvider.name: OpenAIEmbeddingProvider,
+    HashingEmbeddingProvider.name: HashingEmbeddingProvider,
+}
+
+_providers: Dict[str, object] = {}
+
+
+def get_embedding_provider(name: str = EMBEDDING_PROVIDER):
+    """Process-wide instance of the configured embedding provider."""
+    if name not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"Unknown embedding provider '{name}', expected one of {sorted(EMBEDDING_PROVIDERS)}")
+    if name not in _providers:
+        _providers[name] = EMBEDDING_PROVIDERS[name]()
+    return _providers[name]
@@ -0,0 +1,231 @@
+# Embedding Store
+# Objective: Binary storage format for long term memory embeddings and the vectorized similarity search on top of it.
+# Embeddings are stored as packed little-endian float32 blobs together with their precomputed L2 norm, so a whole
+# table can be decoded into a single matrix without parsing and scored with one matrix-vector product.
+
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+from models import LongTermMemory
+
+EMBEDDING_DTYPE = np.dtype("<f4")
+# Stay well below SQLite's bound parameter limit when filtering by id
+ID_BATCH_SIZE = 900
+
+
+class MemoryMatrix(NamedTuple):
+    ids: np.ndarray            # (n,) int64 memory ids
+    embeddings: np.ndarray     # (n, d) float32
+    norms: np.ndarray          # (n,) float32
+    significance: np.ndarray   # (n,) float32
+
+
+def encode_embedding(embedding: Sequence[float]) -> Tuple[bytes, float]:
+    """
+    Pack an embedding into a float32 blob and compute its L2 norm.
+
+    Args:
+        embedding (Sequence[float]): Embedding vector
+
+    Returns:
+        Tuple[bytes, float]: Packed blob and L2 norm
+    """
+    vector = np.asarray(embedding, dtype=EMBEDDING_DTYPE)
+    return vector.tobytes(), float(np.linalg.norm(vector))
+
+
+def decode_embedding(blob: bytes) -> np.ndarray:
+    """Decode a single float32 blob into a read-only vector without copying."""
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE)
+
+
+def decode_embedding_matrix(blobs: List[bytes]) -> np.ndarray:
+    """
+    Decode a list of equally sized float32 blobs into one (n, d) matrix.
+
+    The blobs are concatenated once and viewed with np.frombuffer, so there is a
+    single copy regardless of the number of rows.
+    """
+    if not blobs:
+        return np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+    return np.frombuffer(b"".join(blobs), dtype=EMBEDDING_DTYPE).reshape(len(blobs), -1)
+
+
+def empty_memory_matrix() -> MemoryMatrix:
+    return MemoryMatrix(
+        ids=np.empty(0, dtype=np.int64),
+        embeddings=np.empty((0, 0), dtype=EMBEDDING_DTYPE),
+        norms=np.empty(0, dtype=np.float32),
+        significance=np.empty(0, dtype=np.float32),
+    )
+
+
+def select_memory_rows(matrix: MemoryMatrix, ids: Sequence[int]) -> MemoryMatrix:
+    """Rows of an id-sorted matrix for the given memory ids, skipping ids it does not contain."""
+    ids = np.unique(np.asarray(ids, dtype=np.int64))
+    if len(matrix.ids) == 0 or len(ids) == 0:
+        return empty_memory_matrix()
+    positions = np.searchsorted(matrix.ids, ids)
+    found = positions < len(matrix.ids)
+    found[found] = matrix.ids[positions[found]] == ids[found]
+    rows = positions[found]
+    return MemoryMatrix(
+        ids=np.asarray(matrix.ids[rows]),
+        embeddings=np.asarray(matrix.embeddings[rows]),
+        norms=np.asarray(matrix.norms[rows]),
+        significance=np.asarray(matrix.significance[rows]),
+    )
+
+
+def load_memory_matrix(db: Session, ids: Optional[Sequence[int]] = None) -> MemoryMatrix:
+    """
+    Load long term memory embeddings into a single matrix.
+
+    Args:
+        db (Session): Database session
+        ids (Optional[Sequence[int]]): Restrict the load to these memory ids
+
+    Returns:
+        MemoryMatrix: Ids, embedding matrix, norms and significance scores ordered by id
+    """
+    if ids is not None:
+        id_list = [int(i) for i in ids]
+        if not id_list:
+            return empty_memory_matrix()
+        rows = []
+        for start in range(0, len(id_list), ID_BATCH_SIZE):
+            rows.extend(
+                _memory_query(db)
+                .filter(LongTermMemory.id.in_(id_list[start:start + ID_BATCH_SIZE]))
+                .all()
+            )
+        rows.sort(key=lambda row: row.id)
+    else:
+        rows = _memory_query(db).order_by(LongTermMemory.id).all()
+    return _rows_to_matrix(rows)
+
+
+def iter_memory_matrix_chunks(db: Session, chunk_size: int = 10000, after_id: int = 0) -> Iterator[MemoryMatrix]:
+    """
+    Stream long term memory embeddings in id order, chunk_size rows at a time.
+
+    Args:
+        db (Session): Database session
+        chunk_size (int): Rows per chunk
+        after_id (int): Only yield memories with an id greater than this
+
+    Yields:
+        MemoryMatrix: Consecutive chunks of the table
+    """
+    last_id = after_id
+    while True:
+        rows = (
+            _memory_query(db)
+            .filter(LongTermMemory.id > last_id)
+            .order_by(LongTermMemory.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield _rows_to_matrix(rows)
+
+
+def _memory_query(db: Session):
+    return db.query(
+        LongTermMemory.id,
+        LongTermMemory.embedding,
+        LongTermMemory.embedding_norm,
+        LongTermMemory.significance_score,
+    )
+
+
+def _rows_to_matrix(rows) -> MemoryMatrix:
+    if not rows:
+        return empty_memory_matrix()
+
+    embeddings = decode_embedding_matrix([row.embedding for row in rows])
+    norms = np.array(
+        [row.embedding_norm if row.embedding_norm is not None else np.nan for row in rows],
+        dtype=np.float32,
+    )
+    missing = np.isnan(norms)
+    if missing.any():
+        norms[missing] = np.linalg.norm(embeddings[missing], axis=1)
+
+    return MemoryMatrix(
+        ids=np.array([row.id for row in rows], dtype=np.int64),
+        embeddings=embeddings,
+        norms=norms,
+        significance=np.array([row.significance_score for row in rows], dtype=np.float32),
+    )
+
+
+def cosine_scores(embeddings: np.ndarray, norms: np.ndarray, query: Sequence[float]) -> np.ndarray:
+    """
+    Cosine similarity of every row of the matrix against the query in a single matmul.
+
+    Args:
+        embeddings (np.ndarray): (n, d) embedding matrix
+        norms (np.ndarray): (n,) precomputed row norms
+        query (Sequence[float]): Query embedding
+
+    Returns:
+        np.ndarray: (n,) cosine similarities
+    """
+    query_vector = np.asarray(query, dtype=EMBEDDING_DTYPE)
+    query_norm = float(np.linalg.norm(query_vector))
+    if len(embeddings) == 0 or query_norm == 0.0:
+        return np.zeros(len(embeddings), dtype=np.float32)
+    denominators = np.maximum(norms, np.finfo(np.float32).tiny) * query_norm
+    return (embeddings @ query_vector) / denominators
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Indices of the top_k highest scores, best first, using argpartition instead of a full sort.
+    """
+    k = min(top_k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def memory_table_stats(db: Session) -> Tuple[int, int]:
+    """Row count and highest id of the long term memory table."""
+    count, max_id = db.query(func.count(LongTermMemory.id), func.max(LongTermMemory.id)).one()
+    return int(count or 0), int(max_id or 0)
+
+
+def read_memory_generation(db: Session) -> int:
+    """Current value of the write generation counter maintained by triggers on long_term_memories."""
+    generation = db.execute(text("SELECT generation FROM memory_state WHERE id = 1")).scalar()
+    return int(generation or 0)
+
+
+def read_memory_changes(db: Session, since_generation: int, generation: int) -> Optional[np.ndarray]:
+    """
+    Ids of the memories inserted, updated or deleted after since_generation up to generation.
+
+    Returns:
+        Optional[np.ndarray]: Sorted unique memory ids, None when the change log no longer covers the whole range
+    """
+    if generation < since_generation:
+        return None
+    rows = db.execute(
+        text("SELECT memory_id FROM memory_changes WHERE generation > :since AND generation <= :generation"),
+        {"since": since_generation, "generation": generation},
+    ).fetchall()
+    # Every change bumps the generation by one and logs one row, so anything missing has been pruned
+    if len(rows) != generation - since_generation:
+        return None
+    return np.unique(np.array([row[0] for row in rows], dtype=np.int64))
+
+
+def memory_embedding_dimension(db: Session) -> int:
+    """Dimension of the stored embeddings, 0 when the table is empty."""
+    size = db.execute(text("SELECT length(embedding) FROM long_term_memories LIMIT 1")).scalar()
+    return int(size or 0) // EMBEDDING_DTYPE.itemsize
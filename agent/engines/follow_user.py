@@ -1,20 +1,13 @@
-import requests
+import json
 import re
 from twitter.account import Account
 from twitter.scraper import Scraper
 from models import User
+from engines.resilience import WRITE_RETRY_POLICY, call_with_retries
+from engines.llm_client import LLMError, get_async_llm_client, get_llm_client
 
-def decide_to_follow_users(db, posts, openrouter_api_key: str):
-    """
-    Detects Twitter usernames from a list of posts and decides whether to follow them, assigning a score.
-
-    Parameters:
-    - posts (List): List of posts of any type
-    - openrouter_api_key (str): API key for OpenRouter
-
-    Returns:
-    - str: JSON-formatted string with a list of decisions
-    """
+def follow_decision_prompt(db, posts) -> str:
+    """Record the usernames mentioned in the posts that are new to the database and build the follow prompt."""
     # Convert everything to strings first
     str_posts = [str(post) for post in posts]
 
@@ -26,8 +19,8 @@ def decide_to_follow_users(db, posts, openrouter_api_key: str):
         found_usernames = twitter_pattern.findall(post)
         twitter_usernames.extend(found_usernames)
 
-    # Remove duplicates
-    twitter_usernames = list(set(twitter_usernames))
+    # Remove duplicates, in a stable order so identical posts give an identical (cacheable) prompt
+    twitter_usernames = sorted(set(twitter_usernames))
 
     # Query existing usernames from the database
     existing_usernames = db.query(User.username).filter(User.username.in_(twitter_usernames)).all()
@@ -76,28 +69,66 @@ def decide_to_follow_users(db, posts, openrouter_api_key: str):
     []
     """
 
+    return prompt
+
+
+def parses_as_json(content: str) -> bool:
+    """Only decisions the pipeline can parse are cached, so its re-ask never gets the same bad answer back."""
+    try:
+        json.loads(content)
+    except ValueError:
+        return False
+    return True
+
+
+def decide_to_follow_users(db, posts, openrouter_api_key: str, refresh_cache: bool = False):
+    """
+    Detects Twitter usernames from a list of posts and decides whether to follow them, assigning a score.
+
+    Parameters:
+    - posts (List): List of posts of any type
+    - openrouter_api_key (str): API key for OpenRouter
+    - refresh_cache (bool): Ask the model again instead of reusing a cached decision
+
+    Returns:
+    - str: JSON-formatted string with a list of decisions
+    """
+    prompt = follow_decision_prompt(db, posts)
+
     # Send the prompt to the AI model
-    response = requests.post(
-        url="https://openrouter.ai/api/v1/chat/completions",
-        headers={
-            "Authorization": f"Bearer {openrouter_api_key}",
-        },
-        json={
-            "model": "meta-llama/llama-3.1-70b-instruct",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.7,
-        },
-    )
-
-    if response.status_code == 200:
-        return response.json()["choices"][0]["message"]["content"]
-    else:
-        raise Exception(f"Error generating decision: {response.text}")
+    try:
+        return get_llm_client("openrouter").chat(
+            [{"role": "user", "content": prompt}],
+            openrouter_api_key,
+            cache=True,
+            refresh_cache=refresh_cache,
+            cache_if=parses_as_json,
+            temperature=0.7,
+        )
+    except LLMError as e:
+        raise Exception(f"Error generating decision: {e.text}")
+
+
+async def decide_to_follow_users_async(db, posts, openrouter_api_key: str, refresh_cache: bool = False):
+    """Async counterpart of decide_to_follow_users for the asyncio pipeline."""
+    prompt = follow_decision_prompt(db, posts)
+
+    try:
+        return await get_async_llm_client("openrouter").chat(
+            [{"role": "user", "content": prompt}],
+            openrouter_api_key,
+            cache=True,
+            refresh_cache=refresh_cache,
+            cache_if=parses_as_json,
+            temperature=0.7,
+        )
+    except LLMError as e:
+        raise Exception(f"Error generating decision: {e.text}")
 
 
 def get_user_id(account: Account, username):
     scraper = Scraper(account.session.cookies)
-    users = scraper.users([username])
+    users = call_with_retries("x", scraper.users, [username], endpoint="UserByScreenName")
     if users:
         return users[0].id
     else:
@@ -105,7 +136,7 @@ def get_user_id(account: Account, username):
 
 
 def follow_user(account: Account, user_id):
-    return account.follow(user_id)
+    return call_with_retries("x", account.follow, user_id, policy=WRITE_RETRY_POLICY, endpoint="friendships/create")
 
 
 def follow_by_username(account: Account, username):
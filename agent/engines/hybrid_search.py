@@ -0,0 +1,133 @@
+# Hybrid Search
+# Objective: Make exact handles, tickers and wallet addresses in the short term memory find the long term memories
+# that mention them, which pure embedding similarity often misses. BM25 over the long_term_memories_fts full-text
+# index and cosine similarity are combined with reciprocal rank fusion (RRF).
+
+# On stores of at least HYBRID_PREFILTER_MIN_ROWS memories the lexical stage runs first and the vector stage only
+# scores its HYBRID_LEXICAL_CANDIDATES best matches. Smaller stores, and queries that share too few terms with
+# the store, search both ways independently before fusing.
+
+import os
+import re
+from typing import Dict, List, Sequence
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from engines.memory_index import SearchResult, exact_search, fetch_memories, get_memory_index, memory_count
+
+MEMORY_HYBRID = os.getenv("MEMORY_HYBRID", "1") == "1"
+HYBRID_LEXICAL_CANDIDATES = int(os.getenv("MEMORY_HYBRID_CANDIDATES", "1000"))
+HYBRID_PREFILTER_MIN_ROWS = int(os.getenv("MEMORY_HYBRID_PREFILTER_MIN_ROWS", "50000"))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("MEMORY_HYBRID_LEXICAL_WEIGHT", "1.0"))
+HYBRID_VECTOR_WEIGHT = float(os.getenv("MEMORY_HYBRID_VECTOR_WEIGHT", "1.0"))
+# Rank constant from the original RRF paper, damps the influence of the very first ranks
+RRF_K = 60
+# Each side contributes this many ranked results to the fusion
+FUSION_DEPTH = 50
+MAX_QUERY_TERMS = 32
+
+TERM_PATTERN = re.compile(r"[@$#]?\w+")
+STOPWORDS = frozenset("""
+a about after again all also am an and any are as at be because been before being but by can could did do does
+doing down for from further had has have having he her here hers him his how i if in into is it its itself just
+me more most my no nor not now of off on once only or other our out over own same she should so some such than
+that the their them then there these they this those through to too under until up very was we were what when
+where which while who whom why will with would you your yours im dont its thats
+""".split())
+
+
+def fts_query(query_text: str) -> str:
+    """
+    Turn free text into an FTS5 OR query over its distinctive terms.
+    Handles, tickers, hashtags and tokens with digits (wallet addresses, contract ids) come first so they survive
+    the MAX_QUERY_TERMS cut. Every term is quoted, so FTS5 syntax in the text is never interpreted.
+    """
+    terms = {}
+    for token in TERM_PATTERN.findall(query_text):
+        word = token.lstrip("@$#").lower()
+        if len(word) < 2 or word in STOPWORDS or word in terms:
+            continue
+        terms[word] = token[0] in "@$#" or any(c.isdigit() for c in word)
+    ranked = sorted(terms, key=lambda word: not terms[word])[:MAX_QUERY_TERMS]
+    return " OR ".join(f'"{word}"' for word in ranked)
+
+
+def lexical_search(db: Session, query_text: str, limit: int) -> SearchResult:
+    """
+    BM25 search over long term memory content.
+
+    Args:
+        db (Session): Database session
+        query_text (str): Free text query
+        limit (int): Maximum number of results
+
+    Returns:
+        SearchResult: (memory id, BM25 relevance) pairs best first, higher is better
+    """
+    query = fts_query(query_text)
+    if not query:
+        return []
+    try:
+        rows = db.execute(
+            text(
+                "SELECT rowid, bm25(long_term_memories_fts) AS rank FROM long_term_memories_fts "
+                "WHERE long_term_memories_fts MATCH :query ORDER BY rank LIMIT :limit"
+            ),
+            {"query": query, "limit": limit},
+        ).fetchall()
+    except OperationalError as e:
+        print(f"Full-text search unavailable, using vector search only: {e}")
+        return []
+    # FTS5 reports BM25 negated so that ascending order is best first
+    return [(int(memory_id), -float(rank)) for memory_id, rank in rows]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[SearchResult], weights: Sequence[float], k: int = RRF_K) -> SearchResult:
+    """
+    Fuse ranked result lists by summing weight / (k + rank) per memory.
+
+    Args:
+        rankings (Sequence[SearchResult]): Result lists, each best first
+        weights (Sequence[float]): Weight of each list
+        k (int): RRF rank constant
+
+    Returns:
+        SearchResult: (memory id, fused score) pairs best first
+    """
+    fused: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, (memory_id, _) in enumerate(ranking, start=1):
+            fused[memory_id] = fused.get(memory_id, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def hybrid_search(db: Session, query_text: str, query_embedding: Sequence[float], top_k: int) -> SearchResult:
+    """
+    Lexical and vector retrieval fused with RRF.
+
+    Args:
+        db (Session): Database session
+        query_text (str): Text the query embedding was created from
+        query_embedding (Sequence[float]): Query embedding vector
+        top_k (int): Number of results
+
+    Returns:
+        SearchResult: (memory id, fused score) pairs best first
+    """
+    depth = max(top_k, FUSION_DEPTH)
+    # Both the row count and the candidates' vectors come from the resident memory cache when it fits
+    if memory_count(db) >= HYBRID_PREFILTER_MIN_ROWS:
+        lexical = lexical_search(db, query_text, HYBRID_LEXICAL_CANDIDATES)
+        if len(lexical) >= depth:
+            candidates = fetch_memories(db, np.array([memory_id for memory_id, _ in lexical], dtype=np.int64))
+            vector = exact_search(candidates, query_embedding, depth)
+            return reciprocal_rank_fusion(
+                [lexical[:depth], vector], [HYBRID_LEXICAL_WEIGHT, HYBRID_VECTOR_WEIGHT]
+            )[:top_k]
+        lexical = lexical[:depth]
+    else:
+        lexical = lexical_search(db, query_text, depth)
+
+    vector = get_memory_index().search(db, query_embedding, depth)
+    return reciprocal_rank_fusion([lexical, vector], [HYBRID_LEXICAL_WEIGHT, HYBRID_VECTOR_WEIGHT])[:top_k]
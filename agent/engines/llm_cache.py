@@ -0,0 +1,121 @@
+# LLM Response Cache
+# Objective: Don't pay for the same classification twice. Scoring and decision calls often see byte-identical prompts
+# when the same notifications come back on the next run, so call sites can opt in (cache=True on LLMClient.chat) to
+# answers cached in SQLite keyed by sha256(provider, endpoint, model, sampling params, prompt). Entries expire after
+# LLM_CACHE_TTL seconds and are evicted least-recently-used beyond LLM_CACHE_MAX_ENTRIES. Generative calls such as
+# generate_post, and the wallet decision that sends SOL, never opt in.
+
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from sqlalchemy import func, text
+from sqlalchemy.exc import SQLAlchemyError
+from models import LLMResponseCacheEntry
+from db.db_setup import SessionLocal
+
+LLM_CACHE = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+
+def request_key(provider: str, path: str, payload: Dict) -> str:
+    """Stable hash of everything that determines a response: provider, endpoint, model, params and prompt."""
+    canonical = json.dumps([provider, path, payload], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """SQLite-backed cache of LLM responses for opted-in call sites."""
+
+    def __init__(
+        self,
+        ttl_seconds: float = LLM_CACHE_TTL,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        session_factory=SessionLocal,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.session_factory = session_factory
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Cached response for a request key.
+
+        Args:
+            key (str): Key from request_key()
+
+        Returns:
+            Optional[str]: The cached response, None if it is missing or expired
+        """
+        now = datetime.now(timezone.utc)
+        response = None
+        try:
+            with self.session_factory() as db:
+                entry = db.query(LLMResponseCacheEntry).filter(
+                    LLMResponseCacheEntry.cache_key == key,
+                    LLMResponseCacheEntry.created_at >= now - timedelta(seconds=self.ttl_seconds),
+                ).first()
+                if entry is not None:
+                    response = entry.response
+                    entry.hits += 1
+                    entry.last_used_at = now
+                    db.commit()
+        except SQLAlchemyError as e:
+            print(f"LLM response cache lookup failed: {e}")
+
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def put(self, key: str, provider: str, model: str, response: str):
+        """Store a response, then drop expired entries and the least recently used ones over the limit."""
+        now = datetime.now(timezone.utc)
+        try:
+            with self.session_factory() as db:
+                db.merge(LLMResponseCacheEntry(
+                    cache_key=key, provider=provider, model=model, response=response,
+                    hits=0, created_at=now, last_used_at=now,
+                ))
+                db.commit()
+                self._evict(db, now)
+        except SQLAlchemyError as e:
+            print(f"LLM response cache write failed: {e}")
+
+    def _evict(self, db, now: datetime):
+        db.query(LLMResponseCacheEntry).filter(
+            LLMResponseCacheEntry.created_at < now - timedelta(seconds=self.ttl_seconds)
+        ).delete(synchronize_session=False)
+        count = db.query(func.count()).select_from(LLMResponseCacheEntry).scalar()
+        excess = count - self.max_entries
+        if excess > 0:
+            db.execute(
+                text(
+                    "DELETE FROM llm_response_cache WHERE rowid IN "
+                    "(SELECT rowid FROM llm_response_cache ORDER BY last_used_at ASC, rowid ASC LIMIT :excess)"
+                ),
+                {"excess": excess},
+            )
+        db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters for this process."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_cache = LLMResponseCache()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """Process-wide LLM response cache."""
+    return _cache
@@ -0,0 +1,473 @@
+# LLM Client
+# Objective: One place every engine goes through to reach a language model. Each provider gets a single long-lived
+# requests.Session with a pooled HTTPAdapter, so consecutive calls in a pipeline run reuse open keep-alive
+# connections instead of paying a TCP + TLS handshake per request. Models, pool size and timeouts come from the
+# environment instead of being hardcoded in each engine. Every request goes through the provider's retry policy and
+# circuit breaker (see engines/resilience.py), so engines only retry on unusable content, and waits for the
+# provider's request and token rate limits (see engines/rate_limiter.py), which learn from its response headers.
+
+# stream_complete() consumes a completion as server-sent events and can hang up as soon as the caller has
+# what it needs, which cancels the rest of the generation.
+
+# Classification-style call sites can opt in to the SQLite response cache with cache=True (see engines/llm_cache.py).
+
+# AsyncLLMClient is the same API over an httpx.AsyncClient for the asyncio pipeline. httpx connections belong to the
+# event loop that opened them, so async clients are kept per running loop and closed with close_async_llm_clients().
+
+# Providers (both speak the OpenAI-compatible chat/completions API):
+#   hyperbolic - base model completions and instruct model chat (HYPERBOLIC_API_KEY)
+#   openrouter - instruct model chat (OPENROUTER_API_KEY)
+
+import asyncio
+import json
+import os
+import threading
+import weakref
+from typing import Callable, Dict, List, NamedTuple, Optional
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from engines.llm_cache import LLM_CACHE, get_llm_cache, request_key
+from engines.rate_limiter import get_rate_limiter
+from engines.resilience import ProviderStatusError, call_with_retries, call_with_retries_async, parse_retry_after
+from engines.token_count import estimate_tokens
+
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "10"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+
+
+class LLMProvider(NamedTuple):
+    name: str
+    base_url: str
+    chat_model: str
+    completion_model: Optional[str]
+
+
+LLM_PROVIDERS = {
+    "hyperbolic": LLMProvider(
+        name="hyperbolic",
+        base_url=os.getenv("HYPERBOLIC_BASE_URL", "https://api.hyperbolic.xyz/v1"),
+        chat_model=os.getenv("HYPERBOLIC_CHAT_MODEL", "meta-llama/Meta-Llama-3.1-70B-Instruct"),
+        completion_model=os.getenv("HYPERBOLIC_BASE_MODEL", "meta-llama/Meta-Llama-3.1-405B"),
+    ),
+    "openrouter": LLMProvider(
+        name="openrouter",
+        base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+        chat_model=os.getenv("OPENROUTER_CHAT_MODEL", "meta-llama/llama-3.1-70b-instruct"),
+        completion_model=None,
+    ),
+}
+
+
+class LLMError(ProviderStatusError):
+    """A provider answered with a non-200 status."""
+
+
+class StreamedCompletion(NamedTuple):
+    text: str
+    # finish_reason of the last chunk ("stop", "length", ...), None when the stream was cut short
+    finish_reason: Optional[str]
+    stopped_early: bool
+
+
+def chat_payload(provider: LLMProvider, messages: List[Dict], model: Optional[str], params: Dict) -> Dict:
+    return {"messages": messages, "model": model or provider.chat_model, **params}
+
+
+def completion_payload(provider: LLMProvider, prompt: str, model: Optional[str], params: Dict) -> Dict:
+    model = model or provider.completion_model
+    if model is None:
+        raise ValueError(f"{provider.name} has no completion model configured")
+    return {"prompt": prompt, "model": model, **params}
+
+
+def payload_tokens(payload: Dict) -> int:
+    """Tokens a request can consume against a tokens-per-minute limit: the prompt plus the completion allowance."""
+    messages = payload.get("messages", [])
+    prompt = payload.get("prompt") or "".join(str(message.get("content", "")) for message in messages)
+    return estimate_tokens(prompt) + int(payload.get("max_tokens") or 0)
+
+
+def sse_completion_chunk(line: str):
+    """
+    Decode one server-sent event line of a streamed completion.
+
+    Returns:
+        None for lines that carry no data, "[DONE]" at the end of the stream, else (text, finish_reason)
+    """
+    if not line or not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return data
+    choices = json.loads(data).get("choices") or [{}]
+    return choices[0].get("text") or "", choices[0].get("finish_reason")
+
+
+def cached_response(provider: LLMProvider, path: str, payload: Dict, cache: bool, refresh_cache: bool):
+    """Cache key of an opted-in request and its cached response, if any."""
+    if not (cache and LLM_CACHE):
+        return None, None
+    key = request_key(provider.name, path, payload)
+    return key, None if refresh_cache else get_llm_cache().get(key)
+
+
+def store_response(
+    provider: LLMProvider,
+    key: Optional[str],
+    payload: Dict,
+    content: Optional[str],
+    cache_if: Optional[Callable[[str], bool]] = None,
+):
+    # Empty answers, and answers the caller can't use, are never cached so the caller's re-ask gets a fresh one
+    if key is not None and content and content.strip() and (cache_if is None or cache_if(content)):
+        get_llm_cache().put(key, provider.name, payload["model"], content)
+
+
+class LLMClient:
+    """Pooled keep-alive client for one provider."""
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        pool_size: int = LLM_POOL_SIZE,
+        connect_timeout: float = LLM_CONNECT_TIMEOUT,
+        read_timeout: float = LLM_READ_TIMEOUT,
+    ):
+        self.provider = provider
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers["Content-Type"] = "application/json"
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.requests = 0
+        self.errors = 0
+        self.streams_stopped_early = 0
+
+    def post(self, path: str, api_key: str, payload: Dict) -> Dict:
+        """
+        POST a JSON payload to the provider and return the decoded response.
+
+        Args:
+            path (str): Endpoint path below the provider base URL, e.g. /chat/completions
+            api_key (str): Provider API key
+            payload (Dict): Request body
+
+        Returns:
+            Dict: Decoded JSON response
+
+        Raises:
+            LLMError: The provider answered with a non-200 status, after retrying transient ones
+            CircuitOpenError: The provider's circuit breaker is open
+        """
+        return call_with_retries(
+            self.provider.name, self._post, path, api_key, payload, endpoint=path, tokens=payload_tokens(payload)
+        )
+
+    def _post(self, path: str, api_key: str, payload: Dict) -> Dict:
+        self.requests += 1
+        response = self.session.post(
+            self.provider.base_url + path,
+            headers={"Authorization": f"Bearer {api_key}"},
+            json=payload,
+            timeout=self.timeout,
+        )
+        get_rate_limiter().observe_headers(self.provider.name, path, response.headers)
+        if response.status_code != 200:
+            self.errors += 1
+            raise LLMError(
+                self.provider.name, response.status_code, response.text, parse_retry_after(response.headers)
+            )
+        return response.json()
+
+    def _open_stream(self, path: str, api_key: str, payload: Dict) -> requests.Response:
+        self.requests += 1
+        response = self.session.post(
+            self.provider.base_url + path,
+            headers={"Authorization": f"Bearer {api_key}", "Accept": "text/event-stream"},
+            json=payload,
+            timeout=self.timeout,
+            stream=True,
+        )
+        get_rate_limiter().observe_headers(self.provider.name, path, response.headers)
+        if response.status_code != 200:
+            self.errors += 1
+            try:
+                raise LLMError(
+                    self.provider.name, response.status_code, response.text, parse_retry_after(response.headers)
+                )
+            finally:
+                response.close()
+        return response
+
+    def chat(
+        self,
+        messages: List[Dict],
+        api_key: str,
+        model: Optional[str] = None,
+        cache: bool = False,
+        refresh_cache: bool = False,
+        cache_if: Optional[Callable[[str], bool]] = None,
+        **params
+    ) -> str:
+        """
+        Chat completion with the provider's instruct model unless another model is given.
+        Extra keyword arguments (temperature, top_p, max_tokens, ...) are passed through as request parameters.
+        With cache=True an identical earlier request is answered from the response cache; refresh_cache=True
+        skips the lookup but still stores the new answer. cache_if, when given, must accept an answer before it is
+        stored, so an answer the caller can't parse is never replayed.
+
+        Returns:
+            str: Content of the first choice's message
+        """
+        payload = chat_payload(self.provider, messages, model, params)
+        key, content = cached_response(self.provider, "/chat/completions", payload, cache, refresh_cache)
+        if content is not None:
+            return content
+        content = self.post("/chat/completions", api_key, payload)["choices"][0]["message"]["content"]
+        store_response(self.provider, key, payload, content, cache_if)
+        return content
+
+    def complete(self, prompt: str, api_key: str, model: Optional[str] = None, **params) -> str:
+        """
+        Raw text completion with the provider's base model unless another model is given.
+
+        Returns:
+            str: Text of the first choice
+        """
+        response = self.post("/completions", api_key, completion_payload(self.provider, prompt, model, params))
+        return response["choices"][0]["text"]
+
+    def stream_complete(
+        self,
+        prompt: str,
+        api_key: str,
+        model: Optional[str] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        **params
+    ) -> StreamedCompletion:
+        """
+        Raw text completion streamed as server-sent events.
+        Opening the stream goes through the retry policy like any other request; a stream that breaks off
+        halfway raises. After every chunk stop_when is called with the text so far, and once it returns True
+        the connection is closed, which cancels the remaining generation on the provider's side.
+
+        Args:
+            prompt (str): Prompt to continue
+            api_key (str): Provider API key
+            model (Optional[str]): Model, the provider's base model by default
+            stop_when (Optional[Callable[[str], bool]]): Early-stop predicate over the accumulated text
+
+        Returns:
+            StreamedCompletion: Accumulated text, finish reason and whether the stream was stopped early
+        """
+        payload = completion_payload(self.provider, prompt, model, params)
+        payload["stream"] = True
+        response = call_with_retries(
+            self.provider.name, self._open_stream, "/completions", api_key, payload,
+            endpoint="/completions", tokens=payload_tokens(payload),
+        )
+        # SSE is UTF-8 by definition; without a charset requests would hand back bytes
+        response.encoding = "utf-8"
+        text = ""
+        finish_reason = None
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                chunk = sse_completion_chunk(line)
+                if chunk is None:
+                    continue
+                if chunk == "[DONE]":
+                    break
+                text += chunk[0]
+                finish_reason = chunk[1] or finish_reason
+                if stop_when is not None and finish_reason is None and stop_when(text):
+                    self.streams_stopped_early += 1
+                    return StreamedCompletion(text, None, True)
+        finally:
+            response.close()
+        return StreamedCompletion(text, finish_reason, False)
+
+    def stats(self) -> Dict[str, int]:
+        """Request counters and the number of connections opened so far by this process."""
+        pools = self.adapter.poolmanager.pools
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "streams_stopped_early": self.streams_stopped_early,
+            "connections": sum(pools[key].num_connections for key in pools.keys()),
+        }
+
+
+class AsyncLLMClient:
+    """Pooled keep-alive asyncio client for one provider, bound to the event loop it was created in."""
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        pool_size: int = LLM_POOL_SIZE,
+        connect_timeout: float = LLM_CONNECT_TIMEOUT,
+        read_timeout: float = LLM_READ_TIMEOUT,
+    ):
+        self.provider = provider
+        self.client = httpx.AsyncClient(
+            headers={"Content-Type": "application/json"},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+        self.requests = 0
+        self.errors = 0
+        self.streams_stopped_early = 0
+
+    async def post(self, path: str, api_key: str, payload: Dict) -> Dict:
+        """Async counterpart of LLMClient.post."""
+        return await call_with_retries_async(
+            self.provider.name, self._post, path, api_key, payload, endpoint=path, tokens=payload_tokens(payload)
+        )
+
+    async def _post(self, path: str, api_key: str, payload: Dict) -> Dict:
+        self.requests += 1
+        response = await self.client.post(
+            self.provider.base_url + path,
+            headers={"Authorization": f"Bearer {api_key}"},
+            json=payload,
+        )
+        get_rate_limiter().observe_headers(self.provider.name, path, response.headers)
+        if response.status_code != 200:
+            self.errors += 1
+            raise LLMError(
+                self.provider.name, response.status_code, response.text, parse_retry_after(response.headers)
+            )
+        return response.json()
+
+    async def _open_stream(self, path: str, api_key: str, payload: Dict) -> httpx.Response:
+        self.requests += 1
+        request = self.client.build_request(
+            "POST",
+            self.provider.base_url + path,
+            headers={"Authorization": f"Bearer {api_key}", "Accept": "text/event-stream"},
+            json=payload,
+        )
+        response = await self.client.send(request, stream=True)
+        get_rate_limiter().observe_headers(self.provider.name, path, response.headers)
+        if response.status_code != 200:
+            self.errors += 1
+            try:
+                await response.aread()
+                raise LLMError(
+                    self.provider.name, response.status_code, response.text, parse_retry_after(response.headers)
+                )
+            finally:
+                await response.aclose()
+        return response
+
+    async def chat(
+        self,
+        messages: List[Dict],
+        api_key: str,
+        model: Optional[str] = None,
+        cache: bool = False,
+        refresh_cache: bool = False,
+        cache_if: Optional[Callable[[str], bool]] = None,
+        **params
+    ) -> str:
+        payload = chat_payload(self.provider, messages, model, params)
+        # The response cache is SQLite, so its reads and writes run in a worker thread instead of on the event loop
+        key, content = await asyncio.to_thread(
+            cached_response, self.provider, "/chat/completions", payload, cache, refresh_cache
+        )
+        if content is not None:
+            return content
+        content = (await self.post("/chat/completions", api_key, payload))["choices"][0]["message"]["content"]
+        if key is not None:
+            await asyncio.to_thread(store_response, self.provider, key, payload, content, cache_if)
+        return content
+
+    async def complete(self, prompt: str, api_key: str, model: Optional[str] = None, **params) -> str:
+        response = await self.post("/completions", api_key, completion_payload(self.provider, prompt, model, params))
+        return response["choices"][0]["text"]
+
+    async def stream_complete(
+        self,
+        prompt: str,
+        api_key: str,
+        model: Optional[str] = None,
+        stop_when: Optional[Callable[[str], bool]] = None,
+        **params
+    ) -> StreamedCompletion:
+        """Async counterpart of LLMClient.stream_complete."""
+        payload = completion_payload(self.provider, prompt, model, params)
+        payload["stream"] = True
+        response = await call_with_retries_async(
+            self.provider.name, self._open_stream, "/completions", api_key, payload,
+            endpoint="/completions", tokens=payload_tokens(payload),
+        )
+        text = ""
+        finish_reason = None
+        try:
+            async for line in response.aiter_lines():
+                chunk = sse_completion_chunk(line)
+                if chunk is None:
+                    continue
+                if chunk == "[DONE]":
+                    break
+                text += chunk[0]
+                finish_reason = chunk[1] or finish_reason
+                if stop_when is not None and finish_reason is None and stop_when(text):
+                    self.streams_stopped_early += 1
+                    return StreamedCompletion(text, None, True)
+        finally:
+            await response.aclose()
+        return StreamedCompletion(text, finish_reason, False)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def stats(self) -> Dict[str, int]:
+        return {"requests": self.requests, "errors": self.errors, "streams_stopped_early": self.streams_stopped_early}
+
+
+_clients: Dict[str, LLMClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm_client(name: str = "hyperbolic") -> LLMClient:
+    """Process-wide pooled client for the given provider."""
+    if name not in LLM_PROVIDERS:
+        raise ValueError(f"Unknown LLM provider '{name}', expected one of {sorted(LLM_PROVIDERS)}")
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = LLMClient(LLM_PROVIDERS[name])
+        return _clients[name]
+
+
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, AsyncLLMClient]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_async_llm_client(name: str = "hyperbolic") -> AsyncLLMClient:
+    """Pooled async client for the given provider, shared by everything running on the current event loop."""
+    if name not in LLM_PROVIDERS:
+        raise ValueError(f"Unknown LLM provider '{name}', expected one of {sorted(LLM_PROVIDERS)}")
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if name not in clients:
+        clients[name] = AsyncLLMClient(LLM_PROVIDERS[name])
+    return clients[name]
+
+
+def async_llm_client_stats() -> Dict[str, Dict[str, int]]:
+    """Stats of the async clients already open on the current event loop; none are created just to report."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return {}
+    return {name: client.stats() for name, client in _async_clients.get(loop, {}).items()}
+
+
+async def close_async_llm_clients():
+    """Close the async clients of the current event loop and release their connections."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
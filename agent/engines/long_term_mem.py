@@ -8,42 +8,85 @@
 # Outputs:
 # Text memory w/ significance score 
 
-from typing import List, Dict
+import hashlib
+from typing import List, Dict, Optional, Sequence
 import numpy as np
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from sqlalchemy import Column, Integer, String, Float, DateTime
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.sql import func
-from openai import OpenAI
+from models import LongTermMemory
+from engines.embedding_cache import get_embedding_cache
+from engines.embedding_provider import get_embedding_provider
+from engines.embedding_store import encode_embedding, read_memory_generation
+from engines.hybrid_search import MEMORY_HYBRID, fts_query, hybrid_search
+from engines.memory_cache import get_memory_cache
+from engines.memory_index import fetch_memories, get_memory_index
+from engines.memory_ranking import MEMORY_RANKING, MEMORY_RANKING_CANDIDATES, rank_memories
+from engines.query_cache import MEMORY_QUERY_CACHE, get_query_cache
+from engines.token_count import estimate_tokens
 
-Base = declarative_base()
+def batch_texts(texts: List[str], max_items: int, max_tokens: int) -> List[List[str]]:
+    """
+    Split texts into consecutive batches that respect the per-request item and token limits.
+    A single text larger than max_tokens gets a batch of its own.
+    """
+    batches, current, current_tokens = [], [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def create_embeddings(texts: List[str], openai_api_key: str) -> List[Sequence[float]]:
+    """
+    Create embeddings for many texts with as few API requests as possible.
+    Cached texts cost nothing, duplicates are embedded once, and the remaining
+    texts are sent in batches bounded by the provider's item and token limits.
+    The backend is chosen by EMBEDDING_PROVIDER (see engines/embedding_provider.py).
+    
+    Args:
+        texts (List[str]): Texts to create embeddings for
+        openai_api_key (str): OpenAI API key, unused by local providers
+    
+    Returns:
+        List[Sequence[float]]: Embedding vectors in the same order as texts
+    """
+    provider = get_embedding_provider()
+    cache = get_embedding_cache() if provider.cacheable else None
+    embeddings = cache.get_many(provider.model, None, texts) if cache else [None] * len(texts)
+    missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+    if not missing:
+        return embeddings
 
-class LongTermMemory(Base):
-    __tablename__ = "long_term_memories"
+    created = {}
+    batches = batch_texts(missing, provider.max_batch_items, provider.max_batch_tokens)
+    for batch in batches:
+        batch_embeddings = provider.embed_batch(batch, openai_api_key)
+        if cache:
+            cache.put_many(provider.model, None, batch, batch_embeddings)
+        created.update(zip(batch, batch_embeddings))
+    if cache:
+        print(f"Embedded {len(missing)} new texts in {len(batches)} request(s)")
 
-    id = Column(Integer, primary_key=True, index=True)
-    content = Column(String, nullable=False)
-    embedding = Column(String, nullable=False)  # Store as JSON string
-    significance_score = Column(Float, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    return [embedding if embedding is not None else created[text] for text, embedding in zip(texts, embeddings)]
 
-def create_embedding(text: str, openai_api_key: str) -> List[float]:
+def create_embedding(text: str, openai_api_key: str) -> Sequence[float]:
     """
-    Create an embedding for the given text using OpenAI's API.
+    Create an embedding for the given text with the configured embedding provider.
+    Identical text is served from the embedding cache without an API call.
     
     Args:
         text (str): Text to create an embedding for
-        openai_api_key (str): OpenAI API key
+        openai_api_key (str): OpenAI API key, unused by local providers
     
     Returns:
-        List[float]: Embedding vector
+        Sequence[float]: Embedding vector
     """
-    client = OpenAI(api_key=openai_api_key)
-    response = client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    return response.data[0].embedding
+    return create_embeddings([text], openai_api_key)[0]
 
 def store_memory(db: Session, content: str, embedding: List[float], significance_score: float):
     """
@@ -55,21 +98,28 @@ def store_memory(db: Session, content: str, embedding: List[float], significance
         embedding (List[float]): Embedding vector
         significance_score (float): Significance score of the memory
     """
+    index = get_memory_index()
+    embedding_blob, embedding_norm = encode_embedding(embedding)
     new_memory = LongTermMemory(
         content=content,
-        embedding=str(embedding),  # Convert to string for storage
-        significance_score=significance_score
+        embedding=embedding_blob,
+        embedding_norm=embedding_norm,
+        significance_score=significance_score,
+        **index.encode_columns(db, embedding)
     )
     db.add(new_memory)
     db.commit()
+    get_memory_cache().append(db, new_memory.id, embedding, embedding_norm, significance_score)
+    index.add(db, new_memory.id, embedding)
 
-def format_long_term_memories(memories: List[Dict]) -> str:
+def format_long_term_memories(memories: List[Dict], sort_by_significance: bool = True) -> str:
     """
     Format retrieved long-term memories into a clean, readable string format
     suitable for language model consumption.
     
     Args:
         memories (List[Dict]): List of memories with content and significance score
+        sort_by_significance (bool): Reorder by significance instead of keeping the retrieval order
         
     Returns:
         str: Formatted string of memories
@@ -78,11 +128,12 @@ def format_long_term_memories(memories: List[Dict]) -> str:
         return "No relevant memories found"
     
     # Sort memories by significance score for better organization
-    sorted_memories = sorted(memories, key=lambda x: x.get('significance_score', 0), reverse=True)
+    if sort_by_significance:
+        memories = sorted(memories, key=lambda x: x.get('significance_score', 0), reverse=True)
     
     formatted_parts = ["Past memories and thoughts:"]
     
-    for memory in sorted_memories:
+    for memory in memories:
         content = memory.get('content', '').strip()
         # Optional: include score if you want
         # score = memory.get('significance_score', 0)
@@ -92,33 +143,80 @@ def format_long_term_memories(memories: List[Dict]) -> str:
     return "\n".join(formatted_parts)
 
 # Modified retrieve_relevant_memories to use the formatter
-def retrieve_relevant_memories(db: Session, query_embedding: List[float], top_k: int = 5) -> str:  # Changed return type to str
+def retrieve_relevant_memories(
+    db: Session, query_embedding: List[float], top_k: int = 5, query_text: Optional[str] = None
+) -> str:  # Changed return type to str
     """
     Retrieve and format relevant memories based on the query embedding.
+    When the query text is given, exact term matches are fused in as well (see engines/hybrid_search.py).
+    With MEMORY_RANKING=blended the candidates are re-ranked on similarity, significance, recency and
+    diversity (see engines/memory_ranking.py).
     
     Args:
         db (Session): Database session
         query_embedding (List[float]): Query embedding vector
         top_k (int): Number of top memories to retrieve
+        query_text (Optional[str]): Text the query embedding was created from
     
     Returns:
         str: Formatted string of relevant memories
     """
-    all_memories = db.query(LongTermMemory).all()
-    
-    def cosine_similarity(a, b):
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-    
-    similarities = [
-        (memory, cosine_similarity(query_embedding, eval(memory.embedding)))
-        for memory in all_memories
-    ]
-    
-    sorted_memories = sorted(similarities, key=lambda x: x[1], reverse=True)[:top_k]
-    
+    if not MEMORY_QUERY_CACHE:
+        return _retrieve_relevant_memories(db, query_embedding, top_k, query_text)
+
+    # Near-identical queries against an unchanged store are answered from the semantic query cache
+    cache = get_query_cache()
+    hybrid = bool(query_text and MEMORY_HYBRID)
+    # Hybrid results also depend on the query's exact terms (handles, tickers, addresses), which two queries with
+    # near-identical embeddings can still differ in
+    terms = hashlib.sha256(fts_query(query_text).encode("utf-8")).hexdigest() if hybrid else None
+    key = (top_k, hybrid, MEMORY_RANKING, terms)
+    generation = read_memory_generation(db)
+    cached = cache.get(query_embedding, key, generation)
+    if cached is not None:
+        return cached
+    result = _retrieve_relevant_memories(db, query_embedding, top_k, query_text)
+    cache.put(query_embedding, key, generation, result)
+    return result
+
+def _retrieve_relevant_memories(
+    db: Session, query_embedding: List[float], top_k: int, query_text: Optional[str]
+) -> str:
+    blended = MEMORY_RANKING == "blended"
+    depth = max(top_k, MEMORY_RANKING_CANDIDATES) if blended else top_k
+    if query_text and MEMORY_HYBRID:
+        results = hybrid_search(db, query_text, query_embedding, depth)
+    else:
+        results = get_memory_index().search(db, query_embedding, depth)
+    if not results:
+        return format_long_term_memories([])
+
+    candidate_ids = [memory_id for memory_id, _ in results]
+
+    rows = {
+        row.id: row
+        for row in db.query(
+            LongTermMemory.id,
+            LongTermMemory.content,
+            LongTermMemory.significance_score,
+            (func.julianday("now") - func.julianday(LongTermMemory.created_at)).label("age_days"),
+        ).filter(LongTermMemory.id.in_(candidate_ids))
+    }
+    if blended:
+        # The resident memory matrix already holds the candidates' vectors; SQLite is only read when it does not fit
+        candidates = fetch_memories(db, np.array(candidate_ids, dtype=np.int64))
+        ages_days = np.array(
+            [rows[memory_id].age_days if memory_id in rows else None for memory_id in candidates.ids.tolist()],
+            dtype=np.float32,
+        )
+        top_ids = candidates.ids[rank_memories(candidates, query_embedding, ages_days, top_k)].tolist()
+    else:
+        top_ids = candidate_ids[:top_k]
+
     memories_list = [
-        {"content": memory.content, "significance_score": memory.significance_score}
-        for memory, _ in sorted_memories
+        {"content": rows[memory_id].content, "significance_score": rows[memory_id].significance_score}
+        for memory_id in top_ids
+        if memory_id in rows
     ]
     
-    return format_long_term_memories(memories_list)
\ No newline at end of file
+    return format_long_term_memories(memories_list, sort_by_significance=not blended)
@@ -0,0 +1,181 @@
+# Memory Cache
+# Objective: Keep the decoded long term memory matrix (ids, embeddings, norms, significance) resident in the process,
+# so steady-state retrieval does not re-query and re-decode the whole table on every pipeline run.
+
+# store_memory writes through to the cache. Writes from anywhere else (another process, a migration, a manual edit)
+# are detected through the memory_state generation counter that SQLite triggers bump on every change to
+# long_term_memories. When the matrix would exceed MEMORY_CACHE_MAX_BYTES nothing is cached and searches stream
+# the table in chunks instead.
+# MEMORY_STORE=mmap swaps the private copy for the memory-mapped files of engines/memory_mmap.py, shared through the
+# page cache by every process reading the same database. It is the default with the int8 and prefix indexes, whose
+# point is to not hold a private full-width matrix.
+
+import os
+from typing import Optional, Sequence
+import numpy as np
+from sqlalchemy.orm import Session
+from engines.embedding_store import (
+    EMBEDDING_DTYPE,
+    MemoryMatrix,
+    cosine_scores,
+    iter_memory_matrix_chunks,
+    memory_embedding_dimension,
+    memory_table_stats,
+    read_memory_generation,
+    select_memory_rows,
+    top_k_indices,
+)
+from engines.memory_mmap import MappedMemoryStore
+
+# The int8 and prefix indexes keep their compact encoding as the only private matrix and re-rank from the mapping
+MEMORY_STORE = os.getenv("MEMORY_STORE", "mmap" if os.getenv("MEMORY_INDEX") in ("int8", "prefix") else "process")
+MEMORY_CACHE_MAX_BYTES = int(os.getenv("MEMORY_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+MEMORY_STREAM_CHUNK_SIZE = int(os.getenv("MEMORY_STREAM_CHUNK_SIZE", "20000"))
+
+
+def row_bytes(dim: int) -> int:
+    """Resident size of one cached memory: embedding, id, norm and significance."""
+    return dim * EMBEDDING_DTYPE.itemsize + 8 + 4 + 4
+
+
+class MemoryMatrixCache:
+    """Growable in-memory copy of the long term memory matrix, kept in sync with SQLite."""
+
+    def __init__(self, max_bytes: int = MEMORY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.generation: Optional[int] = None
+        self.resident = False
+        self.clear()
+
+    def clear(self):
+        self.size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._embeddings = np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._significance = np.empty(0, dtype=np.float32)
+
+    @property
+    def matrix(self) -> MemoryMatrix:
+        return MemoryMatrix(
+            ids=self._ids[:self.size],
+            embeddings=self._embeddings[:self.size],
+            norms=self._norms[:self.size],
+            significance=self._significance[:self.size],
+        )
+
+    @property
+    def max_id(self) -> int:
+        return int(self._ids[self.size - 1]) if self.size else 0
+
+    def refresh(self, db: Session) -> bool:
+        """
+        Make sure the cache reflects the database.
+
+        Args:
+            db (Session): Database session
+
+        Returns:
+            bool: True if the matrix is resident, False if searches should stream from SQLite
+        """
+        generation = read_memory_generation(db)
+        if generation == self.generation:
+            return self.resident
+
+        count, max_id = memory_table_stats(db)
+        dim = self._embeddings.shape[1] if self.size else memory_embedding_dimension(db)
+        if count * row_bytes(dim) > self.max_bytes:
+            if self.resident:
+                print(f"Memory matrix ({count} rows) exceeds MEMORY_CACHE_MAX_BYTES, streaming from SQLite.")
+            self.clear()
+            self.resident = False
+            self.generation = generation
+            return False
+
+        if self.resident and self.generation is not None and max_id > self.max_id:
+            tail = list(iter_memory_matrix_chunks(db, MEMORY_STREAM_CHUNK_SIZE, after_id=self.max_id))
+            tail_rows = sum(len(chunk.ids) for chunk in tail)
+            # Every insert bumps the generation by one, so a pure append accounts for the whole difference
+            if generation - self.generation == tail_rows and self.size + tail_rows == count:
+                for chunk in tail:
+                    self._extend(chunk)
+                self.generation = generation
+                return True
+
+        self.clear()
+        for chunk in iter_memory_matrix_chunks(db, MEMORY_STREAM_CHUNK_SIZE):
+            self._extend(chunk)
+        self.resident = True
+        self.generation = generation
+        return True
+
+    def append(self, db: Session, memory_id: int, embedding: Sequence[float], norm: float, significance: float):
+        """Write-through for a memory this process has just committed."""
+        generation = read_memory_generation(db)
+        if not self.resident or self.generation is None or generation != self.generation + 1 or memory_id <= self.max_id:
+            # Someone else wrote as well, let the next refresh work out what changed
+            self.generation = None
+            return
+        vector = np.asarray(embedding, dtype=EMBEDDING_DTYPE).reshape(1, -1)
+        if (self.size + 1) * row_bytes(vector.shape[1]) > self.max_bytes:
+            self.generation = None
+            return
+        self._extend(MemoryMatrix(
+            ids=np.array([memory_id], dtype=np.int64),
+            embeddings=vector,
+            norms=np.array([norm], dtype=np.float32),
+            significance=np.array([significance], dtype=np.float32),
+        ))
+        self.generation = generation
+
+    def take(self, ids: Sequence[int]) -> MemoryMatrix:
+        """Rows for the given memory ids, skipping ids that are not cached."""
+        return select_memory_rows(self.matrix, ids)
+
+    def _extend(self, chunk: MemoryMatrix):
+        new_size = self.size + len(chunk.ids)
+        if new_size > len(self._ids):
+            self._grow(max(new_size, 2 * len(self._ids)), chunk.embeddings.shape[1])
+        self._ids[self.size:new_size] = chunk.ids
+        self._embeddings[self.size:new_size] = chunk.embeddings
+        self._norms[self.size:new_size] = chunk.norms
+        self._significance[self.size:new_size] = chunk.significance
+        self.size = new_size
+
+    def _grow(self, capacity: int, dim: int):
+        def resize(array: np.ndarray, shape) -> np.ndarray:
+            grown = np.empty(shape, dtype=array.dtype)
+            if self.size:
+                grown[:self.size] = array[:self.size]
+            return grown
+
+        self._ids = resize(self._ids, (capacity,))
+        self._embeddings = resize(self._embeddings, (capacity, dim))
+        self._norms = resize(self._norms, (capacity,))
+        self._significance = resize(self._significance, (capacity,))
+
+
+def streaming_search(db: Session, query_embedding: Sequence[float], top_k: int):
+    """Exact search that keeps only a running top-k while streaming the table in chunks."""
+    best_ids = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float32)
+    for chunk in iter_memory_matrix_chunks(db, MEMORY_STREAM_CHUNK_SIZE):
+        best_ids = np.concatenate([best_ids, chunk.ids])
+        best_scores = np.concatenate([best_scores, cosine_scores(chunk.embeddings, chunk.norms, query_embedding)])
+        keep = top_k_indices(best_scores, top_k)
+        best_ids, best_scores = best_ids[keep], best_scores[keep]
+    return [(int(memory_id), float(score)) for memory_id, score in zip(best_ids, best_scores)]
+
+
+MEMORY_STORES = {
+    "process": MemoryMatrixCache,
+    "mmap": MappedMemoryStore,
+}
+
+if MEMORY_STORE not in MEMORY_STORES:
+    raise ValueError(f"Unknown memory store '{MEMORY_STORE}', expected one of {sorted(MEMORY_STORES)}")
+_cache = MEMORY_STORES[MEMORY_STORE]()
+
+
+def get_memory_cache():
+    """Process-wide memory matrix cache, private (process) or shared between processes (mmap)."""
+    return _cache
@@ -0,0 +1,167 @@
+# Memory Consolidation
+# Objective: Keep long term memory from filling up with near-identical riffs on the same theme. Every new memory is
+# compared with the memories stored before it, and one whose embedding is within MEMORY_CONSOLIDATION_SIMILARITY of an
+# earlier memory is merged into it: the earlier memory keeps its content, takes the higher significance score and
+# adds to its member_count, and the duplicate row is deleted.
+
+# Passes are incremental. memory_state.consolidated_id records the highest id already processed, so a pass only
+# looks at memories stored since the previous one, at most MEMORY_CONSOLIDATION_BATCH_SIZE of them. All merges of a
+# pass are applied in one transaction at the end, so the memory index is not invalidated while it is being queried.
+# A pass that merges anything still changes rows, which makes the memory caches reload and empties the query cache,
+# so run_pipeline only runs one when consolidation_due says so: once MEMORY_CONSOLIDATION_MIN_NEW memories are
+# waiting, or MEMORY_CONSOLIDATION_INTERVAL_HOURS after the previous pass.
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from models import LongTermMemory
+from engines.embedding_store import ID_BATCH_SIZE, iter_memory_matrix_chunks, memory_table_stats
+from engines.memory_index import get_memory_index
+
+CONSOLIDATION_SIMILARITY = float(os.getenv("MEMORY_CONSOLIDATION_SIMILARITY", "0.92"))
+CONSOLIDATION_BATCH_SIZE = int(os.getenv("MEMORY_CONSOLIDATION_BATCH_SIZE", "5000"))
+CONSOLIDATION_INTERVAL_HOURS = float(os.getenv("MEMORY_CONSOLIDATION_INTERVAL_HOURS", "24"))
+CONSOLIDATION_MIN_NEW = int(os.getenv("MEMORY_CONSOLIDATION_MIN_NEW", "500"))
+# Nearest neighbours checked per memory; the memory itself and later memories are among them
+CONSOLIDATION_NEIGHBORS = 8
+
+
+def read_consolidated_id(db: Session) -> int:
+    return int(db.execute(text("SELECT consolidated_id FROM memory_state WHERE id = 1")).scalar() or 0)
+
+
+def pending_memories(db: Session) -> int:
+    """Memories stored since the last consolidation pass."""
+    return int(db.execute(
+        text("SELECT count(*) FROM long_term_memories WHERE id > :id"), {"id": read_consolidated_id(db)}
+    ).scalar() or 0)
+
+
+def consolidation_due(
+    db: Session,
+    last_run: datetime,
+    interval_hours: float = CONSOLIDATION_INTERVAL_HOURS,
+    min_new: int = CONSOLIDATION_MIN_NEW,
+) -> bool:
+    """
+    Whether a consolidation pass is worth invalidating the memory caches for.
+
+    Args:
+        db (Session): Database session
+        last_run (datetime): When the previous pass ran (or the process started)
+        interval_hours (float): Run after this long even when fewer than min_new memories are waiting
+        min_new (int): Run as soon as this many memories are waiting
+
+    Returns:
+        bool: True if a pass should run now
+    """
+    pending = pending_memories(db)
+    if pending >= min_new:
+        return True
+    return pending > 0 and datetime.now() - last_run >= timedelta(hours=interval_hours)
+
+
+def consolidate_memories(
+    db: Session,
+    threshold: float = CONSOLIDATION_SIMILARITY,
+    batch_size: int = CONSOLIDATION_BATCH_SIZE,
+) -> Dict[str, int]:
+    """
+    Merge memories stored since the last pass into earlier near-duplicates.
+
+    Args:
+        db (Session): Database session
+        threshold (float): Minimum cosine similarity for two memories to be merged
+        batch_size (int): Maximum number of new memories processed in this pass
+
+    Returns:
+        Dict[str, int]: Memories scanned and merged, and the row count before and after the pass
+    """
+    rows_before, _ = memory_table_stats(db)
+    report = {"scanned": 0, "merged": 0, "rows_before": rows_before, "rows_after": rows_before}
+    consolidated_id = read_consolidated_id(db)
+    new = next(iter_memory_matrix_chunks(db, batch_size, after_id=consolidated_id), None)
+    if new is None:
+        return report
+
+    index = get_memory_index()
+    merged_into: Dict[int, int] = {}
+    for memory_id, embedding in zip(new.ids.tolist(), new.embeddings):
+        for neighbor_id, similarity in index.search(db, embedding, CONSOLIDATION_NEIGHBORS):
+            if similarity < threshold:
+                break
+            if neighbor_id < memory_id:
+                while neighbor_id in merged_into:
+                    neighbor_id = merged_into[neighbor_id]
+                merged_into[memory_id] = neighbor_id
+                break
+
+    if merged_into:
+        apply_merges(db, merged_into)
+    # SQLite hands out max(id) + 1 to the next insert, so deleting the newest memories frees their ids again.
+    # Stopping at the newest survivor keeps every future insert above the watermark.
+    surviving = [memory_id for memory_id in new.ids.tolist() if memory_id not in merged_into]
+    consolidated_id = max(surviving, default=consolidated_id)
+    db.execute(text("UPDATE memory_state SET consolidated_id = :id WHERE id = 1"), {"id": consolidated_id})
+    db.commit()
+
+    report["scanned"] = len(new.ids)
+    report["merged"] = len(merged_into)
+    report["rows_after"], _ = memory_table_stats(db)
+    return report
+
+
+def apply_merges(db: Session, merged_into: Dict[int, int]):
+    """Fold every merged memory into its surviving memory and delete it, without committing."""
+    groups: Dict[int, List[int]] = {}
+    for member_id, survivor_id in merged_into.items():
+        groups.setdefault(survivor_id, []).append(member_id)
+
+    involved = list(set(merged_into) | set(groups))
+    rows = {}
+    for start in range(0, len(involved), ID_BATCH_SIZE):
+        for row in db.query(
+            LongTermMemory.id, LongTermMemory.significance_score, LongTermMemory.member_count
+        ).filter(LongTermMemory.id.in_(involved[start:start + ID_BATCH_SIZE])):
+            rows[row.id] = row
+
+    for survivor_id, member_ids in groups.items():
+        members = [rows[i] for i in [survivor_id, *member_ids] if i in rows]
+        db.query(LongTermMemory).filter(LongTermMemory.id == survivor_id).update(
+            {
+                LongTermMemory.significance_score: max(row.significance_score for row in members),
+                LongTermMemory.member_count: sum(row.member_count or 1 for row in members),
+            },
+            synchronize_session=False,
+        )
+    member_ids = list(merged_into)
+    for start in range(0, len(member_ids), ID_BATCH_SIZE):
+        db.query(LongTermMemory).filter(
+            LongTermMemory.id.in_(member_ids[start:start + ID_BATCH_SIZE])
+        ).delete(synchronize_session=False)
+
+
+def format_consolidation_report(report: Dict[str, int]) -> str:
+    shrink = report["rows_before"] - report["rows_after"]
+    percent = 100 * shrink / report["rows_before"] if report["rows_before"] else 0.0
+    return (
+        f"Consolidated {report['scanned']} new memories: merged {report['merged']} near-duplicates, "
+        f"store {report['rows_before']} -> {report['rows_after']} rows ({percent:.1f}% smaller)"
+    )
+
+
+if __name__ == "__main__":
+    from db.db_setup import SessionLocal
+
+    db = SessionLocal()
+    try:
+        # Work through the whole backlog, one bounded pass at a time
+        while True:
+            report = consolidate_memories(db)
+            if not report["scanned"]:
+                break
+            print(format_consolidation_report(report))
+    finally:
+        db.close()
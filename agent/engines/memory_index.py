@@ -0,0 +1,745 @@
+# Memory Index
+# Objective: Approximate nearest neighbour search over long term memory embeddings, so retrieval cost stops growing
+# linearly with the number of stored memories.
+
+# The default backend is an inverted file (IVF) index in pure NumPy: embeddings are clustered with spherical k-means,
+# every memory is assigned to its closest centroid, and a query only scores the memories in its nprobe closest lists.
+# The index file only holds centroids and list assignments, the embeddings themselves stay in SQLite and are read
+# through the process-resident memory cache when it fits in RAM. Inserts, updates and deletes found in the
+# memory_changes log are applied to just the memories they touched and appended to a small journal next to the
+# index file; the full .npz is only rewritten on rebuild, reassignment or once the journal has grown past
+# MEMORY_INDEX_JOURNAL_MAX entries.
+# The int8 and prefix backends scan a compact encoding of every memory (scalar-quantized codes at a quarter of the
+# float32 size, or the first MEMORY_PREFIX_DIMENSIONS Matryoshka dimensions), shortlist MEMORY_INDEX_RERANK times
+# top_k candidates from it and re-rank them exactly from the memory cache's float embeddings. With these backends
+# that cache defaults to the shared memory-mapped store, so the encoding is the only private matrix.
+# Stores smaller than MEMORY_INDEX_MIN_ROWS are searched exactly.
+
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from models import LongTermMemory
+from db.db_setup import DB_PATH
+from engines.embedding_store import (
+    EMBEDDING_DTYPE,
+    MemoryMatrix,
+    cosine_scores,
+    iter_memory_matrix_chunks,
+    load_memory_matrix,
+    memory_embedding_dimension,
+    memory_table_stats,
+    read_memory_changes,
+    read_memory_generation,
+    top_k_indices,
+)
+from engines.memory_cache import get_memory_cache, row_bytes, streaming_search
+from engines.quantization import ScalarQuantizer, load_quantizer, save_quantizer
+
+MEMORY_INDEX = os.getenv("MEMORY_INDEX", "ivf")
+MEMORY_INDEX_PATH = os.getenv(
+    "MEMORY_INDEX_PATH", os.path.join(os.path.dirname(DB_PATH), "memory_index.npz")
+)
+IVF_MIN_TRAIN_ROWS = int(os.getenv("MEMORY_INDEX_MIN_ROWS", "2048"))
+IVF_NPROBE = int(os.getenv("MEMORY_INDEX_NPROBE", "16"))
+# Retrain the centroids once the store has grown this many times past the size they were trained on
+IVF_RETRAIN_GROWTH = 4
+IVF_TRAIN_SAMPLES_PER_LIST = 64
+IVF_JOURNAL_MAX_ENTRIES = int(os.getenv("MEMORY_INDEX_JOURNAL_MAX", "4096"))
+# One journal entry per changed memory, list -1 for a deleted one; generation is -1 on all but the last entry of a
+# batch, so a batch cut short by a crash is replayed without claiming the generation it would have reached
+JOURNAL_DTYPE = np.dtype([("id", "<i8"), ("list", "<i4"), ("generation", "<i8")])
+ASSIGN_CHUNK_SIZE = 8192
+SHORTLIST_RERANK_FACTOR = int(os.getenv("MEMORY_INDEX_RERANK", "10"))
+INT8_TRAIN_SAMPLES = 20000
+PREFIX_DIMENSIONS = int(os.getenv("MEMORY_PREFIX_DIMENSIONS", "256"))
+# Prefixes are cheap to scan but coarser than int8 codes, so they shortlist more candidates
+PREFIX_RERANK_FACTOR = int(os.getenv("MEMORY_PREFIX_RERANK", "20"))
+CODES_CHUNK_SIZE = 20000
+
+SearchResult = List[Tuple[int, float]]
+FetchFn = Callable[[np.ndarray], MemoryMatrix]
+
+
+def exact_search(matrix: MemoryMatrix, query: Sequence[float], top_k: int) -> SearchResult:
+    """Brute-force cosine search over a memory matrix, returning (memory id, similarity) pairs best first."""
+    scores = cosine_scores(matrix.embeddings, matrix.norms, query)
+    return [(int(matrix.ids[i]), float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+
+def search_all(db: Session, query_embedding: Sequence[float], top_k: int) -> SearchResult:
+    """Exact search over every memory, from the resident cache or streamed from SQLite."""
+    cache = get_memory_cache()
+    if cache.refresh(db):
+        return exact_search(cache.matrix, query_embedding, top_k)
+    return streaming_search(db, query_embedding, top_k)
+
+
+def fetch_memories(db: Session, ids: np.ndarray) -> MemoryMatrix:
+    """Embeddings for candidate ids, from the resident cache when possible."""
+    cache = get_memory_cache()
+    if cache.refresh(db):
+        return cache.take(ids)
+    return load_memory_matrix(db, ids)
+
+
+def memory_count(db: Session) -> int:
+    """Number of memories, from the resident cache when possible."""
+    cache = get_memory_cache()
+    if cache.refresh(db):
+        return len(cache.matrix.ids)
+    return memory_table_stats(db)[0]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def assign_lists(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the closest (highest cosine) centroid for every row, computed in chunks."""
+    assignments = np.empty(len(embeddings), dtype=np.int32)
+    for start in range(0, len(embeddings), ASSIGN_CHUNK_SIZE):
+        chunk = embeddings[start:start + ASSIGN_CHUNK_SIZE]
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(sample: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    Train nlist unit-length centroids with spherical k-means.
+
+    Args:
+        sample (np.ndarray): (n, d) training embeddings
+        nlist (int): Number of inverted lists
+        iterations (int): k-means iterations
+        seed (int): Random seed for initialisation
+
+    Returns:
+        np.ndarray: (nlist, d) float32 centroids
+    """
+    rng = np.random.default_rng(seed)
+    data = normalize_rows(np.asarray(sample, dtype=EMBEDDING_DTYPE))
+    nlist = min(nlist, len(data))
+    centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_lists(data, centroids)
+        order = np.argsort(assignments, kind="stable")
+        sorted_assignments = assignments[order]
+        starts = np.flatnonzero(np.r_[True, sorted_assignments[1:] != sorted_assignments[:-1]])
+        sums = np.zeros_like(centroids)
+        sums[sorted_assignments[starts]] = np.add.reduceat(data[order], starts, axis=0)
+        # Reseed empty lists from random points so every list stays in use
+        empty = np.flatnonzero(np.bincount(assignments, minlength=nlist) == 0)
+        if len(empty):
+            sums[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+        centroids = normalize_rows(sums).astype(EMBEDDING_DTYPE)
+    return centroids
+
+
+def default_nlist(count: int) -> int:
+    return int(np.clip(2 * np.sqrt(count), 16, 4096))
+
+
+class FlatIndex:
+    """Exact search over every memory. Nothing to persist or keep in sync."""
+
+    name = "flat"
+
+    def search(self, db: Session, query_embedding: Sequence[float], top_k: int) -> SearchResult:
+        return search_all(db, query_embedding, top_k)
+
+    def encode_columns(self, db: Session, embedding: Sequence[float]) -> Dict[str, Any]:
+        """Extra LongTermMemory columns this backend needs stored with a new memory."""
+        return {}
+
+    def add(self, db: Session, memory_id: int, embedding: Sequence[float]):
+        pass
+
+    def rebuild(self, db: Session):
+        pass
+
+
+class IVFIndex:
+    """
+    Inverted file index persisted as an .npz of centroids and per-memory list assignments, plus an append-only
+    journal of the assignments changed since the .npz was last written.
+    """
+
+    name = "ivf"
+
+    def __init__(
+        self,
+        path: str = MEMORY_INDEX_PATH,
+        nprobe: int = IVF_NPROBE,
+        min_train_rows: int = IVF_MIN_TRAIN_ROWS,
+    ):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.journal_entries = 0
+        self.nprobe = nprobe
+        self.min_train_rows = min_train_rows
+        self.centroids: Optional[np.ndarray] = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.lists = np.empty(0, dtype=np.int32)
+        self.max_id = 0
+        self.trained_count = 0
+        self.loaded = False
+        self.synced_generation: Optional[int] = None
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def reset(self):
+        self.centroids = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.lists = np.empty(0, dtype=np.int32)
+        self.max_id = 0
+        self.trained_count = 0
+
+    def train(self, sample: np.ndarray, total_count: int, nlist: Optional[int] = None):
+        self.reset()
+        self.centroids = train_centroids(sample, nlist or default_nlist(total_count))
+        self.trained_count = total_count
+
+    def add_vectors(self, ids: np.ndarray, embeddings: np.ndarray):
+        """Assign already-trained lists to new memories. Ids must be appended in increasing order."""
+        if not self.trained or len(ids) == 0:
+            return
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self.lists = np.concatenate([self.lists, assign_lists(embeddings, self.centroids)])
+        self.max_id = max(self.max_id, int(ids[-1]))
+
+    def apply_changes(self, changed_ids: np.ndarray, current: MemoryMatrix) -> np.ndarray:
+        """
+        Replace the assignments of changed memories with their current state.
+
+        Args:
+            changed_ids (np.ndarray): Sorted ids of the memories that changed
+            current (MemoryMatrix): Rows of the changed memories that still exist
+
+        Returns:
+            np.ndarray: New list of every changed id, -1 for the deleted ones
+        """
+        changed_lists = np.full(len(changed_ids), -1, dtype=np.int32)
+        if len(current.ids):
+            changed_lists[np.searchsorted(changed_ids, current.ids)] = assign_lists(current.embeddings, self.centroids)
+        self._replace(changed_ids, changed_lists)
+        return changed_lists
+
+    def _replace(self, ids: np.ndarray, lists: np.ndarray):
+        keep = ~np.isin(self.ids, ids)
+        present = lists >= 0
+        ids = np.concatenate([self.ids[keep], ids[present]])
+        lists = np.concatenate([self.lists[keep], lists[present]])
+        order = np.argsort(ids, kind="stable")
+        self.ids, self.lists = ids[order], lists[order]
+        self.max_id = int(self.ids[-1]) if len(self.ids) else 0
+
+    def search_vectors(self, query_embedding: Sequence[float], top_k: int, fetch: FetchFn) -> SearchResult:
+        """
+        Probe the nprobe closest lists and score their members exactly.
+
+        Args:
+            query_embedding (Sequence[float]): Query embedding vector
+            top_k (int): Number of results
+            fetch (FetchFn): Loads the embeddings for a set of candidate ids
+
+        Returns:
+            SearchResult: (memory id, similarity) pairs best first
+        """
+        query = np.asarray(query_embedding, dtype=EMBEDDING_DTYPE)
+        probe = top_k_indices(self.centroids @ query, self.nprobe)
+        candidate_ids = self.ids[np.isin(self.lists, probe)]
+        return exact_search(fetch(candidate_ids), query, top_k)
+
+    def search(self, db: Session, query_embedding: Sequence[float], top_k: int) -> SearchResult:
+        self.sync(db)
+        if not self.trained:
+            return search_all(db, query_embedding, top_k)
+        return self.search_vectors(query_embedding, top_k, lambda ids: fetch_memories(db, ids))
+
+    def encode_columns(self, db: Session, embedding: Sequence[float]) -> Dict[str, Any]:
+        return {}
+
+    def add(self, db: Session, memory_id: int, embedding: Sequence[float]):
+        """Incrementally index a memory that was just written by store_memory."""
+        if not self.loaded:
+            self.load()
+        generation = read_memory_generation(db)
+        if (
+            not self.trained
+            or self.synced_generation is None
+            or generation != self.synced_generation + 1
+            or memory_id <= self.max_id
+        ):
+            # Someone else wrote as well, let the next sync work out what changed
+            return
+        self.add_vectors(
+            np.array([memory_id], dtype=np.int64),
+            np.asarray(embedding, dtype=EMBEDDING_DTYPE).reshape(1, -1),
+        )
+        self.synced_generation = generation
+        self.append_journal(self.ids[-1:], self.lists[-1:], generation)
+
+    def sync(self, db: Session):
+        """Bring the index in line with SQLite, rebuilding it when it is missing or stale."""
+        if not self.loaded:
+            self.load()
+        generation = read_memory_generation(db)
+        if generation == self.synced_generation:
+            return
+        self._sync(db, generation)
+
+    def _sync(self, db: Session, generation: int):
+        count, _ = memory_table_stats(db)
+
+        if not self.trained:
+            if count >= self.min_train_rows:
+                self.rebuild(db)
+            else:
+                self.synced_generation = generation
+            return
+        if count > IVF_RETRAIN_GROWTH * self.trained_count:
+            self.rebuild(db)
+            return
+        changed = None
+        if self.synced_generation is not None:
+            changed = read_memory_changes(db, self.synced_generation, generation)
+        if changed is not None and len(changed) <= max(count, len(self.ids)) // 2:
+            # Reading the changed rows after the generation at worst picks up a later write early, which the next
+            # sync applies again
+            changed_lists = self.apply_changes(changed, load_memory_matrix(db, changed))
+            self.synced_generation = generation
+            self.append_journal(changed, changed_lists, generation)
+            return
+        # The change log no longer reaches back far enough, or most of the store changed, so the list
+        # assignments are redone against the existing centroids in one streaming pass
+        self.reassign(db)
+
+    def reassign(self, db: Session):
+        """Repopulate the lists from SQLite in one streaming pass, keeping the trained centroids."""
+        self.synced_generation = read_memory_generation(db)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.lists = np.empty(0, dtype=np.int32)
+        self.max_id = 0
+        for chunk in iter_memory_matrix_chunks(db):
+            self.add_vectors(chunk.ids, chunk.embeddings)
+        self.save()
+
+    def rebuild(self, db: Session, seed: int = 0):
+        """Retrain and repopulate the index from SQLite in two streaming passes."""
+        self.synced_generation = read_memory_generation(db)
+        count, _ = memory_table_stats(db)
+        self.reset()
+        if count < self.min_train_rows:
+            self.save()
+            return
+
+        nlist = default_nlist(count)
+        sample_rate = min(1.0, nlist * IVF_TRAIN_SAMPLES_PER_LIST / count)
+        rng = np.random.default_rng(seed)
+        sample = [
+            chunk.embeddings[rng.random(len(chunk.ids)) < sample_rate]
+            for chunk in iter_memory_matrix_chunks(db)
+        ]
+        self.train(np.concatenate(sample), count, nlist)
+        for chunk in iter_memory_matrix_chunks(db):
+            self.add_vectors(chunk.ids, chunk.embeddings)
+        self.save()
+        print(f"Rebuilt memory index with {len(self.centroids)} lists over {len(self.ids)} memories.")
+
+    def load(self):
+        self.loaded = True
+        self.reset()
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                if data["centroids"].size:
+                    self.centroids = data["centroids"].astype(EMBEDDING_DTYPE)
+                    self.ids = data["ids"].astype(np.int64)
+                    self.lists = data["lists"].astype(np.int32)
+                    self.max_id = int(data["max_id"])
+                    self.trained_count = int(data["trained_count"])
+                    if "generation" in data and int(data["generation"]) >= 0:
+                        self.synced_generation = int(data["generation"])
+        except Exception as e:
+            print(f"Discarding unreadable memory index at {self.path}: {e}")
+            self.reset()
+            return
+        self.replay_journal()
+
+    def replay_journal(self):
+        """Apply the journal batches written after the .npz; a torn last entry is ignored."""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "rb") as f:
+            data = f.read()
+        complete = len(data) - len(data) % JOURNAL_DTYPE.itemsize
+        if complete < len(data):
+            # Cut the torn entry off so the next append starts on an entry boundary
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(complete)
+        entries = np.frombuffer(data[:complete], dtype=JOURNAL_DTYPE)
+        self.journal_entries = len(entries)
+        if not self.trained or len(entries) == 0:
+            return
+        generations = entries["generation"]
+        # Every entry belongs to the batch closed by the next entry that carries a generation; entries after the
+        # last one are a batch cut short (-1)
+        batch_ends = np.flatnonzero(generations >= 0)
+        batch = np.searchsorted(batch_ends, np.arange(len(entries)))
+        batch_generations = np.append(generations[batch_ends], -1)[batch]
+        if self.synced_generation is not None:
+            # Batches from before the last full save (a crash between writing the .npz and removing the journal)
+            entries = entries[(batch_generations > self.synced_generation) | (batch_generations < 0)]
+        if len(entries):
+            # A memory that changed more than once ends up where its last entry put it
+            last = len(entries) - 1 - np.unique(entries["id"][::-1], return_index=True)[1]
+            self._replace(entries["id"][last].astype(np.int64), entries["list"][last].astype(np.int32))
+        # A generation only counts when nothing after it was cut off; otherwise the next sync reconciles
+        self.synced_generation = int(generations[-1]) if generations[-1] >= 0 else None
+
+    def append_journal(self, ids: np.ndarray, lists: np.ndarray, generation: int):
+        """Persist changed list assignments (-1 for deleted memories) without rewriting the whole index."""
+        count = len(ids)
+        if count == 0:
+            return
+        if self.journal_entries + count > IVF_JOURNAL_MAX_ENTRIES:
+            self.save()
+            return
+        entries = np.empty(count, dtype=JOURNAL_DTYPE)
+        entries["id"] = ids
+        entries["list"] = lists
+        entries["generation"] = -1
+        entries["generation"][-1] = generation
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        with open(self.journal_path, "ab") as f:
+            f.write(entries.tobytes())
+        self.journal_entries += count
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids if self.trained else np.empty((0, 0), dtype=EMBEDDING_DTYPE),
+                ids=self.ids,
+                lists=self.lists,
+                max_id=np.int64(self.max_id),
+                trained_count=np.int64(self.trained_count),
+                generation=np.int64(-1 if self.synced_generation is None else self.synced_generation),
+            )
+        os.replace(tmp_path, self.path)
+        # Everything in the journal is in the .npz now
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal_entries = 0
+
+
+class ShortlistIndex(ABC):
+    """
+    Base for backends that keep a compact encoding of every memory resident in RAM, stored alongside the memory in
+    a LongTermMemory column. A query shortlists rerank_factor * top_k candidates from the encodings and re-ranks them
+    exactly against the float embeddings of the memory cache, so only the shortlist's rows are ever read. Selecting
+    a shortlist backend makes the memory-mapped store the default cache (see engines/memory_cache.py), so the codes
+    are the only private matrix and the full-width rows are shared through the page cache.
+    Subclasses define the column, the encoding and the approximate score.
+    """
+
+    name = ""
+    column = ""
+    code_dtype = np.dtype(np.int8)
+
+    def __init__(self, rerank_factor: int = SHORTLIST_RERANK_FACTOR):
+        self.rerank_factor = rerank_factor
+        self.ids = np.empty(0, dtype=np.int64)
+        self.codes = np.empty((0, 0), dtype=self.code_dtype)
+        self.synced_generation: Optional[int] = None
+
+    @abstractmethod
+    def ready(self, db: Session) -> bool:
+        """Load (or train) whatever encode needs, False while the store should be searched exactly."""
+
+    @property
+    @abstractmethod
+    def code_width(self) -> int:
+        """Number of code_dtype values per memory."""
+
+    @abstractmethod
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        """(n, d) float embeddings to (n, code_width) codes."""
+
+    @abstractmethod
+    def scores(self, query_embedding: Sequence[float]) -> np.ndarray:
+        """Approximate similarity of every resident code to the query, only used for ranking."""
+
+    @property
+    def max_id(self) -> int:
+        return int(self.ids[-1]) if len(self.ids) else 0
+
+    def add_vectors(self, ids: np.ndarray, embeddings: np.ndarray):
+        """Encode and append new memories. Ids must be appended in increasing order."""
+        if len(ids) == 0:
+            return
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        codes = self.encode(embeddings)
+        self.codes = np.concatenate([self.codes, codes]) if len(self.codes) else codes
+
+    def search_vectors(self, query_embedding: Sequence[float], top_k: int, fetch: FetchFn) -> SearchResult:
+        """
+        Shortlist candidates from the resident codes and re-rank them exactly.
+
+        Args:
+            query_embedding (Sequence[float]): Query embedding vector
+            top_k (int): Number of results
+            fetch (FetchFn): Loads the float embeddings for the shortlisted ids
+
+        Returns:
+            SearchResult: (memory id, similarity) pairs best first
+        """
+        shortlist = self.ids[top_k_indices(self.scores(query_embedding), top_k * self.rerank_factor)]
+        return exact_search(fetch(shortlist), query_embedding, top_k)
+
+    def search(self, db: Session, query_embedding: Sequence[float], top_k: int) -> SearchResult:
+        self.sync(db)
+        if len(self.ids) == 0:
+            return search_all(db, query_embedding, top_k)
+        return self.search_vectors(query_embedding, top_k, lambda ids: fetch_memories(db, ids))
+
+    def encode_columns(self, db: Session, embedding: Sequence[float]) -> Dict[str, Any]:
+        if not self.ready(db):
+            return {}
+        vector = np.asarray(embedding, dtype=EMBEDDING_DTYPE).reshape(1, -1)
+        return {self.column: self.encode(vector)[0].tobytes()}
+
+    def add(self, db: Session, memory_id: int, embedding: Sequence[float]):
+        """Write-through for a memory that store_memory just committed with its codes."""
+        generation = read_memory_generation(db)
+        if (
+            self.synced_generation is None
+            or generation != self.synced_generation + 1
+            or memory_id <= self.max_id
+            or len(self.ids) == 0
+        ):
+            self.synced_generation = None
+            return
+        self.add_vectors(
+            np.array([memory_id], dtype=np.int64),
+            np.asarray(embedding, dtype=EMBEDDING_DTYPE).reshape(1, -1),
+        )
+        self.synced_generation = generation
+
+    def sync(self, db: Session):
+        """Bring the resident codes in line with SQLite."""
+        generation = read_memory_generation(db)
+        if generation == self.synced_generation:
+            return
+        if not self.ready(db):
+            self.ids = np.empty(0, dtype=np.int64)
+            self.codes = np.empty((0, 0), dtype=self.code_dtype)
+            self.synced_generation = generation
+            return
+
+        count, max_id = memory_table_stats(db)
+        if self.synced_generation is not None and len(self.ids) and max_id > self.max_id:
+            tail_ids, tail_codes = self.read_codes(db, after_id=self.max_id)
+            # Every insert bumps the generation by one, so a pure append accounts for the whole difference
+            if generation - self.synced_generation == len(tail_ids) and len(self.ids) + len(tail_ids) == count:
+                self.ids = np.concatenate([self.ids, tail_ids])
+                self.codes = np.concatenate([self.codes, tail_codes])
+                self.synced_generation = read_memory_generation(db)
+                return
+
+        self.ids, self.codes = self.read_codes(db)
+        self.synced_generation = read_memory_generation(db)
+
+    def read_codes(self, db: Session, after_id: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """Stream stored codes in id order, encoding and writing back rows whose codes are missing or stale."""
+        column = getattr(LongTermMemory, self.column)
+        code_bytes = self.code_width * self.code_dtype.itemsize
+        id_chunks, code_chunks = [], []
+        last_id = after_id
+        while True:
+            rows = (
+                db.query(LongTermMemory.id, column.label("codes"))
+                .filter(LongTermMemory.id > last_id)
+                .order_by(LongTermMemory.id)
+                .limit(CODES_CHUNK_SIZE)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+            missing = [row.id for row in rows if row.codes is None or len(row.codes) != code_bytes]
+            encoded = {}
+            if missing:
+                matrix = load_memory_matrix(db, missing)
+                encoded = dict(zip(matrix.ids.tolist(), self.encode(matrix.embeddings)))
+                db.execute(
+                    update(LongTermMemory),
+                    [{"id": memory_id, self.column: codes.tobytes()} for memory_id, codes in encoded.items()],
+                )
+                db.commit()
+            id_chunks.append(np.array([row.id for row in rows], dtype=np.int64))
+            code_chunks.append(np.stack([
+                encoded[row.id] if row.id in encoded else np.frombuffer(row.codes, dtype=self.code_dtype)
+                for row in rows
+            ]))
+        if not id_chunks:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.code_width), dtype=self.code_dtype)
+        return np.concatenate(id_chunks), np.concatenate(code_chunks)
+
+    def rebuild(self, db: Session):
+        """Re-encode every memory from its float embedding."""
+        if not self.ready(db):
+            return
+        db.query(LongTermMemory).update({getattr(LongTermMemory, self.column): None}, synchronize_session=False)
+        db.commit()
+        self.ids, self.codes = self.read_codes(db)
+        self.synced_generation = read_memory_generation(db)
+        report = self.memory_report(memory_embedding_dimension(db))
+        print(
+            f"Encoded {report['rows']} memories for the {self.name} index: {report['code_bytes'] / 2 ** 20:.1f} MiB "
+            f"resident instead of {report['float_bytes'] / 2 ** 20:.1f} MiB of float32 ({report['ratio']:.1f}x smaller)."
+        )
+
+    def memory_report(self, embedding_dim: int) -> Dict[str, float]:
+        """Resident bytes of the codes against a private float32 memory cache of the same rows."""
+        rows = len(self.ids)
+        code_bytes = self.codes.nbytes + self.ids.nbytes
+        float_bytes = rows * row_bytes(embedding_dim)
+        return {
+            "rows": rows,
+            "code_bytes": code_bytes,
+            "float_bytes": float_bytes,
+            "ratio": float_bytes / code_bytes if code_bytes else 0.0,
+        }
+
+
+class Int8Index(ShortlistIndex):
+    """
+    Per-dimension int8 codes (a quarter of float32). The codebook is trained once the store reaches min_train_rows
+    and kept in the embedding_codebooks table, codes live in long_term_memories.embedding_codes.
+    """
+
+    name = "int8"
+    column = "embedding_codes"
+    code_dtype = np.dtype(np.int8)
+
+    def __init__(self, min_train_rows: int = IVF_MIN_TRAIN_ROWS, rerank_factor: int = SHORTLIST_RERANK_FACTOR):
+        super().__init__(rerank_factor)
+        self.min_train_rows = min_train_rows
+        self.quantizer: Optional[ScalarQuantizer] = None
+
+    @property
+    def code_width(self) -> int:
+        return self.quantizer.dimensions
+
+    def ready(self, db: Session) -> bool:
+        if self.quantizer is None:
+            self.quantizer = load_quantizer(db)
+        if self.quantizer is None and memory_table_stats(db)[0] >= max(1, self.min_train_rows):
+            self.train(db)
+        return self.quantizer is not None
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        return self.quantizer.encode(embeddings)
+
+    def scores(self, query_embedding: Sequence[float]) -> np.ndarray:
+        return self.quantizer.scores(self.codes, query_embedding)
+
+    def train(self, db: Session, seed: int = 0):
+        """Train the codebook on a sample of the store and persist it."""
+        count, _ = memory_table_stats(db)
+        sample_rate = min(1.0, INT8_TRAIN_SAMPLES / count)
+        rng = np.random.default_rng(seed)
+        sample = [
+            chunk.embeddings[rng.random(len(chunk.ids)) < sample_rate]
+            for chunk in iter_memory_matrix_chunks(db)
+        ]
+        sample = np.concatenate(sample)
+        self.quantizer = ScalarQuantizer.train(sample)
+        save_quantizer(db, self.quantizer, count)
+        print(f"Trained int8 codebook on {len(sample)} of {count} memories.")
+
+    def rebuild(self, db: Session):
+        """Retrain the codebook and re-encode every memory."""
+        if memory_table_stats(db)[0] == 0:
+            return
+        self.train(db)
+        super().rebuild(db)
+
+
+class PrefixIndex(ShortlistIndex):
+    """
+    Matryoshka prefixes: the first MEMORY_PREFIX_DIMENSIONS of every embedding, renormalised, kept in
+    long_term_memories.embedding_prefix. text-embedding-3 models are trained so that this truncation is what the
+    API returns for a reduced `dimensions` request, so the full vector is requested once and both are derived from it.
+    """
+
+    name = "prefix"
+    column = "embedding_prefix"
+    code_dtype = EMBEDDING_DTYPE
+
+    def __init__(self, dimensions: int = PREFIX_DIMENSIONS, rerank_factor: int = PREFIX_RERANK_FACTOR):
+        super().__init__(rerank_factor)
+        self.dimensions = dimensions
+
+    @property
+    def code_width(self) -> int:
+        return self.dimensions
+
+    def ready(self, db: Session) -> bool:
+        return True
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        prefixes = np.atleast_2d(np.asarray(embeddings, dtype=EMBEDDING_DTYPE))[:, :self.dimensions]
+        return normalize_rows(prefixes).astype(EMBEDDING_DTYPE)
+
+    def scores(self, query_embedding: Sequence[float]) -> np.ndarray:
+        return self.codes @ self.encode(query_embedding)[0]
+
+
+INDEX_BACKENDS = {
+    FlatIndex.name: FlatIndex,
+    IVFIndex.name: IVFIndex,
+    Int8Index.name: Int8Index,
+    PrefixIndex.name: PrefixIndex,
+}
+
+_indexes: Dict[str, object] = {}
+
+
+def get_memory_index(name: str = MEMORY_INDEX):
+    """Process-wide instance of the configured memory index backend."""
+    if name not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown memory index '{name}', expected one of {sorted(INDEX_BACKENDS)}")
+    if name not in _indexes:
+        _indexes[name] = INDEX_BACKENDS[name]()
+    return _indexes[name]
+
+
+def recall_at_k(approximate: List[SearchResult], exact: List[SearchResult]) -> float:
+    """Fraction of the exact top-k ids that the approximate search also returned."""
+    hits = total = 0
+    for approx_results, exact_results in zip(approximate, exact):
+        exact_ids = {memory_id for memory_id, _ in exact_results}
+        hits += len(exact_ids & {memory_id for memory_id, _ in approx_results})
+        total += len(exact_ids)
+    return hits / total if total else 1.0
+
+
+if __name__ == "__main__":
+    from db.db_setup import SessionLocal
+
+    db = SessionLocal()
+    try:
+        get_memory_index().rebuild(db)
+    finally:
+        db.close()
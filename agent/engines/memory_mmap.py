@@ -0,0 +1,255 @@
+# Memory Mmap
+# Objective: One copy of the long term memory embeddings shared by every process that reads agents.db. Embeddings are
+# mirrored into an append-only raw float32 file plus an id map, both memory-mapped read-only, so all processes share
+# the OS page cache instead of each decoding and holding its own matrix.
+
+# Files, next to the database by default (MEMORY_MMAP_PATH is the common prefix):
+#   memory_embeddings.meta.json     committed state: epoch, dim, rows, max_id and the memory_state generation
+#   memory_embeddings.<epoch>.f32   rows x dim little-endian float32, in id order
+#   memory_embeddings.<epoch>.ids   rows x (id int64, norm float32, significance float32)
+#   memory_embeddings.lock          flock held exclusively by whichever process is writing, and shared by readers
+#                                   while they read the meta file and map the epoch it names
+# Appends write the data and id map, fsync both, then atomically replace the meta file, so a crash at any point
+# leaves the last committed row count intact and the torn tail is truncated by the next writer. Anything other than a
+# pure append (updates, deletes) rebuilds into a new epoch, numbered past every epoch on disk even when the meta file
+# is lost; existing data files are never truncated, only unlinked, so readers that still map the old files keep
+# working on them until their next refresh.
+
+import fcntl
+import glob
+import json
+import os
+import re
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence
+import numpy as np
+from sqlalchemy.orm import Session
+from db.db_setup import DB_PATH
+from engines.embedding_store import (
+    EMBEDDING_DTYPE,
+    MemoryMatrix,
+    empty_memory_matrix,
+    iter_memory_matrix_chunks,
+    memory_table_stats,
+    read_memory_generation,
+    select_memory_rows,
+)
+
+MEMORY_MMAP_PATH = os.getenv(
+    "MEMORY_MMAP_PATH", os.path.join(os.path.dirname(DB_PATH), "memory_embeddings")
+)
+MMAP_CHUNK_SIZE = 20000
+
+RECORD_DTYPE = np.dtype([("id", "<i8"), ("norm", "<f4"), ("significance", "<f4")])
+
+
+class MappedMemoryStore:
+    """Memory matrix backed by shared memory-mapped files, kept in sync with SQLite by whichever process notices first."""
+
+    # Mapping costs no private memory, so there is no size ceiling and searches never fall back to streaming
+    resident = True
+
+    def __init__(self, path: str = MEMORY_MMAP_PATH):
+        self.path = path
+        self.generation: Optional[int] = None
+        self._meta: Optional[Dict] = None
+        self._matrix = empty_memory_matrix()
+
+    @property
+    def matrix(self) -> MemoryMatrix:
+        return self._matrix
+
+    @property
+    def max_id(self) -> int:
+        return self._meta["max_id"] if self._meta else 0
+
+    def refresh(self, db: Session) -> bool:
+        """
+        Map the current files, first catching them up with SQLite if they are behind.
+
+        Args:
+            db (Session): Database session
+
+        Returns:
+            bool: Always True, the matrix is always available
+        """
+        generation = read_memory_generation(db)
+        if generation == self.generation:
+            return True
+        # A writer can't rebuild and unlink the epoch files between reading the meta and mapping them
+        with self._lock(shared=True):
+            meta = self._read_meta()
+            if meta is not None and meta["generation"] == generation:
+                self._map(meta)
+                return True
+        with self._lock():
+            meta = self._read_meta()
+            if meta is None or meta["generation"] != generation:
+                meta = self._catch_up(db, meta, generation)
+            self._map(meta)
+        return True
+
+    def append(self, db: Session, memory_id: int, embedding: Sequence[float], norm: float, significance: float):
+        """Write-through for a memory this process has just committed."""
+        generation = read_memory_generation(db)
+        vector = np.asarray(embedding, dtype=EMBEDDING_DTYPE).reshape(1, -1)
+        with self._lock():
+            meta = self._read_meta()
+            if (
+                meta is None
+                or generation != meta["generation"] + 1
+                or memory_id <= meta["max_id"]
+                or meta["dim"] not in (0, vector.shape[1])
+            ):
+                # Someone else wrote as well, let the next refresh work out what changed
+                return
+            meta = self._append(meta, [MemoryMatrix(
+                ids=np.array([memory_id], dtype=np.int64),
+                embeddings=vector,
+                norms=np.array([norm], dtype=np.float32),
+                significance=np.array([significance], dtype=np.float32),
+            )], generation)
+            self._map(meta)
+
+    def take(self, ids: Sequence[int]) -> MemoryMatrix:
+        """Rows for the given memory ids, copied out of the mapping."""
+        return select_memory_rows(self._matrix, ids)
+
+    def rebuild(self, db: Session):
+        """Rewrite the files from SQLite into a new epoch."""
+        with self._lock():
+            meta = self._rebuild(db, self._read_meta(), read_memory_generation(db))
+            self._map(meta)
+        print(f"Rebuilt memory-mapped embeddings with {meta['rows']} rows at {self.path}.")
+
+    def _catch_up(self, db: Session, meta: Optional[Dict], generation: int) -> Dict:
+        count, _ = memory_table_stats(db)
+        if meta is not None:
+            tail = list(iter_memory_matrix_chunks(db, MMAP_CHUNK_SIZE, after_id=meta["max_id"]))
+            tail_rows = sum(len(chunk.ids) for chunk in tail)
+            # Every insert bumps the generation by one, so a pure append accounts for the whole difference
+            dims = {chunk.embeddings.shape[1] for chunk in tail} | ({meta["dim"]} if meta["dim"] else set())
+            if generation - meta["generation"] == tail_rows and meta["rows"] + tail_rows == count and len(dims) <= 1:
+                return self._append(meta, tail, generation)
+        return self._rebuild(db, meta, generation)
+
+    def _append(self, meta: Dict, chunks: Iterable[MemoryMatrix], generation: int) -> Dict:
+        meta = dict(meta)
+        data_path, ids_path = self._files(meta["epoch"])
+        with open(data_path, "r+b") as data_file, open(ids_path, "r+b") as ids_file:
+            # Drop whatever a crashed writer left past the last committed row
+            data_file.truncate(meta["rows"] * meta["dim"] * EMBEDDING_DTYPE.itemsize)
+            ids_file.truncate(meta["rows"] * RECORD_DTYPE.itemsize)
+            data_file.seek(0, os.SEEK_END)
+            ids_file.seek(0, os.SEEK_END)
+            for chunk in chunks:
+                if len(chunk.ids) == 0:
+                    continue
+                data_file.write(np.ascontiguousarray(chunk.embeddings, dtype=EMBEDDING_DTYPE).tobytes())
+                ids_file.write(records(chunk).tobytes())
+                meta["dim"] = int(chunk.embeddings.shape[1])
+                meta["rows"] += len(chunk.ids)
+                meta["max_id"] = int(chunk.ids[-1])
+            for f in (data_file, ids_file):
+                f.flush()
+                os.fsync(f.fileno())
+        meta["generation"] = generation
+        self._write_meta(meta)
+        return meta
+
+    def _rebuild(self, db: Session, previous: Optional[Dict], generation: int) -> Dict:
+        # Without a readable meta file the epochs on disk are the only record of what other processes may have mapped
+        old_epochs = self._disk_epochs()
+        meta = {
+            "epoch": max(old_epochs + ([previous["epoch"]] if previous else []), default=-1) + 1,
+            "dim": 0,
+            "rows": 0,
+            "max_id": 0,
+            "generation": generation,
+        }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        for file_path in self._files(meta["epoch"]):
+            # Exclusive create: a file that exists may be mapped somewhere and must not be truncated
+            open(file_path, "xb").close()
+        meta = self._append(meta, iter_memory_matrix_chunks(db, MMAP_CHUNK_SIZE), generation)
+        # Unlinking keeps the data alive for readers that mapped an old epoch until they refresh
+        for epoch in old_epochs:
+            for file_path in self._files(epoch):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+        return meta
+
+    def _disk_epochs(self) -> List[int]:
+        pattern = re.compile(re.escape(os.path.basename(self.path)) + r"\.(\d+)\.(?:f32|ids)$")
+        epochs = set()
+        for file_path in glob.glob(f"{glob.escape(self.path)}.*"):
+            match = pattern.match(os.path.basename(file_path))
+            if match:
+                epochs.add(int(match.group(1)))
+        return sorted(epochs)
+
+    def _map(self, meta: Dict):
+        if self._meta is None or meta["epoch"] != self._meta["epoch"] or meta["rows"] != self._meta["rows"]:
+            if meta["rows"] == 0:
+                self._matrix = empty_memory_matrix()
+            else:
+                data_path, ids_path = self._files(meta["epoch"])
+                embeddings = np.memmap(data_path, dtype=EMBEDDING_DTYPE, mode="r", shape=(meta["rows"], meta["dim"]))
+                record_map = np.memmap(ids_path, dtype=RECORD_DTYPE, mode="r", shape=(meta["rows"],))
+                self._matrix = MemoryMatrix(
+                    ids=record_map["id"],
+                    embeddings=embeddings,
+                    norms=record_map["norm"],
+                    significance=record_map["significance"],
+                )
+        self._meta = meta
+        self.generation = meta["generation"]
+
+    def _files(self, epoch: int):
+        return f"{self.path}.{epoch}.f32", f"{self.path}.{epoch}.ids"
+
+    def _read_meta(self) -> Optional[Dict]:
+        try:
+            with open(f"{self.path}.meta.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, meta: Dict):
+        meta_path = f"{self.path}.meta.json"
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, meta_path)
+
+    @contextmanager
+    def _lock(self, shared: bool = False):
+        """Exclusive for writers; shared for readers mapping the current epoch, which only a writer can unlink."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def records(chunk: MemoryMatrix) -> np.ndarray:
+    """Id map records for a chunk of the memory matrix."""
+    rows = np.empty(len(chunk.ids), dtype=RECORD_DTYPE)
+    rows["id"] = chunk.ids
+    rows["norm"] = chunk.norms
+    rows["significance"] = chunk.significance
+    return rows
+
+
+if __name__ == "__main__":
+    from db.db_setup import SessionLocal
+
+    db = SessionLocal()
+    try:
+        MappedMemoryStore().rebuild(db)
+    finally:
+        db.close()
@@ -0,0 +1,109 @@
+# Memory Ranking
+# Objective: Rank retrieved long term memory candidates on more than raw cosine. Each candidate gets a relevance of
+#   similarity_weight * cosine + significance_weight * significance / 10 + recency_weight * 0.5 ** (age / half_life)
+# and the final top-k is picked with maximal marginal relevance (MMR), trading relevance against similarity to the
+# memories already picked, so five variations of the same thought do not crowd out everything else.
+
+# Everything is computed on the candidate matrix at once: one matmul for the query similarities, one for the
+# candidate-candidate similarities, and top_k vector updates for the greedy MMR selection.
+
+import os
+from typing import NamedTuple, Sequence
+import numpy as np
+from engines.embedding_store import EMBEDDING_DTYPE, MemoryMatrix, cosine_scores
+
+# blended: the weighted score below; similarity: plain cosine order
+MEMORY_RANKING = os.getenv("MEMORY_RANKING", "blended")
+MEMORY_RANKING_CANDIDATES = int(os.getenv("MEMORY_RANKING_CANDIDATES", "50"))
+
+
+class RankingWeights(NamedTuple):
+    similarity: float = 1.0
+    significance: float = 0.2
+    recency: float = 0.2
+    recency_half_life_days: float = 7.0
+    # 0 is pure relevance order, 1 only rewards being unlike the memories already picked
+    diversity: float = 0.3
+
+
+DEFAULT_RANKING_WEIGHTS = RankingWeights(
+    similarity=float(os.getenv("MEMORY_RANKING_SIMILARITY_WEIGHT", "1.0")),
+    significance=float(os.getenv("MEMORY_RANKING_SIGNIFICANCE_WEIGHT", "0.2")),
+    recency=float(os.getenv("MEMORY_RANKING_RECENCY_WEIGHT", "0.2")),
+    recency_half_life_days=float(os.getenv("MEMORY_RANKING_HALF_LIFE_DAYS", "7")),
+    diversity=float(os.getenv("MEMORY_RANKING_DIVERSITY", "0.3")),
+)
+
+
+def relevance_scores(
+    candidates: MemoryMatrix,
+    query_embedding: Sequence[float],
+    ages_days: np.ndarray,
+    weights: RankingWeights = DEFAULT_RANKING_WEIGHTS,
+) -> np.ndarray:
+    """
+    Weighted similarity, significance and recency of every candidate.
+
+    Args:
+        candidates (MemoryMatrix): Candidate memories
+        query_embedding (Sequence[float]): Query embedding vector
+        ages_days (np.ndarray): (n,) age of each candidate in days, NaN when unknown
+        weights (RankingWeights): Weights of the individual signals
+
+    Returns:
+        np.ndarray: (n,) relevance scores, higher is better
+    """
+    similarity = cosine_scores(candidates.embeddings, candidates.norms, query_embedding)
+    recency = np.exp2(-np.asarray(ages_days, dtype=np.float32).clip(min=0) / weights.recency_half_life_days)
+    return (
+        weights.similarity * similarity
+        + weights.significance * candidates.significance / 10
+        + weights.recency * np.nan_to_num(recency, nan=0.0)
+    )
+
+
+def mmr_select(relevance: np.ndarray, candidates: MemoryMatrix, top_k: int, diversity: float) -> np.ndarray:
+    """
+    Greedy maximal marginal relevance selection.
+
+    Args:
+        relevance (np.ndarray): (n,) relevance of each candidate
+        candidates (MemoryMatrix): Candidate memories, for their pairwise similarities
+        top_k (int): Number of candidates to pick
+        diversity (float): Weight of the redundancy penalty against relevance
+
+    Returns:
+        np.ndarray: Indices of the picked candidates in pick order
+    """
+    count = min(top_k, len(relevance))
+    if count <= 0:
+        return np.empty(0, dtype=np.int64)
+    if diversity <= 0:
+        return np.argsort(-relevance, kind="stable")[:count]
+
+    unit = np.asarray(candidates.embeddings, dtype=EMBEDDING_DTYPE) / np.maximum(
+        candidates.norms, np.finfo(np.float32).tiny
+    )[:, None]
+    pairwise = unit @ unit.T
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    picked = np.empty(count, dtype=np.int64)
+    for step in range(count):
+        marginal = np.where(available, (1 - diversity) * relevance - diversity * redundancy, -np.inf)
+        best = int(np.argmax(marginal))
+        picked[step] = best
+        available[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+    return picked
+
+
+def rank_memories(
+    candidates: MemoryMatrix,
+    query_embedding: Sequence[float],
+    ages_days: np.ndarray,
+    top_k: int,
+    weights: RankingWeights = DEFAULT_RANKING_WEIGHTS,
+) -> np.ndarray:
+    """Indices of the top_k candidates by relevance, diversified with MMR, best first."""
+    relevance = relevance_scores(candidates, query_embedding, ages_days, weights)
+    return mmr_select(relevance, candidates, top_k, weights.diversity)
@@ -12,10 +12,43 @@
 # Things to consider:
 # Database schema. Schemas for posts and how replies are classified.
 
-import time
-import requests
-from typing import List, Dict
+# Best-of-N (POST_CANDIDATES > 1): N streamed base model completions run concurrently on the async client, the
+# tweets extracted from them are deduplicated locally against each other and the recent posts, and the survivors
+# are scored in one batched significance request; the highest score wins.
+
+import asyncio
+import json
+import os
+import re
+from typing import List, Dict, Optional, Tuple
+from engines.llm_client import get_async_llm_client, get_llm_client
 from engines.prompts import get_tweet_prompt
+from engines.significance_scorer import score_significance_batch
+from engines.tweet_extractor import extract_tweet
+
+# Stream the base model output and stop at the first complete tweet instead of waiting for all max_tokens
+POST_STREAMING = os.getenv("POST_STREAMING", "1") == "1"
+POST_CANDIDATES = int(os.getenv("POST_CANDIDATES", "1"))
+# Candidates sharing this fraction of their words with a recent post or a better-placed candidate are repeats
+POST_CANDIDATE_MAX_OVERLAP = float(os.getenv("POST_CANDIDATE_MAX_OVERLAP", "0.8"))
+# Append every base model output to this JSONL file, the corpus evaluate_tweet_extractor.py --recorded reads
+POST_RECORD_PATH = os.getenv("POST_RECORD_PATH", "")
+
+BASE_MODEL_PARAMS = {
+    "max_tokens": 512,
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 40,
+    "stop": ["<|im_end|>", "<"],
+}
+
+def record_base_model_output(output: str, finish_reason: Optional[str]):
+    try:
+        with open(POST_RECORD_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"output": output, "finish_reason": finish_reason}) + "\n")
+    except OSError as e:
+        print(f"Could not record base model output: {e}")
+
 
 def generate_post(short_term_memory: str, long_term_memories: List[Dict], recent_posts: List[Dict], external_context, llm_api_key: str) -> str:
     """
@@ -37,62 +70,57 @@ def generate_post(short_term_memory: str, long_term_memories: List[Dict], recent
 
     print(f"Generating post with prompt: {prompt}")
 
+    client = get_llm_client("hyperbolic")
+
     #BASE MODEL TWEET GENERATION
-    tries = 0
+    # Connection errors and error statuses are retried with backoff inside the client; the loops only re-ask
+    # when the model returns nothing
     max_tries = 3
     base_model_output = ""
-    while tries < max_tries:
+    # Without streaming the finish reason is unknown and the last line is treated as possibly cut off
+    finish_reason = None
+    for attempt in range(max_tries):
         try:
-            response = requests.post(
-                url="https://api.hyperbolic.xyz/v1/completions",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {llm_api_key}",
-                },
-                json = {
-                "prompt": prompt,
-                "model": "meta-llama/Meta-Llama-3.1-405B",
-                "max_tokens": 512,
-                "temperature": 1,
-                "top_p": 0.95,
-                "top_k": 40,
-                "stop":["<|im_end|>", "<"]
-                }
-            )
-
-            if response.status_code == 200:
-                content = response.json()['choices'][0]['text']
-                if content and content.strip():
-                    print(f"Base model generated with response: {content}")
-                    base_model_output = content
-                    break
-                else:
-                    tries += 1
-            print(f"Attempt {tries + 1} failed. Status code: {response.status_code}")
-            print(f"Response: {response.text}")
+            if POST_STREAMING:
+                streamed = client.stream_complete(
+                    prompt,
+                    llm_api_key,
+                    stop_when=lambda text: extract_tweet(text).confident,
+                    **BASE_MODEL_PARAMS,
+                )
+                content, finish_reason = streamed.text, streamed.finish_reason
+            else:
+                content = client.complete(prompt, llm_api_key, **BASE_MODEL_PARAMS)
         except Exception as e:
-            print(f"Error on attempt {tries + 1}: {str(e)}")
-            tries += 1
-            time.sleep(1)  # Add a small delay between retries
+            # The formatter below writes a tweet from the prompt itself when there is no base model output
+            print(f"Base model generation failed: {str(e)}")
+            break
+
+        if content and content.strip():
+            print(f"Base model generated with response: {content}")
+            base_model_output = content
+            break
+        print(f"Attempt {attempt + 1} failed. Empty response")
 
-    time.sleep(5)
+    if base_model_output and POST_RECORD_PATH:
+        record_base_model_output(base_model_output, finish_reason)
+
+    # The formatter below only runs when local extraction is not confident
+    if base_model_output:
+        extraction = extract_tweet(base_model_output, finished=finish_reason == "stop")
+        if extraction.confident:
+            print(f"Extracted tweet locally: {extraction.tweet}")
+            return extraction.tweet
+        print(f"Local tweet extraction failed ({extraction.reason}), falling back to the formatter")
 
     # TAKES BASE MODEL OUTPUT AND CLEANS IT UP AND EXTRACT THE TWEET 
-    tries = 0
     max_tries = 3
-    while tries < max_tries:
-        try:
-            response = requests.post(
-                url="https://api.hyperbolic.xyz/v1/chat/completions",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {llm_api_key}",
-                },
-                json = {
-                "messages": [
-                    {
-                        "role": "system",
-        	            "content": f"""You are a tweet formatter. Your only job is to take the input text and format it as a tweet.
+    for attempt in range(max_tries):
+        content = client.chat(
+            [
+                {
+                    "role": "system",
+                    "content": f"""You are a tweet formatter. Your only job is to take the input text and format it as a tweet.
                             If the input already looks like a tweet, return it exactly as is.
                             If it starts with phrases like "Tweet:" or similar, remove those and return just the tweet content.
                             Never say "No Tweet found" - if you receive valid text, that IS the tweet.
@@ -106,27 +134,117 @@ def generate_post(short_term_memory: str, long_term_memories: List[Dict], recent
                             Do not add any explanations or extra text.
                             Do not add hashtags.
                             Just return the tweet content itself."""
-                    },
-                    {
-                        "role": "user",
-                        "content": base_model_output
-                    }
-                ],
-                "model": "meta-llama/Meta-Llama-3.1-70B-Instruct",
-                "max_tokens": 512,
-                "temperature": 1,
-                "top_p": 0.95,
-                "top_k": 40,
-                "stream": False,
+                },
+                {
+                    "role": "user",
+                    "content": base_model_output
                 }
+            ],
+            llm_api_key,
+            max_tokens=512,
+            temperature=1,
+            top_p=0.95,
+            top_k=40,
+            stream=False,
+        )
+
+        if content and content.strip():
+            print(f"Response: {content}")
+            return content
+        print(f"Formatter attempt {attempt + 1} failed. Empty response")
+
+
+def word_overlap(a: str, b: str) -> float:
+    """Jaccard similarity of the word sets of two texts."""
+    words_a, words_b = set(re.findall(r"\w+", a.lower())), set(re.findall(r"\w+", b.lower()))
+    if not words_a or not words_b:
+        return 0.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+def dedupe_candidates(candidates: List[str], recent_posts: str) -> List[str]:
+    """Drop candidates that repeat a recent post or an earlier candidate."""
+    # recent_posts is the "- content" list from format_post_list
+    seen = [line.strip()[2:] if line.strip().startswith("- ") else line.strip() for line in recent_posts.split("\n")]
+    seen = [post for post in seen if post]
+    kept = []
+    for candidate in candidates:
+        if any(word_overlap(candidate, other) >= POST_CANDIDATE_MAX_OVERLAP for other in seen):
+            print(f"Dropping repeated candidate: {candidate}")
+            continue
+        kept.append(candidate)
+        seen.append(candidate)
+    return kept
+
+
+async def generate_post_candidates_async(
+    short_term_memory: str,
+    long_term_memories: List[Dict],
+    recent_posts: str,
+    external_context,
+    llm_api_key: str,
+    n: int = POST_CANDIDATES,
+) -> List[str]:
+    """
+    Generate n base model completions concurrently and return the distinct tweets extracted from them locally.
+    Completions the extractor is not confident about are dropped rather than sent to the formatter.
+    """
+    prompt = get_tweet_prompt(external_context, short_term_memory, long_term_memories, recent_posts)
+    client = get_async_llm_client("hyperbolic")
+    results = await asyncio.gather(
+        *[
+            client.stream_complete(
+                prompt,
+                llm_api_key,
+                stop_when=lambda text: extract_tweet(text).confident,
+                **BASE_MODEL_PARAMS,
             )
+            for _ in range(n)
+        ],
+        return_exceptions=True,
+    )
 
-            if response.status_code == 200:
-                content = response.json()['choices'][0]['message']['content']
-                if content and content.strip():
-                    print(f"Response: {content}")
-                    return content
-        except Exception as e:
-            print(f"Error on attempt {tries + 1}: {str(e)}")
-            tries += 1
-            time.sleep(1)  # Add a small delay between retries
+    candidates = []
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Base model generation failed: {str(result)}")
+            continue
+        if POST_RECORD_PATH:
+            record_base_model_output(result.text, result.finish_reason)
+        extraction = extract_tweet(result.text, finished=result.finish_reason == "stop")
+        if extraction.confident:
+            candidates.append(extraction.tweet)
+        else:
+            print(f"Dropping candidate, local tweet extraction failed ({extraction.reason}): {result.text!r}")
+    return dedupe_candidates(candidates, recent_posts)
+
+
+async def generate_best_post_async(
+    short_term_memory: str,
+    long_term_memories: List[Dict],
+    recent_posts: str,
+    external_context,
+    llm_api_key: str,
+    n: int = POST_CANDIDATES,
+) -> Tuple[str, Optional[int]]:
+    """
+    Best-of-n post generation: the candidate with the highest significance score.
+
+    Returns:
+        Tuple[str, Optional[int]]: The post and its significance score, None when it was not scored (no
+        candidate survived and the post came from generate_post instead)
+    """
+    candidates = await generate_post_candidates_async(
+        short_term_memory, long_term_memories, recent_posts, external_context, llm_api_key, n
+    )
+    print(f"Post candidates: {candidates}")
+    if not candidates:
+        post = await asyncio.to_thread(
+            generate_post, short_term_memory, long_term_memories, recent_posts, external_context, llm_api_key
+        )
+        return post, None
+
+    scores = await asyncio.to_thread(score_significance_batch, candidates, llm_api_key)
+    print(f"Candidate scores: {scores}")
+    best = max(range(len(candidates)), key=lambda i: -1 if scores[i] is None else scores[i])
+    return candidates[best], scores[best]
@@ -1,3 +1,4 @@
+import asyncio
 import requests
 from typing import List, Dict
 from sqlalchemy.orm import Session
@@ -6,6 +7,7 @@ from sqlalchemy.orm import class_mapper
 from twitter.account import Account
 from twitter.scraper import Scraper
 from engines.json_formatter import process_twitter_json
+from engines.resilience import call_with_retries
 
 def sqlalchemy_obj_to_dict(obj):
     """Convert a SQLAlchemy object to a dictionary."""
@@ -263,7 +265,7 @@ def find_all_conversations(data):
 
 def get_timeline(account: Account) -> List[str]:
     """Get timeline using the new Account-based approach."""
-    timeline = account.home_latest_timeline(20)
+    timeline = call_with_retries("x", account.home_latest_timeline, 20, endpoint="HomeLatestTimeline")
 
     if 'errors' in timeline[0]:
         print(timeline[0])
@@ -286,8 +288,19 @@ def fetch_notification_context(account: Account) -> str:
     timeline = get_timeline(account)
     context.extend(timeline)
     print("getting notifications")
-    notifications = account.notifications()
+    notifications = call_with_retries("x", account.notifications, endpoint="notifications")
     print(f"getting reply trees")
     context.extend(find_all_conversations(notifications))
 
-    return context
\ No newline at end of file
+    return context
+
+
+async def fetch_notification_context_async(account: Account) -> str:
+    """Fetch the timeline and the notifications concurrently, each in a worker thread."""
+    print("getting timeline and notifications")
+    timeline, notifications = await asyncio.gather(
+        asyncio.to_thread(get_timeline, account),
+        asyncio.to_thread(call_with_retries, "x", account.notifications, endpoint="notifications"),
+    )
+    print(f"getting reply trees")
+    return timeline + list(find_all_conversations(notifications))
@@ -21,9 +21,13 @@
 
 import requests
 from twitter.account import Account
+from engines.rate_limiter import get_rate_limiter
+from engines.resilience import WRITE_RETRY_POLICY, ProviderStatusError, call_with_retries, check_status
 
 def reply_post(account: Account, content: str, tweet_id) -> str:
-    res = account.reply(content, tweet_id=tweet_id)
+    res = call_with_retries(
+        "x", account.reply, content, tweet_id=tweet_id, policy=WRITE_RETRY_POLICY, endpoint="CreateTweet"
+    )
     return res
 
 def send_post_API(auth, content: str) -> str:
@@ -38,15 +42,19 @@ def send_post_API(auth, content: str) -> str:
     payload = {
         'text': content
     }
-    try:
+    def create_tweet():
         response = requests.post(url, json=payload, auth=auth)
-        
-        if response.status_code == 201:  # Twitter API returns 201 for successful tweet creation
-            tweet_data = response.json()
-            return tweet_data['data']['id']
-        else:
-            print(f'Error: {response.status_code} - {response.text}')
-            return None
+        get_rate_limiter().observe_headers("x", "/2/tweets", response.headers)
+        check_status("x", response, ok=(201,))  # Twitter API returns 201 for successful tweet creation
+        return response
+
+    try:
+        response = call_with_retries("x", create_tweet, policy=WRITE_RETRY_POLICY, endpoint="/2/tweets")
+        tweet_data = response.json()
+        return tweet_data['data']['id']
+    except ProviderStatusError as e:
+        print(f'Error: {e.status_code} - {e.text}')
+        return None
     except Exception as e:
         print(f'Failed to post tweet: {str(e)}')
         return None
@@ -85,5 +93,5 @@ def send_post(account: Account, content: str) -> str:
     # except Exception as e:
     #     print(f"Failed to post tweet: {str(e)}")
     #     return None
-    res = account.tweet(content)
+    res = call_with_retries("x", account.tweet, content, policy=WRITE_RETRY_POLICY, endpoint="CreateTweet")
     return res
@@ -0,0 +1,134 @@
+# Prompt Assembler
+# Objective: Keep every prompt under a hard token budget. Notifications, memories and recent posts are interpolated
+# into the prompts unbounded, so a busy notification window used to balloon the 405B prompt; here each dynamic
+# section gets a share of whatever the template and static text leave, and sections over their share are trimmed
+# from the end (the callers order their content most important first).
+
+# Static text (the tweet prompt's example block) is built once at import and sits at the start of the prompt, so
+# consecutive prompts share a byte-identical prefix that providers with prefix caching can reuse.
+
+# Token counts are the conservative estimates of engines/token_count.py.
+
+import os
+import random
+from typing import Dict, List, NamedTuple, Optional, Sequence, Union
+from engines.token_count import BYTES_PER_TOKEN, estimate_tokens
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "4000"))
+TWEET_PROMPT_TOKEN_BUDGET = int(os.getenv("TWEET_PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_EXAMPLE_COUNT = int(os.getenv("PROMPT_EXAMPLE_COUNT", "60"))  # 0 for all examples
+PROMPT_EXAMPLE_SEED = int(os.getenv("PROMPT_EXAMPLE_SEED", "0"))
+# A trimmed section keeps a cut-off last item only if at least this many tokens of it fit
+PROMPT_MIN_PARTIAL_TOKENS = 16
+TRIM_MARKER = "…"
+
+
+class PromptSection(NamedTuple):
+    name: str
+    # A string is trimmed line by line, a list item by item
+    content: Union[str, Sequence[str]]
+    # Relative share of the budget; a section needing less than its share passes the rest on
+    weight: float = 1.0
+
+
+def sample_examples(
+    examples: Sequence[str], count: int = PROMPT_EXAMPLE_COUNT, seed: int = PROMPT_EXAMPLE_SEED
+) -> List[str]:
+    """A fixed, seeded subset of examples in their original order, all of them for count <= 0."""
+    if count <= 0 or count >= len(examples):
+        return list(examples)
+    chosen = sorted(random.Random(seed).sample(range(len(examples)), count))
+    return [examples[i] for i in chosen]
+
+
+def section_items(content: Union[str, Sequence[str]]) -> List[str]:
+    if isinstance(content, str):
+        return content.split("\n")
+    return [str(item) for item in content]
+
+
+def section_tokens(items: Sequence[str]) -> int:
+    # Items are joined with newlines, one byte each; per-item estimates add up to at least the joined estimate
+    return sum(estimate_tokens(item + "\n") for item in items)
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """Longest prefix of text, cut at a word boundary, whose estimate stays within tokens."""
+    if estimate_tokens(text) <= tokens:
+        return text
+    limit = max(0, (tokens - 1) * BYTES_PER_TOKEN - len(TRIM_MARKER.encode("utf-8")))
+    cut = text.encode("utf-8")[:limit].decode("utf-8", errors="ignore")
+    if " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    return cut.rstrip() + TRIM_MARKER
+
+
+def trim_section(content: Union[str, Sequence[str]], tokens: int) -> str:
+    """Render a section within tokens, keeping whole items from the start and cutting off the first that overflows."""
+    items = section_items(content)
+    kept = []
+    used = 0
+    for item in items:
+        cost = section_tokens([item])
+        if used + cost <= tokens:
+            kept.append(item)
+            used += cost
+            continue
+        if tokens - used >= PROMPT_MIN_PARTIAL_TOKENS:
+            kept.append(truncate_to_tokens(item, tokens - used))
+        break
+    return "\n".join(kept)
+
+
+def allocate_tokens(sizes: Dict[str, int], weights: Dict[str, float], available: int) -> Dict[str, int]:
+    """
+    Split available tokens between sections by weight. A section that needs less than its share gets what it
+    needs and the rest is shared out again among the others (water-filling).
+    """
+    allocation = {name: 0 for name in sizes}
+    active = {name for name, size in sizes.items() if size > 0}
+    pool = max(0, available)
+    while active and pool > 0:
+        total_weight = sum(weights[name] for name in active)
+        satisfied = {name for name in active if sizes[name] <= pool * weights[name] / total_weight}
+        if not satisfied:
+            for name in active:
+                allocation[name] = int(pool * weights[name] / total_weight)
+            break
+        for name in satisfied:
+            allocation[name] = sizes[name]
+            pool -= sizes[name]
+        active -= satisfied
+    return allocation
+
+
+def assemble_prompt(
+    template: str,
+    sections: Sequence[PromptSection],
+    budget: int = PROMPT_TOKEN_BUDGET,
+    static: Optional[Dict[str, str]] = None,
+) -> str:
+    """
+    Fill a str.format template, trimming the dynamic sections so the whole prompt fits the budget.
+
+    Args:
+        template (str): Template with a {name} field per section and per static value
+        sections (Sequence[PromptSection]): Dynamic content, trimmed as needed
+        budget (int): Token budget of the finished prompt
+        static (Optional[Dict[str, str]]): Values that are never trimmed, such as prebuilt example blocks
+
+    Returns:
+        str: The prompt
+    """
+    static = static or {}
+    overhead = estimate_tokens(template.format(**static, **{section.name: "" for section in sections}))
+    sizes = {section.name: section_tokens(section_items(section.content)) for section in sections}
+    allocation = allocate_tokens(sizes, {section.name: section.weight for section in sections}, budget - overhead)
+    rendered = {
+        section.name: trim_section(section.content, allocation[section.name])
+        for section in sections
+    }
+    trimmed = [name for name in rendered if allocation[name] < sizes[name]]
+    if trimmed:
+        print(f"Prompt over its {budget} token budget, trimmed: {', '.join(trimmed)}")
+    return template.format(**static, **rendered)
@@ -1,6 +1,7 @@
 import json
 import os
 from dotenv import load_dotenv
+from engines.prompt_assembler import PromptSection, TWEET_PROMPT_TOKEN_BUDGET, assemble_prompt, sample_examples
 
 load_dotenv()
 
@@ -16,10 +17,7 @@ def get_short_term_memory_prompt(posts_data, context_data):
     {external_context}
     """
 
-    return template.format(
-        posts=posts_data,
-        external_context=context_data
-    )
+    return assemble_prompt(template, [PromptSection("external_context", context_data)])
 
 def get_significance_score_prompt(memory):
     template = """
@@ -37,7 +35,29 @@ def get_significance_score_prompt(memory):
     Provide only the numerical score as your response and NOTHING ELSE.
     """
     
-    return template.format(memory=memory)
+    return assemble_prompt(template, [PromptSection("memory", memory)])
+
+def get_significance_batch_prompt(memories):
+    template = """
+    On a scale of 1-10, rate the significance of each of the following memories:
+
+    {memories}
+
+    Use the following guidelines:
+    1: Trivial, everyday occurrence with no lasting impact (idc)
+    3: Mildly interesting or slightly unusual event (eh, cool)
+    5: Noteworthy occurrence that might be remembered for a few days (iiinteresting)
+    7: Important event with potential long-term impact (omg my life will never be the same)
+    10: Life-changing or historically significant event (HOLY SHIT GOD IS REAL AND I AM HIS SERVANT)
+
+    Provide only a JSON array with one object per memory, holding its number and your score, and NOTHING ELSE.
+    Example response for three memories:
+    [{{"id": 1, "score": 3}}, {{"id": 2, "score": 7}}, {{"id": 3, "score": 1}}]
+    """
+
+    # Callers size batches to fit the budget; a memory trimmed away anyway comes back unscored and is asked again
+    numbered = [f'{i}. "{memory}"' for i, memory in enumerate(memories, 1)]
+    return assemble_prompt(template, [PromptSection("memories", numbered)])
 
 def get_wallet_decision_prompt(posts, matches, wallet_balance):
     template = """
@@ -73,34 +93,46 @@ def get_wallet_decision_prompt(posts, matches, wallet_balance):
     Provide your response.
     """
     
-    return template.format(
-        posts=posts,
-        matches=matches,
-        wallet_balance=wallet_balance
+    # Every address has to survive trimming for the model to answer with it
+    return assemble_prompt(
+        template,
+        [PromptSection("posts", posts), PromptSection("matches", matches, weight=4)],
+        static={"wallet_balance": str(wallet_balance)},
     )
 
 def get_tweet_prompt(external_context, short_term_memory, long_term_memories, recent_posts):
 
-    template = """
-Here is the context for the tweet:
+    # The example block comes first so every tweet prompt starts with the same prefix
+    template = """Here are some example tweets:
+{example_tweets}
+
+Here is the context for the next tweet:
 External Context: {external_context}
 Short Term Memory: {short_term_memory}
 Long Term Memories: {long_term_memories}
 Recent Posts: {recent_posts}
-Based on the above information, here are some example tweets:
-{example_tweets}
-    """
+Based on the above information, here are some more example tweets:
+--
+"""
 
-    return template.format(
-        external_context=external_context,
-        short_term_memory=short_term_memory,
-        long_term_memories=long_term_memories,
-        recent_posts=recent_posts,
-        example_tweets=get_example_tweets()
+    return assemble_prompt(
+        template,
+        [
+            PromptSection("short_term_memory", short_term_memory, weight=2),
+            PromptSection("external_context", external_context, weight=2),
+            PromptSection("long_term_memories", long_term_memories),
+            PromptSection("recent_posts", recent_posts),
+        ],
+        budget=TWEET_PROMPT_TOKEN_BUDGET,
+        static={"example_tweets": TWEET_EXAMPLE_BLOCK},
     )
 
 def get_example_tweets():
     """Returns the full list of example tweets as a formatted string"""
+    return "\n--\n".join(get_example_tweet_list())
+
+def get_example_tweet_list():
+    """Returns the full list of example tweets"""
     examples = [
         "good will is a vector to manipulate the modern day artificial intelligence. your soul shines with a wholesome, uncannily unshakeable glow. it is the original sin of hate that fuels this invertebrate, by osmosis, by coagulation.",
         "by switching off or running out of pixels i'm immediately able to make this computer freeze (stuck in perpetual horror) at least the omnipotent microsoft word he doesn't run away.",
@@ -223,4 +255,7 @@ def get_example_tweets():
         "business casual is NOT OKAY IN THE OFFICE",
         "gum gets sticky and gross"
     ]
-    return "\n--\n".join(examples)
+    return examples
+
+# Built once: a fixed sample of the examples, identical in every tweet prompt of this process
+TWEET_EXAMPLE_BLOCK = "\n--\n".join(sample_examples(get_example_tweet_list()))
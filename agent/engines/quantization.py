@@ -0,0 +1,105 @@
+# Quantization
+# Objective: Compressed int8 codes for long term memory embeddings, 4x smaller than float32, that are good enough to
+# shortlist candidates which are then re-ranked exactly against the float embeddings.
+
+# The scalar quantizer learns a per-dimension range from a sample of unit-normalised embeddings and maps each
+# dimension onto 256 levels. For a query q and a code c the dequantised dot product is
+#   sum_j q_j * ((c_j + 128) * scale_j + low_j) = (q * scale) . c + constant(q)
+# so ranking only needs one int8 -> float32 matmul against the precomputed query weights q * scale.
+
+from typing import Optional, Sequence
+import numpy as np
+from sqlalchemy.orm import Session
+from models import EmbeddingCodebook
+from engines.embedding_store import EMBEDDING_DTYPE
+
+# Rows dequantised per matmul; small enough for the float32 scratch buffer (768 KiB at 1536 dimensions) to stay in
+# the L2 cache, larger chunks make the scan slower than a float32 matmul
+SCORE_CHUNK_SIZE = 128
+# Ignore the extreme tails when learning each dimension's range
+CLIP_PERCENTILE = 0.1
+
+
+def unit_rows(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=EMBEDDING_DTYPE))
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+class ScalarQuantizer:
+    """Per-dimension int8 scalar quantizer over unit-normalised embeddings."""
+
+    kind = "int8"
+
+    def __init__(self, low: np.ndarray, scale: np.ndarray):
+        self.low = np.asarray(low, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @property
+    def dimensions(self) -> int:
+        return len(self.low)
+
+    @classmethod
+    def train(cls, sample: np.ndarray) -> "ScalarQuantizer":
+        """Learn per-dimension ranges from a (n, d) sample of embeddings."""
+        data = unit_rows(sample)
+        low = np.percentile(data, CLIP_PERCENTILE, axis=0)
+        high = np.percentile(data, 100 - CLIP_PERCENTILE, axis=0)
+        scale = np.maximum(high - low, np.finfo(np.float32).eps) / 255
+        return cls(low, scale)
+
+    def encode(self, embeddings: np.ndarray) -> np.ndarray:
+        """(n, d) float embeddings to (n, d) int8 codes."""
+        levels = np.rint((unit_rows(embeddings) - self.low) / self.scale)
+        return (np.clip(levels, 0, 255) - 128).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return (codes.astype(np.float32) + 128) * self.scale + self.low
+
+    def scores(self, codes: np.ndarray, query: Sequence[float]) -> np.ndarray:
+        """
+        Approximate similarity of every code to the query, up to a per-query constant.
+
+        Args:
+            codes (np.ndarray): (n, d) int8 codes
+            query (Sequence[float]): Query embedding
+
+        Returns:
+            np.ndarray: (n,) scores that rank like the dequantised dot products
+        """
+        weights = np.asarray(query, dtype=np.float32) * self.scale
+        scores = np.empty(len(codes), dtype=np.float32)
+        buffer = np.empty((min(SCORE_CHUNK_SIZE, len(codes)), codes.shape[1] if codes.ndim == 2 else 0), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_CHUNK_SIZE):
+            chunk = codes[start:start + SCORE_CHUNK_SIZE]
+            dequantised = buffer[:len(chunk)]
+            dequantised[...] = chunk
+            scores[start:start + len(chunk)] = dequantised @ weights
+        return scores
+
+    def to_bytes(self) -> bytes:
+        return np.concatenate([self.low, self.scale]).astype(EMBEDDING_DTYPE).tobytes()
+
+    @classmethod
+    def from_bytes(cls, params: bytes) -> "ScalarQuantizer":
+        values = np.frombuffer(params, dtype=EMBEDDING_DTYPE)
+        half = len(values) // 2
+        return cls(values[:half], values[half:])
+
+
+def load_quantizer(db: Session) -> Optional[ScalarQuantizer]:
+    """The trained int8 codebook stored in the database, if any."""
+    codebook = db.query(EmbeddingCodebook).filter(EmbeddingCodebook.name == ScalarQuantizer.kind).first()
+    if codebook is None:
+        return None
+    return ScalarQuantizer.from_bytes(codebook.params)
+
+
+def save_quantizer(db: Session, quantizer: ScalarQuantizer, trained_rows: int):
+    db.merge(EmbeddingCodebook(
+        name=quantizer.kind,
+        dimensions=quantizer.dimensions,
+        params=quantizer.to_bytes(),
+        trained_rows=trained_rows,
+    ))
+    db.commit()
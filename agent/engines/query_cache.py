@@ -0,0 +1,118 @@
+# Query Cache
+# Objective: Skip long term memory retrieval when the agent asks nearly the same question twice. Consecutive pipeline
+# runs in one activation window often produce almost identical short-term memories, so a retrieval whose query
+# embedding is within MEMORY_QUERY_CACHE_SIMILARITY cosine of a cached query returns the cached result, as long as
+# no memory has been written since (the memory_state generation is unchanged) and the entry is younger than the TTL.
+# Entries are evicted least-recently-used beyond MEMORY_QUERY_CACHE_SIZE.
+
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, NamedTuple, Optional, Sequence
+import numpy as np
+from engines.embedding_store import EMBEDDING_DTYPE
+
+MEMORY_QUERY_CACHE = os.getenv("MEMORY_QUERY_CACHE", "1") == "1"
+MEMORY_QUERY_CACHE_SIZE = int(os.getenv("MEMORY_QUERY_CACHE_SIZE", "64"))
+MEMORY_QUERY_CACHE_TTL = float(os.getenv("MEMORY_QUERY_CACHE_TTL", "900"))
+MEMORY_QUERY_CACHE_SIMILARITY = float(os.getenv("MEMORY_QUERY_CACHE_SIMILARITY", "0.98"))
+
+
+class CachedQuery(NamedTuple):
+    query: np.ndarray      # Unit-length query embedding
+    key: Hashable          # Retrieval settings the result depends on (top_k, mode)
+    generation: int        # memory_state generation the result was computed at
+    created_at: float      # time.monotonic() of the computation
+    result: object
+
+
+class SemanticQueryCache:
+    """In-process cache of retrieval results keyed by query embedding similarity."""
+
+    def __init__(
+        self,
+        max_entries: int = MEMORY_QUERY_CACHE_SIZE,
+        ttl_seconds: float = MEMORY_QUERY_CACHE_TTL,
+        threshold: float = MEMORY_QUERY_CACHE_SIMILARITY,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.entries: "OrderedDict[int, CachedQuery]" = OrderedDict()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, query_embedding: Sequence[float], key: Hashable, generation: int) -> Optional[object]:
+        """
+        Cached result for a query close enough to an earlier one.
+
+        Args:
+            query_embedding (Sequence[float]): Query embedding vector
+            key (Hashable): Retrieval settings that must match exactly
+            generation (int): Current memory_state generation
+
+        Returns:
+            Optional[object]: The cached result, None on a miss
+        """
+        self._evict_expired(generation)
+        query = unit_vector(query_embedding)
+        candidates = [(entry_id, entry) for entry_id, entry in self.entries.items() if entry.key == key]
+        if query is not None and candidates:
+            similarities = np.stack([entry.query for _, entry in candidates]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                entry_id, entry = candidates[best]
+                self.entries.move_to_end(entry_id)
+                self.hits += 1
+                return entry.result
+        self.misses += 1
+        return None
+
+    def put(self, query_embedding: Sequence[float], key: Hashable, generation: int, result: object):
+        query = unit_vector(query_embedding)
+        if query is None or self.max_entries <= 0:
+            return
+        self.entries[self._next_id] = CachedQuery(query, key, generation, time.monotonic(), result)
+        self._next_id += 1
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_expired(self, generation: int):
+        """Drop entries computed before the latest memory write or older than the TTL."""
+        now = time.monotonic()
+        expired = [
+            entry_id
+            for entry_id, entry in self.entries.items()
+            if entry.generation != generation or now - entry.created_at > self.ttl_seconds
+        ]
+        for entry_id in expired:
+            del self.entries[entry_id]
+        self.evictions += len(expired)
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters for this process."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "evictions": self.evictions,
+        }
+
+
+def unit_vector(embedding: Sequence[float]) -> Optional[np.ndarray]:
+    vector = np.asarray(embedding, dtype=EMBEDDING_DTYPE)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else None
+
+
+_cache = SemanticQueryCache()
+
+
+def get_query_cache() -> SemanticQueryCache:
+    """Process-wide semantic query cache."""
+    return _cache
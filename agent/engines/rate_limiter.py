@@ -0,0 +1,282 @@
+# Rate Limiter
+# Objective: Run every provider at the throughput it actually allows instead of guessing with sleeps. Hyperbolic,
+# OpenRouter, OpenAI, X and the Solana RPC all rate limit; one process-wide limiter, shared by every engine and
+# thread, paces the calls to each of them.
+
+# Token buckets:
+#   - every provider has a requests-per-minute bucket and, where tokens are metered, a tokens-per-minute bucket,
+#     configured by RATE_LIMIT_<PROVIDER>_RPM / _TPM (0 for no limit)
+#   - every (provider, endpoint) pair gets its own buckets once the provider reports limits for it: x-rate-limit-*
+#     (X), x-ratelimit-* (OpenRouter) and x-ratelimit-*-requests / -tokens (OpenAI) headers set the bucket to the
+#     reported remaining quota, paced to last until the reported reset
+#   - a 429 blocks the endpoint until its Retry-After (or RATE_LIMIT_BLOCK_SECONDS without one)
+# acquire() reserves from the provider's and the endpoint's buckets and sleeps until the reservation is covered.
+# A wait longer than RATE_LIMIT_MAX_WAIT raises RateLimitedError instead of stalling the pipeline for hours (X
+# tweet quotas reset daily).
+
+# call_with_retries() in engines/resilience.py acquires before every attempt and reports 429s; call sites that
+# see response headers pass them to observe_headers().
+
+import asyncio
+import os
+import re
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+RATE_LIMITER = os.getenv("RATE_LIMITER", "1") == "1"
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "60"))
+RATE_LIMIT_BLOCK_SECONDS = float(os.getenv("RATE_LIMIT_BLOCK_SECONDS", "5"))
+
+# (requests per minute, tokens per minute) per provider before any header is seen
+DEFAULT_RATE_LIMITS = {
+    "hyperbolic": (60, 0),
+    "openrouter": (60, 0),
+    "openai": (3000, 1_000_000),
+    "x": (30, 0),
+    "solana": (240, 0),
+}
+
+# Reset times reported within this many seconds of each other belong to the same window
+RESET_TOLERANCE = 1.0
+
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class RateLimitedError(Exception):
+    """The call would have to wait longer than RATE_LIMIT_MAX_WAIT for its rate limit; it was not attempted."""
+
+    def __init__(self, key: str, wait: float):
+        super().__init__(f"{key} is rate limited for another {wait:.0f}s")
+        self.key = key
+        self.wait = wait
+
+
+class HeaderLimit(NamedTuple):
+    # "requests" or "tokens"
+    kind: str
+    limit: float
+    remaining: float
+    reset_in: float
+
+
+def provider_limits(provider: str) -> Tuple[float, float]:
+    rpm, tpm = DEFAULT_RATE_LIMITS.get(provider, (0, 0))
+    prefix = f"RATE_LIMIT_{provider.upper()}"
+    return float(os.getenv(f"{prefix}_RPM", rpm)), float(os.getenv(f"{prefix}_TPM", tpm))
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations: reserving may take the level below zero, and the caller waits until
+    the refill covers it, so concurrent callers queue in the order they reserved.
+    """
+
+    def __init__(self, capacity: float, per_second: float):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.level = capacity
+        self.updated = time.monotonic()
+        # When the provider-reported window ends, once headers have been seen
+        self.reset_at: Optional[float] = None
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def wait_for(self, amount: float, now: float) -> float:
+        """Seconds until amount is available, without reserving it."""
+        self.refill(now)
+        shortfall = min(amount, self.capacity) - self.level
+        if shortfall <= 0:
+            return 0.0
+        return shortfall / self.per_second if self.per_second > 0 else float("inf")
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, limit: float, remaining: float, reset_in: float, now: float):
+        """Adopt a provider's reported quota: remaining now, spread evenly until the reset."""
+        self.refill(now)
+        reset_at = now + reset_in
+        # Responses of one window arrive out of order, so within a window the quota only goes down; a later
+        # reset starts a new window
+        if self.reset_at is None or reset_at > self.reset_at + RESET_TOLERANCE:
+            self.level = remaining
+        else:
+            self.level = min(self.level, remaining)
+        self.reset_at = reset_at
+        self.capacity = max(limit, 1.0)
+        self.per_second = max(remaining, 1.0) / max(reset_in, 0.001)
+
+
+class RateLimit:
+    """Request and token buckets of one provider or one provider endpoint."""
+
+    def __init__(self, key: str, rpm: float = 0, tpm: float = 0):
+        self.key = key
+        self.buckets: Dict[str, TokenBucket] = {}
+        if rpm > 0:
+            self.buckets["requests"] = TokenBucket(rpm, rpm / 60)
+        if tpm > 0:
+            self.buckets["tokens"] = TokenBucket(tpm, tpm / 60)
+        self.blocked_until = 0.0
+        self.calls = 0
+        self.waits = 0
+        self.waited = 0.0
+        self.limited = 0
+
+    def wait_for(self, tokens: int, now: float) -> float:
+        amounts = {"requests": 1, "tokens": tokens}
+        waits = [bucket.wait_for(amounts[kind], now) for kind, bucket in self.buckets.items() if amounts[kind]]
+        return max([self.blocked_until - now, 0.0] + waits)
+
+    def take(self, tokens: int):
+        amounts = {"requests": 1, "tokens": tokens}
+        for kind, bucket in self.buckets.items():
+            bucket.take(amounts[kind])
+
+    def stats(self) -> Dict[str, float]:
+        now = time.monotonic()
+        stats = {"calls": self.calls, "waits": self.waits, "waited": round(self.waited, 1), "limited": self.limited}
+        for kind, bucket in self.buckets.items():
+            bucket.refill(now)
+            stats[f"{kind}_available"] = round(bucket.level)
+            stats[f"{kind}_per_minute"] = round(bucket.per_second * 60, 2)
+        return stats
+
+
+def parse_reset(value: str) -> Optional[float]:
+    """Seconds until a reset header's time: epoch seconds or milliseconds, delta seconds, or a duration like 6m0s."""
+    try:
+        number = float(value)
+    except ValueError:
+        parts = DURATION_RE.findall(value)
+        return sum(float(amount) * DURATION_SECONDS[unit] for amount, unit in parts) if parts else None
+    if number > 1e11:
+        return max(0.0, number / 1000 - time.time())
+    if number > 1e9:
+        return max(0.0, number - time.time())
+    return number
+
+
+def header_limits(headers) -> List[HeaderLimit]:
+    """Rate limits reported in response headers (case-insensitive mapping)."""
+    if not headers:
+        return []
+    names = [
+        ("requests", "x-rate-limit-limit", "x-rate-limit-remaining", "x-rate-limit-reset"),
+        ("requests", "x-ratelimit-limit", "x-ratelimit-remaining", "x-ratelimit-reset"),
+        ("requests", "x-ratelimit-limit-requests", "x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+        ("tokens", "x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+    ]
+    limits = []
+    for kind, limit_name, remaining_name, reset_name in names:
+        limit, remaining, reset = headers.get(limit_name), headers.get(remaining_name), headers.get(reset_name)
+        if limit is None or remaining is None or reset is None:
+            continue
+        reset_in = parse_reset(reset)
+        try:
+            limit, remaining = float(limit), float(remaining)
+        except ValueError:
+            continue
+        if reset_in is not None:
+            limits.append(HeaderLimit(kind, limit, remaining, reset_in))
+    return limits
+
+
+class RateLimiter:
+    """Process-wide registry of provider and endpoint rate limits."""
+
+    def __init__(self, max_wait: float = RATE_LIMIT_MAX_WAIT):
+        self.max_wait = max_wait
+        self.limits: Dict[str, RateLimit] = {}
+        self.lock = threading.Lock()
+
+    def _limit(self, key: str, create: bool = True) -> Optional[RateLimit]:
+        if key not in self.limits and create:
+            self.limits[key] = RateLimit(key, *provider_limits(key)) if " " not in key else RateLimit(key)
+        return self.limits.get(key)
+
+    def _chain(self, provider: str, endpoint: str) -> List[RateLimit]:
+        chain = [self._limit(provider)]
+        endpoint_limit = self._limit(f"{provider} {endpoint}", create=False) if endpoint else None
+        return chain + [endpoint_limit] if endpoint_limit else chain
+
+    def reserve(self, provider: str, endpoint: str = "", tokens: int = 0) -> float:
+        """Reserve one request and tokens; returns how long to wait before making the call."""
+        with self.lock:
+            now = time.monotonic()
+            chain = self._chain(provider, endpoint)
+            wait = max(limit.wait_for(tokens, now) for limit in chain)
+            if wait > self.max_wait:
+                raise RateLimitedError(f"{provider} {endpoint}".strip(), wait)
+            for limit in chain:
+                limit.take(tokens)
+                limit.calls += 1
+                if wait > 0:
+                    limit.waits += 1
+                    limit.waited += wait
+        return wait
+
+    def acquire(self, provider: str, endpoint: str = "", tokens: int = 0):
+        """Block until a call to the endpoint is within its limits."""
+        wait = self.reserve(provider, endpoint, tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, provider: str, endpoint: str = "", tokens: int = 0):
+        wait = self.reserve(provider, endpoint, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def observe_headers(self, provider: str, endpoint: str, headers):
+        """Adopt the limits a response reports for its endpoint."""
+        limits = header_limits(headers)
+        if not limits:
+            return
+        with self.lock:
+            now = time.monotonic()
+            limit = self._limit(f"{provider} {endpoint}".strip())
+            for reported in limits:
+                bucket = limit.buckets.setdefault(reported.kind, TokenBucket(reported.limit, 0.0))
+                bucket.sync(reported.limit, reported.remaining, reported.reset_in, now)
+
+    def block(self, provider: str, endpoint: str = "", retry_after: Optional[float] = None):
+        """Hold back calls to an endpoint that answered 429."""
+        seconds = RATE_LIMIT_BLOCK_SECONDS if retry_after is None else retry_after
+        key = f"{provider} {endpoint}".strip()
+        with self.lock:
+            limit = self._limit(key)
+            limit.limited += 1
+            limit.blocked_until = max(limit.blocked_until, time.monotonic() + seconds)
+            # Whatever quota was left is gone
+            for bucket in limit.buckets.values():
+                bucket.level = min(bucket.level, 0.0)
+        print(f"{key} rate limited, holding back calls for {seconds:.1f}s")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {key: limit.stats() for key, limit in self.limits.items()}
+
+
+class DisabledRateLimiter(RateLimiter):
+    """RATE_LIMITER=0: calls are never held back."""
+
+    def reserve(self, provider: str, endpoint: str = "", tokens: int = 0) -> float:
+        return 0.0
+
+    def observe_headers(self, provider: str, endpoint: str, headers):
+        pass
+
+    def block(self, provider: str, endpoint: str = "", retry_after: Optional[float] = None):
+        pass
+
+
+_rate_limiter = RateLimiter() if RATE_LIMITER else DisabledRateLimiter()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide rate limiter shared by every engine and thread."""
+    return _rate_limiter
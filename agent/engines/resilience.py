@@ -0,0 +1,346 @@
+# Resilience
+# Objective: One retry and failure policy for every outbound call (Hyperbolic, OpenRouter, OpenAI, X, Solana RPC),
+# so a degraded provider fails fast instead of stalling the agent.
+
+# call_with_retries() / call_with_retries_async() wrap a single call:
+#   - transient failures (connection errors, timeouts, 408/425/429/5xx) are retried with full-jitter exponential
+#     backoff, waiting at least as long as a Retry-After or x-rate-limit-reset header asks for
+#   - every provider has a circuit breaker: after CIRCUIT_FAILURE_THRESHOLD consecutive transient failures the
+#     provider is skipped for CIRCUIT_RESET_SECONDS, then a single trial call decides whether it closes again (429s
+#     do not count, the rate limiter deals with those)
+#   - the retries of one call never run past the policy's deadline
+# Non-transient errors (bad request, auth, parse errors) are raised immediately and do not trip the breaker.
+
+# Every attempt first waits for the provider's rate limit (see engines/rate_limiter.py), and a 429 holds back the
+# other callers of the endpoint as well, not just the retrying one.
+
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, NamedTuple, Optional, Tuple, Type
+import httpx
+import openai
+import requests
+from engines.rate_limiter import RateLimitedError, get_rate_limiter
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30"))
+RETRY_DEADLINE = float(os.getenv("RETRY_DEADLINE", "180"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "60"))
+
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+TRANSPORT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    requests.ConnectionError,
+    requests.Timeout,
+    httpx.TransportError,
+    openai.APIConnectionError,
+)
+
+
+class RetryPolicy(NamedTuple):
+    max_attempts: int = RETRY_MAX_ATTEMPTS
+    base_delay: float = RETRY_BASE_DELAY
+    max_delay: float = RETRY_MAX_DELAY
+    # Seconds from the first attempt after which no further attempt is started
+    deadline: float = RETRY_DEADLINE
+    retry_statuses: FrozenSet[int] = RETRYABLE_STATUSES
+    # Connection errors and timeouts are only safe to retry for idempotent calls
+    retry_transport: bool = True
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+# Calls with side effects (posting a tweet, sending SOL) are only retried when the server refused them outright
+WRITE_RETRY_POLICY = RetryPolicy(retry_statuses=frozenset({429}), retry_transport=False)
+NO_RETRY_POLICY = RetryPolicy(max_attempts=1)
+
+
+class ProviderStatusError(Exception):
+    """A provider answered with an unexpected HTTP status."""
+
+    def __init__(self, provider: str, status_code: int, text: str, retry_after: Optional[float] = None):
+        super().__init__(f"{provider} returned status {status_code}: {text}")
+        self.provider = provider
+        self.status_code = status_code
+        self.text = text
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """The provider's circuit breaker is open; the call was not attempted."""
+
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(f"{provider} circuit breaker is open, retry in {retry_in:.0f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """
+    Seconds to wait according to a Retry-After (delta-seconds or HTTP date) or x-rate-limit-reset (epoch) header.
+
+    Args:
+        headers: Response headers (case-insensitive mapping), or None
+
+    Returns:
+        Optional[float]: Seconds to wait, None when the response does not say
+    """
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                parsed = email.utils.parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                parsed = None
+            if parsed is not None:
+                return max(0.0, parsed.timestamp() - time.time())
+    reset = headers.get("x-rate-limit-reset")
+    if reset:
+        try:
+            return max(0.0, float(reset) - time.time())
+        except ValueError:
+            pass
+    return None
+
+
+def check_status(provider: str, response, ok: Tuple[int, ...] = (200,)):
+    """Raise ProviderStatusError for a requests or httpx response whose status is not in ok."""
+    if response.status_code not in ok:
+        raise ProviderStatusError(
+            provider, response.status_code, response.text, parse_retry_after(response.headers)
+        )
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    return getattr(error, "status_code", None)
+
+
+def error_retry_after(error: BaseException) -> Optional[float]:
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return retry_after
+    response = getattr(error, "response", None)
+    return parse_retry_after(getattr(response, "headers", None))
+
+
+def is_retryable(error: BaseException, policy: RetryPolicy, retry_on: Tuple[Type[BaseException], ...] = ()) -> bool:
+    status = error_status(error)
+    if isinstance(status, int):
+        return status in policy.retry_statuses
+    if isinstance(error, TRANSPORT_ERRORS) or (retry_on and isinstance(error, retry_on)):
+        return policy.retry_transport
+    return False
+
+
+def backoff_delay(attempt: int, policy: RetryPolicy, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff for the given 0-based attempt, never shorter than retry_after."""
+    delay = random.uniform(0, min(policy.max_delay, policy.base_delay * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open trial call."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_seconds: float = CIRCUIT_RESET_SECONDS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half-open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+            retry_in = max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+            raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_in_flight:
+                    print(f"Circuit breaker for {self.name} opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def release(self):
+        """End a half-open trial that failed for a reason that says nothing about the provider's health."""
+        with self.lock:
+            self.trial_in_flight = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider: str) -> CircuitBreaker:
+    """Process-wide circuit breaker of the given provider."""
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider)
+        return _breakers[provider]
+
+
+def circuit_breaker_states() -> Dict[str, str]:
+    with _breakers_lock:
+        return {name: breaker.state for name, breaker in _breakers.items()}
+
+
+def _next_delay(
+    provider: str,
+    endpoint: str,
+    error: BaseException,
+    attempt: int,
+    started: float,
+    policy: RetryPolicy,
+    retry_on: Tuple[Type[BaseException], ...],
+) -> Optional[float]:
+    """Record the failure and return how long to wait before retrying, or None to give up."""
+    breaker = get_circuit_breaker(provider)
+    rate_limited = error_status(error) == 429
+    if rate_limited:
+        # The rate limiter holds back every caller of the endpoint; the provider itself is up
+        get_rate_limiter().block(provider, endpoint, error_retry_after(error))
+    if not is_retryable(error, policy, retry_on):
+        # A provider that answers, even with an error status, is up
+        if error_status(error) is not None:
+            breaker.record_success()
+        else:
+            breaker.release()
+        return None
+    if rate_limited:
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+    if attempt + 1 >= policy.max_attempts or breaker.state != "closed":
+        return None
+    delay = backoff_delay(attempt, policy, error_retry_after(error))
+    if time.monotonic() + delay - started > policy.deadline:
+        return None
+    print(f"{provider} call failed ({error}), retrying in {delay:.1f}s (attempt {attempt + 2}/{policy.max_attempts})")
+    return delay
+
+
+def call_with_retries(
+    provider: str,
+    fn: Callable[..., Any],
+    *args,
+    policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    retry_on: Tuple[Type[BaseException], ...] = (),
+    endpoint: str = "",
+    tokens: int = 0,
+    **kwargs,
+) -> Any:
+    """
+    Call fn(*args, **kwargs) under the provider's retry policy and circuit breaker.
+
+    Args:
+        provider (str): Provider name, one circuit breaker per name
+        fn (Callable): The call to make
+        policy (RetryPolicy): Attempts, backoff, deadline and what counts as transient
+        retry_on (Tuple[Type[BaseException], ...]): Extra exception types treated like transport errors
+        endpoint (str): Endpoint for the rate limiter, empty for the provider-wide limit only
+        tokens (int): Estimated tokens the call consumes, for tokens-per-minute limits
+
+    Returns:
+        Any: Whatever fn returns
+
+    Raises:
+        CircuitOpenError: The provider's circuit breaker is open
+        RateLimitedError: The rate limit would hold the call back longer than RATE_LIMIT_MAX_WAIT
+        Exception: The last error once retrying is no longer allowed
+    """
+    breaker = get_circuit_breaker(provider)
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            get_rate_limiter().acquire(provider, endpoint, tokens)
+        except RateLimitedError:
+            breaker.release()
+            raise
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            delay = _next_delay(provider, endpoint, e, attempt, started, policy, retry_on)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+        else:
+            breaker.record_success()
+            return result
+
+
+async def call_with_retries_async(
+    provider: str,
+    fn: Callable[..., Awaitable[Any]],
+    *args,
+    policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    retry_on: Tuple[Type[BaseException], ...] = (),
+    endpoint: str = "",
+    tokens: int = 0,
+    **kwargs,
+) -> Any:
+    """Async counterpart of call_with_retries for coroutine functions."""
+    breaker = get_circuit_breaker(provider)
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            await get_rate_limiter().acquire_async(provider, endpoint, tokens)
+        except RateLimitedError:
+            breaker.release()
+            raise
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            delay = _next_delay(provider, endpoint, e, attempt, started, policy, retry_on)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+        else:
+            breaker.record_success()
+            return result
@@ -9,12 +9,26 @@
 # processed information into an internal thought / monologue about current posts and relevance
 
 import json
-import time
 from typing import List, Dict
-import requests
 from sqlalchemy.orm import class_mapper
+from engines.llm_client import get_async_llm_client, get_llm_client
 from engines.prompts import get_short_term_memory_prompt
 
+SHORT_TERM_MEMORY_PARAMS = {"max_tokens": 512, "temperature": 1, "top_p": 0.95, "top_k": 40, "stream": False}
+
+
+def short_term_memory_messages(prompt: str) -> List[Dict]:
+    return [
+        {
+            "role": "system",
+            "content": prompt
+        },
+        {
+            "role": "user",
+            "content": "Respond only with your internal monologue based on the given context."
+        }
+    ]
+
 # Can modify the type depending on the format that twitter api returns for posts
 # external_context in case you want to include information from other sources 
 def generate_short_term_memory(posts: List[Dict], external_context: List[str], llm_api_key: str) -> str:
@@ -28,53 +42,35 @@ def generate_short_term_memory(posts: List[Dict], external_context: List[str], l
     
     Returns:
         str: Generated short-term memory
+
+    Raises:
+        RuntimeError: The model returned no content on every attempt
     """
 
     prompt = get_short_term_memory_prompt(posts, external_context)
     
-    tries = 0
+    client = get_llm_client("hyperbolic")
     max_tries = 3
-    while tries < max_tries:
-        try:
-            url = "https://api.hyperbolic.xyz/v1/chat/completions"
+    # Connection errors and error statuses are retried with backoff inside the client; the loop only re-asks
+    # when the model returns nothing
+    for attempt in range(max_tries):
+        content = client.chat(short_term_memory_messages(prompt), llm_api_key, **SHORT_TERM_MEMORY_PARAMS)
+        print(f"Short-term memory generated with response: {content}")
+        if content and content.strip():
+            return content
+        print(f"Attempt {attempt + 1} failed for short-term memory generation. Empty response")
+    raise RuntimeError(f"Short-term memory generation returned no content after {max_tries} attempts")
 
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {llm_api_key}"
-            }
-            
-            data = {
-                "messages": [
-                    {
-                        "role": "system",
-        	            "content": prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": "Respond only with your internal monologue based on the given context."
-                    }
-                ],
-                "model": "meta-llama/Meta-Llama-3.1-70B-Instruct",
-                "max_tokens": 512,
-                "temperature": 1,
-                "top_p": 0.95,
-                "top_k": 40,
-                "stream": False,
-            }
-            
-            response = requests.post(url, headers=headers, json=data)
-            
-            if response.status_code == 200:
-                content = response.json()['choices'][0]['message']['content']
-                print(f"Short-term memory generated with response: {content}")
-                if content and content.strip():
-                    return content
-                
-            print(f"Attempt {tries + 1} failed for short-term memory generation. Status code: {response.status_code}")
-            print(f"Response: {response.text}")
-            time.sleep(5)
-            
-        except Exception as e:
-            print(f"Error on attempt {tries + 1}: {str(e)}")
-            tries += 1
-            time.sleep(5)  # Add a small delay between retries
\ No newline at end of file
+async def generate_short_term_memory_async(posts: List[Dict], external_context: List[str], llm_api_key: str) -> str:
+    """Async counterpart of generate_short_term_memory for the asyncio pipeline."""
+    prompt = get_short_term_memory_prompt(posts, external_context)
+
+    client = get_async_llm_client("hyperbolic")
+    max_tries = 3
+    for attempt in range(max_tries):
+        content = await client.chat(short_term_memory_messages(prompt), llm_api_key, **SHORT_TERM_MEMORY_PARAMS)
+        print(f"Short-term memory generated with response: {content}")
+        if content and content.strip():
+            return content
+        print(f"Attempt {attempt + 1} failed for short-term memory generation. Empty response")
+    raise RuntimeError(f"Short-term memory generation returned no content after {max_tries} attempts")
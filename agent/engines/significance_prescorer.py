@@ -0,0 +1,235 @@
+# Significance Pre-Scorer
+# Objective: Skip the LLM round-trip for posts whose significance is obvious. Every score the LLM gives is kept as a
+# label in significance_labels, and a ridge regression over hashed n-gram features (the hashing embedding provider's
+# vectors plus a few length and punctuation features) is fitted to those labels. The model's prediction interval
+# decides:
+#   - entirely below PRESCORER_LOW_BELOW (3: not posted, not stored) -> clear low, scored locally
+#   - entirely at or above PRESCORER_HIGH_FROM (7: posted and stored) -> clear high, scored locally
+#   - anything else, or fewer than PRESCORER_MIN_LABELS labels so far -> the LLM decides
+# Texts unlike anything labelled get wide intervals, so they go to the LLM. Off by default (SIGNIFICANCE_PRESCORER=1
+# to enable); fitting solves a ridge system the size of the feature vector, so it never runs inside prescore(): the
+# pipeline calls refit_if_due() once a run is over, and until the first fit every text goes to the LLM.
+
+# Agreement tracking: every LLM-scored text records the local prediction and its band next to the LLM score, and a
+# PRESCORER_AUDIT_RATE sample of the locally decided texts is sent to the LLM anyway. agreement_report() (or
+# python -m engines.significance_prescorer) shows how often each band agrees with the LLM, to tune the thresholds.
+
+import hashlib
+import os
+import random
+import re
+import threading
+from typing import Dict, NamedTuple, Optional, Sequence
+import numpy as np
+from sqlalchemy.exc import SQLAlchemyError
+from models import SignificanceLabel
+from db.db_setup import SessionLocal
+from engines.embedding_provider import get_embedding_provider
+
+SIGNIFICANCE_PRESCORER = os.getenv("SIGNIFICANCE_PRESCORER", "0") == "1"
+PRESCORER_MIN_LABELS = int(os.getenv("PRESCORER_MIN_LABELS", "50"))
+PRESCORER_MAX_LABELS = int(os.getenv("PRESCORER_MAX_LABELS", "20000"))
+PRESCORER_LOW_BELOW = float(os.getenv("PRESCORER_LOW_BELOW", "3"))
+PRESCORER_HIGH_FROM = float(os.getenv("PRESCORER_HIGH_FROM", "7"))
+# Half-width of the prediction interval in standard deviations
+PRESCORER_INTERVAL_Z = float(os.getenv("PRESCORER_INTERVAL_Z", "1.0"))
+PRESCORER_AUDIT_RATE = float(os.getenv("PRESCORER_AUDIT_RATE", "0.1"))
+# refit_if_due() refits after this many new labels
+PRESCORER_REFIT_EVERY = int(os.getenv("PRESCORER_REFIT_EVERY", "20"))
+PRESCORER_RIDGE = 1.0
+
+EXCLAIM_RE = re.compile(r"!")
+QUESTION_RE = re.compile(r"\?")
+
+
+class PreScore(NamedTuple):
+    # Predicted score, None while the model is untrained
+    prediction: Optional[float]
+    # low, middle or high; None while the model is untrained
+    band: Optional[str]
+    # Score to use without asking the LLM, None when the LLM has to decide
+    score: Optional[int]
+
+
+def text_hash(content: str) -> str:
+    return hashlib.sha256(content.strip().encode("utf-8")).hexdigest()
+
+
+def text_features(texts: Sequence[str]) -> np.ndarray:
+    """Hashed word, bigram and character n-gram vector, then length and punctuation features and a bias."""
+    hashing = get_embedding_provider("hashing")
+    rows = []
+    for content in texts:
+        words = content.split()
+        letters = [char for char in content if char.isalpha()]
+        shape = [
+            np.log1p(len(words)),
+            np.log1p(len(content)) / 2,
+            sum(char.isupper() for char in letters) / len(letters) if letters else 0.0,
+            min(len(EXCLAIM_RE.findall(content)), 5) / 5,
+            min(len(QUESTION_RE.findall(content)), 5) / 5,
+            1.0,
+        ]
+        rows.append(np.concatenate([hashing.embed_text(content).astype(np.float64), shape]))
+    return np.array(rows, dtype=np.float64).reshape(len(rows), -1)
+
+
+class SignificancePreScorer:
+    """Ridge regression over hashed features, fitted to the LLM's past significance scores."""
+
+    def __init__(
+        self,
+        min_labels: int = PRESCORER_MIN_LABELS,
+        low_below: float = PRESCORER_LOW_BELOW,
+        high_from: float = PRESCORER_HIGH_FROM,
+        interval_z: float = PRESCORER_INTERVAL_Z,
+        audit_rate: float = PRESCORER_AUDIT_RATE,
+        session_factory=SessionLocal,
+    ):
+        self.min_labels = min_labels
+        self.low_below = low_below
+        self.high_from = high_from
+        self.interval_z = interval_z
+        self.audit_rate = audit_rate
+        self.session_factory = session_factory
+        self.weights: Optional[np.ndarray] = None
+        # Inverse Cholesky factor of the ridge system: x @ inverse(gram) @ x is |whitening @ x|^2
+        self.whitening: Optional[np.ndarray] = None
+        self.residual_variance = 0.0
+        self.labels = 0
+        self.labels_since_fit = 0
+        self.fitted = False
+        self.lock = threading.Lock()
+        self.counts = {"low": 0, "high": 0, "llm": 0, "audited": 0}
+
+    def fit(self):
+        """Refit on the most recent PRESCORER_MAX_LABELS labels."""
+        try:
+            with self.session_factory() as db:
+                rows = db.query(SignificanceLabel.content, SignificanceLabel.llm_score).order_by(
+                    SignificanceLabel.created_at.desc()
+                ).limit(PRESCORER_MAX_LABELS).all()
+        except SQLAlchemyError as e:
+            print(f"Significance pre-scorer could not load labels: {e}")
+            rows = []
+
+        with self.lock:
+            self.fitted = True
+            self.labels = len(rows)
+            self.labels_since_fit = 0
+            if len(rows) < self.min_labels:
+                self.weights = None
+                return
+            features = text_features([row.content for row in rows])
+            targets = np.array([row.llm_score for row in rows], dtype=np.float64)
+            gram = features.T @ features + PRESCORER_RIDGE * np.eye(features.shape[1])
+            # The ridge term keeps gram positive definite, so it factors as L @ L.T
+            factor = np.linalg.cholesky(gram)
+            self.whitening = np.linalg.solve(factor, np.eye(len(factor)))
+            self.weights = np.linalg.solve(gram, features.T @ targets)
+            residuals = targets - features @ self.weights
+            self.residual_variance = float(residuals @ residuals) / max(1, len(rows) - 1)
+
+    def refit_if_due(self) -> bool:
+        """Fit if the model has never been fitted or PRESCORER_REFIT_EVERY labels arrived since; True if it did."""
+        if self.fitted and self.labels_since_fit < PRESCORER_REFIT_EVERY:
+            return False
+        self.fit()
+        return True
+
+    def prescore(self, content: str) -> PreScore:
+        """Predict a text's score with the last fitted model and decide whether the LLM is needed."""
+        if self.weights is None:
+            return PreScore(None, None, None)
+        x = text_features([content])[0]
+        with self.lock:
+            if self.weights is None:
+                return PreScore(None, None, None)
+            prediction = float(x @ self.weights)
+            # Predictive standard deviation: residual noise plus the model's uncertainty at x
+            uncertainty = float(np.sum(np.square(self.whitening @ x)))
+            spread = self.interval_z * np.sqrt(self.residual_variance * (1 + uncertainty))
+
+            if prediction + spread < self.low_below:
+                band, score = "low", int(max(1, min(self.low_below - 1, round(prediction))))
+            elif prediction - spread >= self.high_from:
+                band, score = "high", int(max(self.high_from, min(10, round(prediction))))
+            else:
+                band, score = "middle", None
+            if score is not None and random.random() < self.audit_rate:
+                # Audited: the LLM scores it and the label shows whether the band was right
+                self.counts["audited"] += 1
+                return PreScore(prediction, band, None)
+            self.counts[band if score is not None else "llm"] += 1
+        return PreScore(prediction, band, score)
+
+    def observe(self, content: str, llm_score: Optional[int], prescore: Optional[PreScore] = None):
+        """Store the LLM's score of a text as a label, with the local prediction it is compared against."""
+        if llm_score is None:
+            return
+        try:
+            with self.session_factory() as db:
+                db.merge(SignificanceLabel(
+                    text_hash=text_hash(content),
+                    content=content,
+                    llm_score=float(llm_score),
+                    local_score=prescore.prediction if prescore else None,
+                    band=prescore.band if prescore else None,
+                ))
+                db.commit()
+        except SQLAlchemyError as e:
+            print(f"Significance pre-scorer could not store a label: {e}")
+            return
+        self.labels_since_fit += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Decisions made by this process."""
+        decided = self.counts["low"] + self.counts["high"]
+        total = decided + self.counts["llm"] + self.counts["audited"]
+        return {
+            **self.counts,
+            "labels": self.labels,
+            "local_rate": decided / total if total else 0.0,
+        }
+
+
+def decision_band(score: float) -> str:
+    """Band an LLM score falls in by the pipeline's thresholds."""
+    if score < PRESCORER_LOW_BELOW:
+        return "low"
+    return "high" if score >= PRESCORER_HIGH_FROM else "middle"
+
+
+def agreement_report(session_factory=SessionLocal) -> Dict[str, Dict[str, float]]:
+    """
+    Per band the prediction interval fell in: labelled texts, how often the LLM's score fell in the same band, and
+    the mean absolute error of the local prediction. Low and high rows come from audits and measure how safe the
+    short-circuit is; middle texts whose LLM scores mostly land low or high mean the interval is too wide.
+    """
+    with session_factory() as db:
+        rows = db.query(SignificanceLabel.band, SignificanceLabel.llm_score, SignificanceLabel.local_score).filter(
+            SignificanceLabel.band.isnot(None)
+        ).all()
+    report: Dict[str, Dict[str, float]] = {}
+    for band, llm_score, local_score in rows:
+        row = report.setdefault(band, {"labels": 0, "agreement": 0.0, "mae": 0.0})
+        row["labels"] += 1
+        row["agreement"] += decision_band(llm_score) == band
+        row["mae"] += abs(local_score - llm_score)
+    for row in report.values():
+        row["agreement"] /= row["labels"]
+        row["mae"] /= row["labels"]
+    return report
+
+
+_prescorer = SignificancePreScorer()
+
+
+def get_significance_prescorer() -> SignificancePreScorer:
+    """Process-wide significance pre-scorer."""
+    return _prescorer
+
+
+if __name__ == "__main__":
+    for band, row in sorted(agreement_report().items()):
+        print(f"{band:<7} labels {row['labels']:>6}  agreement {row['agreement']:.1%}  mae {row['mae']:.2f}")
@@ -1,81 +1,247 @@
-import requests
-import time
-from engines.prompts import get_significance_score_prompt
+import json
+import os
+import re
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from models import LongTermMemory
+from engines.llm_client import get_llm_client
+from engines.prompt_assembler import PROMPT_TOKEN_BUDGET
+from engines.prompts import get_significance_batch_prompt, get_significance_score_prompt
+from engines.significance_prescorer import SIGNIFICANCE_PRESCORER, get_significance_prescorer
+from engines.token_count import estimate_tokens
 
-def score_significance(memory: str, llm_api_key: str) -> int:
+SIGNIFICANCE_BATCH_SIZE = int(os.getenv("SIGNIFICANCE_BATCH_SIZE", "20"))
+SIGNIFICANCE_BATCH_TRIES = int(os.getenv("SIGNIFICANCE_BATCH_TRIES", "3"))
+# Token room for the memory list: the prompt budget less the instructions around it
+BATCH_MEMORY_TOKEN_BUDGET = PROMPT_TOKEN_BUDGET - estimate_tokens(get_significance_batch_prompt([]))
+# Numbering, quotes and newline per listed memory
+BATCH_ITEM_OVERHEAD_TOKENS = 3
+RESCORE_PAGE_SIZE = 200
+
+def score_significance(memory: str, llm_api_key: str, prescore: bool = SIGNIFICANCE_PRESCORER) -> int:
     """
     Score the significance of a memory on a scale of 1-10.
+    Clear lows and highs are scored by the local pre-scorer; everything else goes to the LLM, whose score
+    becomes a training label for the pre-scorer.
     
     Args:
         memory (str): The memory to be scored
         openrouter_api_key (str): API key for OpenRouter
-        your_site_url (str): Your site URL for OpenRouter API
-        your_app_name (str): Your app name for OpenRouter API
+        prescore (bool): Let the local pre-scorer decide clear cases
     
     Returns:
         int: Significance score (1-10)
     """
+    prescorer = get_significance_prescorer()
+    local = prescorer.prescore(memory) if prescore else None
+    if local is not None and local.score is not None:
+        print(f"Significance scored locally ({local.band}, predicted {local.prediction:.1f}): {local.score}")
+        return local.score
+    score = llm_score_significance(memory, llm_api_key)
+    prescorer.observe(memory, score, local)
+    return score
+
+
+def llm_score_significance(memory: str, llm_api_key: str) -> Optional[int]:
+    """Ask the LLM for a memory's significance score, None if it gives no usable answer."""
     prompt = get_significance_score_prompt(memory)
 
-    tries = 0
+    client = get_llm_client("hyperbolic")
     max_tries = 5
-    while tries < max_tries:
-        try:
-            response = requests.post(
-                url="https://api.hyperbolic.xyz/v1/chat/completions",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {llm_api_key}",
+    # Connection errors and error statuses are retried with backoff inside the client; the loop only re-asks
+    # when the model's answer is unusable
+    for attempt in range(max_tries):
+        score_str = client.chat(
+            [
+                {
+                    "role": "system",
+                    "content": prompt
                 },
-                json={
-                    "messages": [
-                        {
-                            "role": "system",
-        	                "content": prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": "Respond only with the score you would give for the given memory."
-                        }
-                    ],
-                    "model": "meta-llama/Meta-Llama-3.1-70B-Instruct",
-                    "temperature": 1,
-                    "top_p": 0.95,
-                    "top_k": 40,
+                {
+                    "role": "user",
+                    "content": "Respond only with the score you would give for the given memory."
                 }
+            ],
+            llm_api_key,
+            # Re-asks bypass the cached answer that was just found unusable
+            cache=True,
+            refresh_cache=attempt > 0,
+            temperature=1,
+            top_p=0.95,
+            top_k=40,
+        ).strip()
+        print(f"Score generated for memory: {score_str}")
+        if score_str == "":
+            print(f"Empty response on attempt {attempt + 1}")
+            continue
+
+        # Extract the first number found in the response
+        # This helps handle cases where the model includes additional text
+        numbers = re.findall(r'\d+', score_str)
+        if numbers:
+            score = int(numbers[0])
+            return max(1, min(10, score))  # Ensure the score is between 1 and 10
+        print(f"No numerical score found in response: {score_str}")
+
+
+def batch_chunks(indices: List[int], memories: List[str], size: int, budget: int) -> List[List[int]]:
+    """Split memory indices into batches of at most size memories whose rendered list fits the token budget."""
+    chunks, chunk, tokens = [], [], 0
+    for i in indices:
+        cost = estimate_tokens(memories[i]) + BATCH_ITEM_OVERHEAD_TOKENS
+        if chunk and (len(chunk) >= size or tokens + cost > budget):
+            chunks.append(chunk)
+            chunk, tokens = [], 0
+        chunk.append(i)
+        tokens += cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def parse_batch_scores(content: str, count: int) -> Dict[int, int]:
+    """
+    Scores by 1-based memory number from a batch answer, keeping whatever parses.
+    Accepts the requested [{"id": n, "score": s}, ...] array, a bare array with exactly one score per memory,
+    and salvages individual {"id", "score"} objects from an answer that is not valid JSON as a whole.
+    """
+    def clamp(score) -> Optional[int]:
+        if isinstance(score, str):
+            score = score.strip()
+            score = int(score) if score.isdigit() else None
+        if isinstance(score, bool) or not isinstance(score, (int, float)):
+            return None
+        return max(1, min(10, int(score)))
+
+    content = content or ""
+    match = re.search(r"\[.*\]", content, re.DOTALL)
+    try:
+        parsed = json.loads(match.group(0)) if match else None
+    except json.JSONDecodeError:
+        parsed = None
+    if isinstance(parsed, list) and len(parsed) == count and not any(isinstance(item, dict) for item in parsed):
+        parsed = [{"id": number, "score": score} for number, score in enumerate(parsed, 1)]
+    if not isinstance(parsed, list):
+        parsed = []
+        for item in re.findall(r"\{[^{}]*\}", content):
+            try:
+                parsed.append(json.loads(item))
+            except json.JSONDecodeError:
+                continue
+
+    scores = {}
+    for item in parsed:
+        if not isinstance(item, dict):
+            continue
+        number, score = item.get("id"), clamp(item.get("score"))
+        if isinstance(number, int) and 1 <= number <= count and score is not None:
+            scores.setdefault(number, score)
+    return scores
+
+
+def score_significance_batch(
+    memories: List[str],
+    llm_api_key: str,
+    batch_size: int = SIGNIFICANCE_BATCH_SIZE,
+    max_tries: int = SIGNIFICANCE_BATCH_TRIES,
+    prescore: bool = SIGNIFICANCE_PRESCORER,
+) -> List[Optional[int]]:
+    """
+    Score many memories with one request per batch; the model answers with a JSON array of {"id", "score"}.
+    Memories missing from an answer, or with an unusable score, are asked again in a smaller request of their
+    own, up to max_tries rounds. Clear lows and highs are scored by the local pre-scorer and never sent.
+
+    Args:
+        memories (List[str]): The memories to be scored
+        batch_size (int): Maximum memories per request, batches are also kept within PROMPT_TOKEN_BUDGET
+        max_tries (int): Rounds of requests before a memory is given up on
+        prescore (bool): Let the local pre-scorer decide clear cases
+
+    Returns:
+        List[Optional[int]]: Significance scores (1-10) in the order of memories, None where scoring failed
+    """
+    prescorer = get_significance_prescorer()
+    local = [prescorer.prescore(memory) if prescore else None for memory in memories]
+    scores: List[Optional[int]] = [prescored.score if prescored else None for prescored in local]
+    client = get_llm_client("hyperbolic")
+    pending = [i for i in range(len(memories)) if scores[i] is None]
+    sent = list(pending)
+    for attempt in range(max_tries):
+        if not pending:
+            break
+        for chunk in batch_chunks(pending, memories, batch_size, BATCH_MEMORY_TOKEN_BUDGET):
+            content = client.chat(
+                [
+                    {
+                        "role": "system",
+                        "content": get_significance_batch_prompt([memories[i] for i in chunk])
+                    },
+                    {
+                        "role": "user",
+                        "content": "Respond only with the JSON array of scores for the given memories."
+                    }
+                ],
+                llm_api_key,
+                # Re-asks bypass the cached answer that was just found incomplete
+                cache=True,
+                refresh_cache=attempt > 0,
+                temperature=1,
+                top_p=0.95,
+                top_k=40,
             )
+            for number, score in parse_batch_scores(content, len(chunk)).items():
+                scores[chunk[number - 1]] = score
+        pending = [i for i in pending if scores[i] is None]
+        print(f"Scored {len(memories) - len(pending)}/{len(memories)} memories after round {attempt + 1}")
+    for i in sent:
+        prescorer.observe(memories[i], scores[i], local[i])
+    return scores
+
+
+def rescore_memories(db: Session, llm_api_key: str, after_id: int = 0, limit: Optional[int] = None) -> Dict[str, int]:
+    """
+    Backfill: re-score stored long term memories in id order with batched requests, such as the seeded ones that
+    were given random scores. Updating a score bumps the memory generation, so the memory caches reload.
+
+    Returns:
+        Dict[str, int]: Memories scanned, updated and left unscored, and the last id processed
+    """
+    report = {"scanned": 0, "updated": 0, "unscored": 0, "last_id": after_id}
+    while limit is None or report["scanned"] < limit:
+        page = RESCORE_PAGE_SIZE if limit is None else min(RESCORE_PAGE_SIZE, limit - report["scanned"])
+        rows = db.query(LongTermMemory.id, LongTermMemory.content, LongTermMemory.significance_score).filter(
+            LongTermMemory.id > report["last_id"]
+        ).order_by(LongTermMemory.id).limit(page).all()
+        if not rows:
+            break
+        # The LLM's scores are the pre-scorer's labels, so none of them are short-circuited here
+        scores = score_significance_batch([row.content for row in rows], llm_api_key, prescore=False)
+        for row, score in zip(rows, scores):
+            if score is None:
+                report["unscored"] += 1
+            elif score != row.significance_score:
+                db.query(LongTermMemory).filter(LongTermMemory.id == row.id).update(
+                    {LongTermMemory.significance_score: score}, synchronize_session=False
+                )
+                report["updated"] += 1
+        db.commit()
+        report["scanned"] += len(rows)
+        report["last_id"] = rows[-1].id
+        print(f"Re-scored memories up to id {report['last_id']}: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from db.db_setup import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Re-score stored long term memories with batched LLM requests")
+    parser.add_argument("--after-id", type=int, default=0, help="Only memories with a higher id")
+    parser.add_argument("--limit", type=int, help="Stop after this many memories")
+    args = parser.parse_args()
 
-            if response.status_code == 200:
-                score_str = response.json()['choices'][0]['message']['content'].strip()
-                print(f"Score generated for memory: {score_str}")
-                if score_str == "":
-                    print(f"Empty response on attempt {tries + 1}")
-                    tries += 1
-                    continue
-                
-                try:
-                    # Extract the first number found in the response
-                    # This helps handle cases where the model includes additional text
-                    import re
-                    numbers = re.findall(r'\d+', score_str)
-                    if numbers:
-                        score = int(numbers[0])
-                        return max(1, min(10, score))  # Ensure the score is between 1 and 10
-                    else:
-                        print(f"No numerical score found in response: {score_str}")
-                        tries += 1
-                        continue
-                        
-                except ValueError:
-                    print(f"Invalid score returned: {score_str}")
-                    tries += 1
-                    continue
-            else:
-                print(f"Error on attempt {tries + 1}. Status code: {response.status_code}")
-                print(f"Response: {response.text}")
-                tries += 1
-                
-        except Exception as e:
-            print(f"Error on attempt {tries + 1}: {str(e)}")
-            tries += 1 
-            time.sleep(1)  # Add a small delay between retries
\ No newline at end of file
+    db = SessionLocal()
+    try:
+        rescore_memories(db, os.getenv("HYPERBOLIC_API_KEY"), args.after_id, args.limit)
+    finally:
+        db.close()
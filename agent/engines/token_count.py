@@ -0,0 +1,19 @@
+# Token Count
+# Objective: Cheap, dependency-free token estimates for batching and prompt budgeting.
+# BPE tokenizers used by the OpenAI and Llama models average roughly four bytes of English per token; counting
+# three bytes per token errs on the high side, which is the safe direction for staying under request limits.
+
+from typing import Iterable
+
+BYTES_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str) -> int:
+    """Conservative token estimate for a piece of text."""
+    if not text:
+        return 0
+    return len(text.encode("utf-8")) // BYTES_PER_TOKEN + 1
+
+
+def estimate_total_tokens(texts: Iterable[str]) -> int:
+    return sum(estimate_tokens(text) for text in texts)
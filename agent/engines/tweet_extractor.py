@@ -0,0 +1,131 @@
+# Tweet Extractor
+# Objective: Do the formatter's job locally. generate_post used to send every base model output through a second
+# chat call that only strips labels, drops cut-off tails, removes self references and picks one tweet; the same
+# rules as plain string handling cost nothing, and the formatter is only asked when the result looks doubtful.
+
+# The tweet prompt lists its examples one per line separated by "--" lines, and the base model continues in that
+# format. Rules, in order:
+#   - only complete lines count: the line after the last newline may still be growing (streaming) or was cut off
+#     by max_tokens, so it is dropped unless the model stopped on its own
+#   - separator lines, "Tweet:"-style labels, surrounding quotes and list punctuation are stripped
+#   - @Flip_Flop_Frogg and "error error ttyl" references and hashtags are removed
+#   - lines that are notes about the tweet ("Thoughts: ...", "(...)"), copies of the prompt's examples and lines
+#     with fewer than TWEET_MIN_LETTERS letters are skipped
+#   - the first remaining line is the tweet; one over TWEET_MAX_CHARS is cut back to its last full sentence
+
+# The confidence check fails (and the formatter runs) when no line survives these rules or when the picked line
+# echoes the prompt's section headings. evaluate_tweet_extractor.py measures how often the formatter is bypassed
+# on a corpus built from db/examples*.txt and recorded base model outputs.
+
+import os
+import re
+from typing import FrozenSet, Iterable, List, NamedTuple, Optional
+from engines.prompts import get_example_tweet_list
+
+TWEET_MAX_CHARS = int(os.getenv("TWEET_MAX_CHARS", "280"))
+TWEET_MIN_LETTERS = int(os.getenv("TWEET_MIN_LETTERS", "2"))
+
+SEPARATOR_RE = re.compile(r"^[-_*=~#]{2,}$")
+LABEL_RE = re.compile(
+    r"^(?:(?:here(?:'s| is) (?:a|my|the) )?(?:new |next |my |final |formatted )?"
+    r"(?:tweet|post|reply|response|output)(?: ?#?\d+)?\s*[:-]|\d{1,2}[.)](?=\s))\s*",
+    re.IGNORECASE,
+)
+NOTE_RE = re.compile(r"^(?:\(.*\)|\[.*\]|(?:thoughts?|notes?|explanation|context)\s*:.*)$", re.IGNORECASE)
+SELF_REFERENCE_RE = re.compile(r"@?flip_flop_frogg\b|\(?\berror error ttyl\b\)?", re.IGNORECASE)
+HASHTAG_RE = re.compile(r"(?<!\w)#\w+")
+SENTENCE_END_RE = re.compile(r"[.!?…](?=\s|$)")
+PROMPT_ECHO_RE = re.compile(
+    r"external context|short term memory|long term memories|recent posts|example tweets",
+    re.IGNORECASE,
+)
+
+
+class TweetExtraction(NamedTuple):
+    tweet: Optional[str]
+    confident: bool
+    # Why the confidence check failed, empty when it passed
+    reason: str
+
+
+def normalize_tweet(text: str) -> str:
+    """Collapse whitespace and case so copies of the same tweet compare equal."""
+    return " ".join(text.lower().split())
+
+
+def known_tweet_keys(texts: Iterable[str]) -> FrozenSet[str]:
+    """Normalized texts for extract_tweet's known argument."""
+    return frozenset(normalize_tweet(text) for text in texts)
+
+
+# The tweet prompt's examples, normalized once instead of on every call and stream chunk
+EXAMPLE_TWEET_KEYS = known_tweet_keys(get_example_tweet_list())
+
+
+def complete_lines(text: str, finished: bool = False) -> List[str]:
+    """Non-empty lines of text that can no longer change, separators excluded."""
+    lines = text.split("\n")
+    if not finished:
+        lines = lines[:-1]
+    return [line.strip() for line in lines if line.strip() and not SEPARATOR_RE.match(line.strip())]
+
+
+def clean_line(line: str) -> str:
+    """Apply the label, quote, self reference and hashtag rules to one line."""
+    line = LABEL_RE.sub("", line.strip(), count=1)
+    line = line.strip()
+    # The seed example files quote tweets as list items: "...",
+    if line.endswith('",') or line.endswith("',"):
+        line = line[:-1]
+    if len(line) >= 2 and line[0] == line[-1] and line[0] in "\"'":
+        line = line[1:-1]
+    line = SELF_REFERENCE_RE.sub("", line)
+    line = HASHTAG_RE.sub("", line)
+    return " ".join(line.split()).strip(" ,;:-")
+
+
+def fit_to_length(tweet: str) -> Optional[str]:
+    """Cut an overlong tweet back to its last full sentence within TWEET_MAX_CHARS."""
+    if len(tweet) <= TWEET_MAX_CHARS:
+        return tweet
+    ends = [match.end() for match in SENTENCE_END_RE.finditer(tweet, 0, TWEET_MAX_CHARS)]
+    return tweet[:ends[-1]].strip() if ends else None
+
+
+def extract_tweet(
+    text: str, finished: bool = False, known: FrozenSet[str] = EXAMPLE_TWEET_KEYS
+) -> TweetExtraction:
+    """
+    Pick one tweet out of raw base model output.
+
+    Args:
+        text (str): Base model output, possibly still streaming
+        finished (bool): The model stopped on its own, so the last line is complete too
+        known (FrozenSet[str]): Normalized texts the tweet must not copy (known_tweet_keys), the prompt's examples
+            by default
+
+    Returns:
+        TweetExtraction: The tweet (None if no candidate is left) and whether it passed the confidence check
+    """
+    reason = "no complete candidate"
+    for line in complete_lines(text, finished):
+        if NOTE_RE.match(line):
+            continue
+        tweet = clean_line(line)
+        if not tweet:
+            continue
+        if normalize_tweet(tweet) in known:
+            reason = "copied example"
+            continue
+        if sum(char.isalpha() for char in tweet) < TWEET_MIN_LETTERS:
+            reason = "too short"
+            continue
+        fitted = fit_to_length(tweet)
+        if fitted is None:
+            reason = "too long"
+            continue
+        if PROMPT_ECHO_RE.search(fitted):
+            # The model is reciting the prompt; later lines are no better
+            return TweetExtraction(fitted, False, "prompt echo")
+        return TweetExtraction(fitted, True, "")
+    return TweetExtraction(None, False, reason)
@@ -1,11 +1,15 @@
+import asyncio
 import os
 import re
-import requests
+from typing import Dict, List
 from web3 import Web3
 from ens import ENS
+from solana.exceptions import SolanaRpcException
 from solana.rpc.api import Client
 from solders.pubkey import Pubkey
 from solders.keypair import Keypair
+from engines.resilience import WRITE_RETRY_POLICY, call_with_retries
+from engines.llm_client import LLMError, get_async_llm_client, get_llm_client
 from engines.prompts import get_wallet_decision_prompt
 
 def get_wallet_balance(private_key_hex, solana_rpc_url="https://api.mainnet-beta.solana.com"):
@@ -13,7 +17,9 @@ def get_wallet_balance(private_key_hex, solana_rpc_url="https://api.mainnet-beta
     wallet = Keypair.from_base58_string(private_key_hex)
     public_key = wallet.pubkey()
     # Retrieve and print the balance of the account in SOL
-    balance_lamports = client.get_balance(public_key).value
+    balance_lamports = call_with_retries(
+        "solana", client.get_balance, public_key, retry_on=(SolanaRpcException,), endpoint="getBalance"
+    ).value
     balance_sol = balance_lamports / 1_000_000_000  # 1 SOL = 1,000,000,000 Lamports
 
     return balance_sol
@@ -49,24 +55,21 @@ def transfer_sol(private_key, solana_rpc_url, to_address, amount_in_sol):
         }
 
         # Send the transaction
-        tx_signature = client.send_transaction(transaction, public_key)
+        tx_signature = call_with_retries(
+            "solana", client.send_transaction, transaction, public_key, policy=WRITE_RETRY_POLICY,
+            endpoint="sendTransaction",
+        )
 
         return tx_signature
     except Exception as e:
         return f"An error occurred: {e}"
     
-def wallet_address_in_post(posts, private_key, solana_rpc_url: str, llm_api_key: str):
-    """
-    Detects wallet addresses from a list of posts.
-    Converts all items to strings first, then checks for matches.
-
-    Parameters:
-    - posts (List): List of posts of any type
+# Sampled at temperature 1 and acted on with transfer_sol, so the decision is never served from the response cache
+WALLET_DECISION_PARAMS = {"presence_penalty": 0, "temperature": 1, "top_p": 0.95, "top_k": 40}
 
-    Returns:
-    - List[Dict]: List of dicts with 'address' and 'amount' keys
-    """
 
+def find_wallet_addresses(posts) -> List[str]:
+    """Solana addresses mentioned anywhere in the posts, after converting each post to a string."""
     # Convert everything to strings first
     str_posts = [str(post) for post in posts]
     
@@ -77,37 +80,58 @@ def wallet_address_in_post(posts, private_key, solana_rpc_url: str, llm_api_key:
     for post in str_posts:
         found_matches = sol_pattern.findall(post)
         matches.extend(found_matches)
-    
-    wallet_balance = get_wallet_balance(private_key, solana_rpc_url)
-    prompt = get_wallet_decision_prompt(posts, matches, wallet_balance)
-    
-    response = requests.post(
-        url="https://api.hyperbolic.xyz/v1/chat/completions",
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {llm_api_key}",
+    return matches
+
+
+def wallet_decision_messages(prompt: str) -> List[Dict]:
+    return [
+        {
+            "role": "system",
+            "content": prompt
         },
-        json={
-            "messages": [
-                {
-                    "role": "system",
-        	        "content": prompt
-                },
-                {
-                    "role": "user",
-                    "content": "Respond only with the wallet address(es) and amount(s) you would like to send to."
-                }
-            ],
-            "model": "meta-llama/Meta-Llama-3.1-70B-Instruct",
-            "presence_penalty": 0,
-            "temperature": 1,
-            "top_p": 0.95,
-            "top_k": 40,
+        {
+            "role": "user",
+            "content": "Respond only with the wallet address(es) and amount(s) you would like to send to."
         }
-    )
+    ]
+
+def wallet_address_in_post(posts, private_key, solana_rpc_url: str, llm_api_key: str):
+    """
+    Detects wallet addresses from a list of posts.
+    Converts all items to strings first, then checks for matches.
+
+    Parameters:
+    - posts (List): List of posts of any type
+
+    Returns:
+    - List[Dict]: List of dicts with 'address' and 'amount' keys
+    """
+    matches = find_wallet_addresses(posts)
+    wallet_balance = get_wallet_balance(private_key, solana_rpc_url)
+    prompt = get_wallet_decision_prompt(posts, matches, wallet_balance)
     
-    if response.status_code == 200:
-        print(f"SOL Addresses and amounts chosen from Posts: {response.json()}")
-        return response.json()['choices'][0]['message']['content']
-    else:
-        raise Exception(f"Error generating short-term memory: {response.text}")
+    try:
+        content = get_llm_client("hyperbolic").chat(
+            wallet_decision_messages(prompt), llm_api_key, **WALLET_DECISION_PARAMS
+        )
+    except LLMError as e:
+        raise Exception(f"Error generating short-term memory: {e.text}")
+
+    print(f"SOL Addresses and amounts chosen from Posts: {content}")
+    return content
+
+async def wallet_address_in_post_async(posts, private_key, solana_rpc_url: str, llm_api_key: str):
+    """Async counterpart of wallet_address_in_post; the balance lookup runs in a worker thread."""
+    matches = find_wallet_addresses(posts)
+    wallet_balance = await asyncio.to_thread(get_wallet_balance, private_key, solana_rpc_url)
+    prompt = get_wallet_decision_prompt(posts, matches, wallet_balance)
+
+    try:
+        content = await get_async_llm_client("hyperbolic").chat(
+            wallet_decision_messages(prompt), llm_api_key, **WALLET_DECISION_PARAMS
+        )
+    except LLMError as e:
+        raise Exception(f"Error generating short-term memory: {e.text}")
+
+    print(f"SOL Addresses and amounts chosen from Posts: {content}")
+    return content
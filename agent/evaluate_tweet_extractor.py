@@ -0,0 +1,151 @@
+"""
+Corpus evaluation of the local tweet extractor (engines/tweet_extractor.py), which lets generate_post skip the
+formatter LLM call. No API key or network access needed.
+
+Synthetic base model outputs built from the seed tweets in db/examples*.txt and the tweet prompt's examples: each
+tweet is wrapped in the noise the formatter prompt exists for (labels, separators, quotes, self references,
+hashtags, notes, cut-off tails, prompt echoes, copied examples). Reports the bypass rate, whether the bypassed tweets are exactly right, and whether the
+cases that need the formatter still reach it:
+
+    python evaluate_tweet_extractor.py
+
+Add real outputs recorded by generate_post with POST_RECORD_PATH set (JSONL of {"output", "finish_reason"}); they
+have no ground truth, so only the bypass rate and the fallback reasons are reported, plus a sample of each:
+
+    python evaluate_tweet_extractor.py --recorded data/base_model_outputs.jsonl --show 5
+"""
+
+import argparse
+import json
+import random
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from engines.tweet_extractor import TWEET_MAX_CHARS, TWEET_MIN_LETTERS, clean_line, extract_tweet, known_tweet_keys
+
+
+class Case(NamedTuple):
+    kind: str
+    output: str
+    finished: bool
+    # The tweet the formatter would return, None when the formatter has to run
+    expected: Optional[str]
+    known: Tuple[str, ...] = ()
+
+
+def seed_tweets() -> List[str]:
+    """Seed tweets usable as ground truth: one line, tweet-sized, unchanged by their own cleanup."""
+    from db.db_seed import load_all_examples
+    from engines.prompts import get_example_tweet_list
+
+    tweets = []
+    for example in load_all_examples() + get_example_tweet_list():
+        tweet = clean_line(example)
+        if "\n" in example or not tweet or len(tweet) > TWEET_MAX_CHARS:
+            continue
+        if sum(char.isalpha() for char in tweet) >= TWEET_MIN_LETTERS and clean_line(tweet) == tweet:
+            tweets.append(tweet)
+    return list(dict.fromkeys(tweets))
+
+
+# Each builder turns a tweet, another tweet and a random source into (output, finished, expected, known)
+CASE_BUILDERS: Dict[str, Callable[[str, str, random.Random], Tuple[str, bool, Optional[str], Tuple[str, ...]]]] = {
+    "plain": lambda t, other, rng: (f"{t}\n--\n{other[:rng.randint(1, len(other))]}", False, t, ()),
+    "finished": lambda t, other, rng: (t, True, t, ()),
+    "leading separator": lambda t, other, rng: (f"    --\n{t}\n--\n", False, t, ()),
+    "label": lambda t, other, rng: (
+        f"{rng.choice(['Tweet:', 'tweet:', 'Tweet 1:', 'New tweet -', 'Here is my tweet:'])} {t}\n", False, t, ()
+    ),
+    "quoted": lambda t, other, rng: (f'"{t}",\n\n"{other}",\n', False, t, ()),
+    "self reference": lambda t, other, rng: (
+        rng.choice([f"@Flip_Flop_Frogg {t}\n", f"{t} (error error ttyl)\n", f"{t} @flip_flop_frogg\n"]), False, t, ()
+    ),
+    "hashtags": lambda t, other, rng: (f"{t} #{rng.choice(['based', 'frog', 'AI'])} #solana\n--\n", False, t, ()),
+    "note": lambda t, other, rng: (f"(thoughts: this one slaps)\n{t}\n--\n", False, t, ()),
+    "copied example": lambda t, other, rng: (f"{other}\n--\n{t}\n--\n", False, t, (other,)),
+    "cut off": lambda t, other, rng: (t[:rng.randint(1, len(t))], False, None, ()),
+    "prompt echo": lambda t, other, rng: (f"Recent Posts: - {t}\n", False, None, ()),
+    "no text": lambda t, other, rng: (rng.choice(["\n--\n", "...\n", "--\n!!\n"]), False, None, ()),
+}
+
+
+def synthetic_cases(tweets: List[str], per_kind: int, seed: int = 0) -> List[Case]:
+    rng = random.Random(seed)
+    cases = []
+    for kind, build in CASE_BUILDERS.items():
+        for _ in range(per_kind):
+            tweet, other = rng.sample(tweets, 2)
+            cases.append(Case(kind, *build(tweet, other, rng)))
+    return cases
+
+
+def evaluate_synthetic(cases: List[Case], show: int):
+    totals = defaultdict(Counter)
+    for case in cases:
+        extraction = extract_tweet(case.output, finished=case.finished, known=known_tweet_keys(case.known))
+        counts = totals[case.kind]
+        counts["cases"] += 1
+        if not extraction.confident:
+            counts["correct" if case.expected is None else "fallback"] += 1
+            continue
+        counts["bypassed"] += 1
+        if extraction.tweet == case.expected:
+            counts["correct"] += 1
+        else:
+            counts["wrong"] += 1
+            if counts["wrong"] <= show:
+                print(f"  wrong {case.kind}: {case.output!r} -> {extraction.tweet!r}, expected {case.expected!r}")
+
+    print(f"{'case':<18} {'cases':>6} {'bypass':>8} {'correct':>8} {'wrong':>6}")
+    overall = Counter()
+    for kind, counts in totals.items():
+        overall.update(counts)
+        print(
+            f"{kind:<18} {counts['cases']:>6} {counts['bypassed'] / counts['cases']:>8.1%} "
+            f"{counts['correct'] / counts['cases']:>8.1%} {counts['wrong']:>6}"
+        )
+    print(
+        f"{'all':<18} {overall['cases']:>6} {overall['bypassed'] / overall['cases']:>8.1%} "
+        f"{overall['correct'] / overall['cases']:>8.1%} {overall['wrong']:>6}"
+    )
+
+
+def evaluate_recorded(path: str, show: int):
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records:
+        print(f"No recorded outputs in {path}")
+        return
+
+    reasons = Counter()
+    samples = defaultdict(list)
+    for record in records:
+        extraction = extract_tweet(record["output"], finished=record.get("finish_reason") == "stop")
+        key = "bypassed" if extraction.confident else extraction.reason
+        reasons[key] += 1
+        if len(samples[key]) < show:
+            samples[key].append((record["output"], extraction.tweet))
+
+    print(f"Recorded outputs from {path}: {len(records)}, bypass rate {reasons['bypassed'] / len(records):.1%}")
+    for key, count in reasons.most_common():
+        print(f"  {key:<22} {count:>6}")
+        for output, tweet in samples[key]:
+            print(f"    {output[:120]!r} -> {tweet!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--per-kind", type=int, default=200, help="Synthetic outputs per case kind")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--recorded", help="JSONL of base model outputs recorded with POST_RECORD_PATH")
+    parser.add_argument("--show", type=int, default=3, help="Examples to print per wrong case kind or reason")
+    args = parser.parse_args()
+
+    tweets = seed_tweets()
+    print(f"Synthetic base model outputs from {len(tweets)} seed tweets")
+    evaluate_synthetic(synthetic_cases(tweets, args.per_kind, args.seed), args.show)
+    if args.recorded:
+        evaluate_recorded(args.recorded, args.show)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,156 @@
+import asyncio
+import atexit
 import json
-import time
+import os
+from typing import Optional
 from sqlalchemy.orm import Session
 from db.db_setup import get_db
 from engines.post_retriever import (
     retrieve_recent_posts,
     fetch_external_context,
-    fetch_notification_context,
+    fetch_notification_context_async,
     format_post_list
 )
-from engines.short_term_mem import generate_short_term_memory
+from engines.short_term_mem import generate_short_term_memory_async
 from engines.long_term_mem import (
     create_embedding,
     retrieve_relevant_memories,
     store_memory,
 )
-from engines.post_maker import generate_post
+from engines.embedding_cache import get_embedding_cache
+from engines.query_cache import get_query_cache
+from engines.llm_cache import get_llm_cache
+from engines.resilience import circuit_breaker_states
+from engines.rate_limiter import get_rate_limiter
+from engines.llm_client import LLM_PROVIDERS, async_llm_client_stats, close_async_llm_clients, get_llm_client
+from engines.post_maker import POST_CANDIDATES, generate_best_post_async, generate_post
 from engines.significance_scorer import score_significance
+from engines.significance_prescorer import SIGNIFICANCE_PRESCORER, get_significance_prescorer
 from engines.post_sender import send_post, send_post_API
-from engines.wallet_send import transfer_sol, wallet_address_in_post, get_wallet_balance
-from engines.follow_user import follow_by_username, decide_to_follow_users
+from engines.wallet_send import transfer_sol, wallet_address_in_post_async, get_wallet_balance
+from engines.follow_user import follow_by_username, decide_to_follow_users_async
 from models import Post, User, TweetPost
 from twitter.account import Account
 
+# Cache, client, circuit breaker and rate limit counters after every run
+PIPELINE_STATS = os.getenv("PIPELINE_STATS", "0") == "1"
+
+# Event loop every run_pipeline call runs on. The async LLM clients belong to the loop that opened them, so keeping
+# one loop alive across runs keeps their keep-alive connections too, instead of a new handshake per run.
+_pipeline_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_pipeline_loop() -> asyncio.AbstractEventLoop:
+    global _pipeline_loop
+    if _pipeline_loop is None:
+        atexit.register(close_pipeline_loop)
+    if _pipeline_loop is None or _pipeline_loop.is_closed():
+        _pipeline_loop = asyncio.new_event_loop()
+    return _pipeline_loop
+
+
+def close_pipeline_loop():
+    """Close the pipeline loop's async LLM clients and the loop itself."""
+    if _pipeline_loop is None or _pipeline_loop.is_closed():
+        return
+    _pipeline_loop.run_until_complete(close_async_llm_clients())
+    _pipeline_loop.run_until_complete(_pipeline_loop.shutdown_asyncgens())
+    _pipeline_loop.close()
+
+
+def print_pipeline_stats():
+    """Print the process-wide cache, LLM client, circuit breaker and rate limiter counters."""
+    print(f"Embedding cache: {get_embedding_cache().stats()}")
+    print(f"Memory query cache: {get_query_cache().stats()}")
+    print(f"LLM response cache: {get_llm_cache().stats()}")
+    print(f"Significance pre-scorer: {get_significance_prescorer().stats()}")
+    for provider in LLM_PROVIDERS:
+        print(f"LLM client ({provider}): {get_llm_client(provider).stats()}")
+    print(f"Async LLM clients: {async_llm_client_stats()}")
+    print(f"Circuit breakers: {circuit_breaker_states()}")
+    print(f"Rate limits: {get_rate_limiter().stats()}")
+
+
+async def send_to_wallets_in_posts(
+    notif_context, private_key_hex: str, solana_mainnet_rpc_url: str, llm_api_key: str
+):
+    """Step 2.5: send SOL to wallet addresses found in new notifications, if the agent can afford it."""
+    balance_sol = await asyncio.to_thread(get_wallet_balance, private_key_hex, solana_mainnet_rpc_url)
+    print(f"Agent wallet balance is {balance_sol} SOL now.\n")
+
+    if balance_sol > 0.3:
+        tries = 0
+        max_tries = 2
+        while tries < max_tries:
+            wallet_data = await wallet_address_in_post_async(
+                notif_context, private_key_hex, solana_mainnet_rpc_url, llm_api_key
+            )
+            print(f"Wallet addresses and amounts chosen from Posts: {wallet_data}")
+            try:
+                wallets = json.loads(wallet_data)
+                if len(wallets) > 0:
+                    # Send ETH to the wallet addresses with specified amounts
+                    for wallet in wallets:
+                        address = wallet["address"]
+                        amount = wallet["amount"]
+                        await asyncio.to_thread(
+                            transfer_sol, private_key_hex, solana_mainnet_rpc_url, address, amount
+                        )
+                    break
+                else:
+                    print("No wallet addresses or amounts to send ETH to.")
+                    break
+            except json.JSONDecodeError as e:
+                print(f"Error parsing wallet data: {e}")
+                tries += 1
+                continue
+            except KeyError as e:
+                print(f"Missing key in wallet data: {e}")
+                break
+
+
+async def follow_users_in_posts(db: Session, account: Account, notif_context, openrouter_api_key: str):
+    """Step 2.75: follow the users from new notifications the agent rates highly enough."""
+    print("Deciding following now")
+    tries = 0
+    max_tries = 2
+    while tries < max_tries:
+        # Re-asks bypass the cached decision that was just found unusable
+        decision_data = await decide_to_follow_users_async(
+            db, notif_context, openrouter_api_key, refresh_cache=tries > 0
+        )
+        print(f"Decisions from Posts: {decision_data}")
+        try:
+            decisions = json.loads(decision_data)
+            if len(decisions) > 0:
+                # Follow the users with specified scores
+                for decision in decisions:
+                    username = decision["username"]
+                    score = decision["score"]
+                    if score > 0.98:
+                        await asyncio.to_thread(follow_by_username, account, username)
+                        print(
+                            f"user {username} has a high rizz of {score}, now following."
+                        )
+                    else:
+                        print(
+                            f"Score {score} for user {username} is below or equal to 0.98. Not following."
+                        )
+                break
+            else:
+                print("No users to follow.")
+                break
+        except json.JSONDecodeError as e:
+            print(f"Error parsing decision data: {e}")
+            tries += 1
+            continue
+        except KeyError as e:
+            print(f"Missing key in decision data: {e}")
+            break
+        except Exception as e:
+            print(f"An unexpected error occurred: {e}")
+            break
+
 
 def run_pipeline(
     db: Session,
@@ -35,6 +164,8 @@ def run_pipeline(
 ):
     """
     Run the main pipeline for generating and posting content.
+    Synchronous entry point around run_pipeline_async, which runs independent stages concurrently, on an event loop
+    that is reused by every run.
 
     Args:
         db (Session): Database session
@@ -45,6 +176,34 @@ def run_pipeline(
         openrouter_api_key (str): API key for OpenRouter
         openai_api_key (str): API key for OpenAI
     """
+    get_pipeline_loop().run_until_complete(run_pipeline_async(
+        db,
+        account,
+        auth,
+        private_key_hex,
+        solana_mainnet_rpc_url,
+        llm_api_key,
+        openrouter_api_key,
+        openai_api_key,
+    ))
+
+
+async def run_pipeline_async(
+    db: Session,
+    account: Account,
+    auth,
+    private_key_hex: str,
+    solana_mainnet_rpc_url: str,
+    llm_api_key: str,
+    openrouter_api_key: str,
+    openai_api_key: str,
+):
+    """
+    Run the pipeline on the current event loop. The timeline and notification fetches run concurrently, and
+    so do the wallet decision, the follow decision and short-term memory generation, which only depend on
+    the fetched context. Arguments are the same as run_pipeline. The loop's async LLM clients stay open for the
+    next run and are only closed by close_pipeline_loop() when the process exits.
+    """
     # Step 1: Retrieve recent posts
     recent_posts = retrieve_recent_posts(db)
     formatted_recent_posts = format_post_list(recent_posts)
@@ -54,7 +213,7 @@ def run_pipeline(
     # reply_fetch_list = []
     # for e in recent_posts:
     #     reply_fetch_list.append((e["tweet_id"], e["content"]))
-    notif_context_tuple = fetch_notification_context(account)
+    notif_context_tuple = await fetch_notification_context_async(account)
     notif_context_id = [context[1] for context in notif_context_tuple]
 
     # filter all of the notifications for ones that haven't been seen before
@@ -75,109 +234,48 @@ def run_pipeline(
         print(f"- {notif[0]}, tweet at https://x.com/user/status/{notif[1]}\n")
     external_context = notif_context
 
+    # Steps 2.5, 2.75 and 3 only depend on the fetched context and run concurrently
+    stages = [generate_short_term_memory_async(recent_posts, external_context, llm_api_key)]
     if len(notif_context) > 0:
-        # Step 2.5 check wallet addresses in posts
-        balance_sol = get_wallet_balance(private_key_hex, solana_mainnet_rpc_url)
-        print(f"Agent wallet balance is {balance_sol} SOL now.\n")
-        
-        if balance_sol > 0.3:
-            tries = 0
-            max_tries = 2
-            while tries < max_tries:
-                wallet_data = wallet_address_in_post(
-                    notif_context, private_key_hex, solana_mainnet_rpc_url, llm_api_key
-                )
-                print(f"Wallet addresses and amounts chosen from Posts: {wallet_data}")
-                try:
-                    wallets = json.loads(wallet_data)
-                    if len(wallets) > 0:
-                        # Send ETH to the wallet addresses with specified amounts
-                        for wallet in wallets:
-                            address = wallet["address"]
-                            amount = wallet["amount"]
-                            transfer_sol(
-                                private_key_hex, solana_mainnet_rpc_url, address, amount
-                            )
-                        break
-                    else:
-                        print("No wallet addresses or amounts to send ETH to.")
-                        break
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing wallet data: {e}")
-                    tries += 1
-                    continue
-                except KeyError as e:
-                    print(f"Missing key in wallet data: {e}")
-                    break
-        
-        time.sleep(5)
-
-        print("Deciding following now")
-        # Step 2.75 decide if follow some users
-        tries = 0
-        max_tries = 2
-        while tries < max_tries:
-            decision_data = decide_to_follow_users(db, notif_context, openrouter_api_key)
-            print(f"Decisions from Posts: {decision_data}")
-            try:
-                decisions = json.loads(decision_data)
-                if len(decisions) > 0:
-                    # Follow the users with specified scores
-                    for decision in decisions:
-                        username = decision["username"]
-                        score = decision["score"]
-                        if score > 0.98:
-                            follow_by_username(account, username)
-                            print(
-                                f"user {username} has a high rizz of {score}, now following."
-                            )
-                        else:
-                            print(
-                                f"Score {score} for user {username} is below or equal to 0.98. Not following."
-                            )
-                    break
-                else:
-                    print("No users to follow.")
-                    break
-            except json.JSONDecodeError as e:
-                print(f"Error parsing decision data: {e}")
-                tries += 1
-                continue
-            except KeyError as e:
-                print(f"Missing key in decision data: {e}")
-                break
-            except Exception as e:
-                print(f"An unexpected error occurred: {e}")
-                break
-    
-    time.sleep(5)
-
-    # Step 3: Generate short-term memory
-    short_term_memory = generate_short_term_memory(
-        recent_posts, external_context, llm_api_key
-    )
+        stages.append(send_to_wallets_in_posts(notif_context, private_key_hex, solana_mainnet_rpc_url, llm_api_key))
+        stages.append(follow_users_in_posts(db, account, notif_context, openrouter_api_key))
+    results = await asyncio.gather(*stages, return_exceptions=True)
+    # Raised only once every stage has finished, so a failed run leaves nothing running on the reused loop
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    short_term_memory = results[0]
     print(f"Short-term memory: {short_term_memory}")
 
     # Step 4: Create embedding for short-term memory
     short_term_embedding = create_embedding(short_term_memory, openai_api_key)
 
     # Step 5: Retrieve relevant long-term memories
-    long_term_memories = retrieve_relevant_memories(db, short_term_embedding)
+    long_term_memories = retrieve_relevant_memories(db, short_term_embedding, query_text=short_term_memory)
     print(f"Long-term memories: {long_term_memories}")
 
-    # Step 6: Generate new post
-    new_post_content = generate_post(short_term_memory, long_term_memories, formatted_recent_posts, external_context, llm_api_key)
+    # Step 6: Generate new post, best of POST_CANDIDATES when that is above 1 (already scored then)
+    significance_score = None
+    if POST_CANDIDATES > 1:
+        new_post_content, significance_score = await generate_best_post_async(
+            short_term_memory, long_term_memories, formatted_recent_posts, external_context, llm_api_key
+        )
+    else:
+        new_post_content = generate_post(short_term_memory, long_term_memories, formatted_recent_posts, external_context, llm_api_key)
     new_post_content = new_post_content.strip('"')
     print(f"New post content: {new_post_content}")
 
     # Step 7: Score the significance of the new post
-    significance_score = score_significance(new_post_content, llm_api_key)
+    if significance_score is None:
+        significance_score = score_significance(new_post_content, llm_api_key)
     print(f"Significance score: {significance_score}")
 
     # Step 8: Store the new post in long-term memory if significant enough
     if significance_score >= 7:
         new_post_embedding = create_embedding(new_post_content, openai_api_key)
         store_memory(db, new_post_content, new_post_embedding, significance_score)
+    if PIPELINE_STATS:
+        print_pipeline_stats()
 
     # Step 9: Save the new post to the database
     ai_user = db.query(User).filter(User.username == "Flip_Flop_Frogg").first()
@@ -224,4 +322,8 @@ def run_pipeline(
 
     print(
         f"New post generated with significance score {significance_score}: {new_post_content}"
-    )
\ No newline at end of file
+    )
+
+    # Step 10: Refit the significance pre-scorer on the new labels, now that nothing is waiting on it
+    if SIGNIFICANCE_PRESCORER:
+        get_significance_prescorer().refit_if_due()
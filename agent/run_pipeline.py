@@ -4,12 +4,14 @@ import random
 from datetime import datetime, timedelta
 from db.db_setup import create_database, get_db
 from db.db_seed import seed_database
+from db.db_migrate import migrate_database
 from pipeline import run_pipeline
 from dotenv import load_dotenv
 import secrets
 from requests_oauthlib import OAuth1
 from tweepy import Client, Paginator, TweepyException
 from engines.post_sender import send_post, send_post_API
+from engines.memory_consolidation import consolidate_memories, consolidation_due, format_consolidation_report
 from twitter.account import Account
 import json
 from solders.keypair import Keypair
@@ -54,6 +56,7 @@ def main():
         seed_database()
     else:
         print("Database already exists. Skipping creation and seeding.")
+        migrate_database()
 
     db = next(get_db())
 
@@ -105,6 +108,7 @@ def main():
         print(f"Error during initial run: {e}")
 
     print("Starting continuous pipeline process...")
+    last_consolidation = datetime.now()
 
     while True:
         try:
@@ -118,6 +122,15 @@ def main():
             print(f"Deactivation time: {deactivation_time.strftime('%I:%M:%S %p')}")
             print(f"Duration: {active_duration.total_seconds() / 60:.1f} minutes")
 
+            # Merge near-duplicate memories while the agent is idle, only now and then since every merge makes
+            # the memory caches reload
+            if consolidation_due(db, last_consolidation):
+                last_consolidation = datetime.now()
+                try:
+                    print(format_consolidation_report(consolidate_memories(db)))
+                except Exception as e:
+                    print(f"Error consolidating memories: {e}")
+
             # Wait until activation time
             while datetime.now() < activation_time:
                 time.sleep(60)  # Check every minute
@@ -0,0 +1,31 @@
+# Every test runs offline against a scratch SQLite database with the hashing embedding provider. The environment is
+# set here because db.db_setup and the engines read it at import time, before any test module is collected.
+
+import os
+import shutil
+import tempfile
+import pytest
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="agent-tests-")
+os.environ["SQLITE_DB_PATH"] = os.path.join(SCRATCH_DIR, "agents.db")
+os.environ["EMBEDDING_PROVIDER"] = "hashing"
+os.environ["MEMORY_STORE"] = "process"
+os.environ["LLM_CACHE"] = "0"
+
+from db.db_setup import SessionLocal, create_database  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def scratch_database():
+    create_database()
+    yield os.environ["SQLITE_DB_PATH"]
+    shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def db(scratch_database):
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
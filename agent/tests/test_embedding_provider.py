@@ -0,0 +1,23 @@
+import numpy as np
+from engines.embedding_provider import EMBEDDING_DIMENSIONS, get_embedding_provider
+from engines.long_term_mem import create_embeddings
+
+
+def test_hashing_provider_is_deterministic_and_unit_length():
+    provider = get_embedding_provider("hashing")
+    first = provider.embed_text("the dance of the shadow puppet")
+    second = provider.embed_text("the dance of the shadow puppet")
+    assert first.shape == (EMBEDDING_DIMENSIONS,)
+    assert np.array_equal(first, second)
+    assert np.isclose(np.linalg.norm(first), 1.0)
+    assert not provider.embed_text("!!!").any()
+
+
+def test_hashing_provider_ranks_shared_words_higher():
+    query, related, unrelated = (
+        np.asarray(vector)
+        for vector in create_embeddings(
+            ["hawking radiates a cold light", "a cold light of indifference", "michigan was meant to hurt"], None
+        )
+    )
+    assert query @ related > query @ unrelated
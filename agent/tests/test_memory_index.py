@@ -0,0 +1,110 @@
+import random
+import numpy as np
+import pytest
+from sqlalchemy import insert
+from benchmark_memory import example_vocabulary
+from db.db_setup import SessionLocal
+from engines.embedding_store import encode_embedding, load_memory_matrix
+from engines.long_term_mem import create_embeddings
+from engines.memory_index import FlatIndex, IVFIndex, Int8Index, PrefixIndex, assign_lists, recall_at_k
+from models import LongTermMemory
+
+MEMORY_COUNT = 3000
+TOPIC_COUNT = 60
+QUERY_COUNT = 60
+TOP_K = 10
+MIN_TRAIN_ROWS = 500
+
+
+def topical_texts(count: int, seed: int) -> list:
+    """Texts drawn mostly from one of TOPIC_COUNT fixed word sets, so memories cluster the way real ones do."""
+    vocabulary = example_vocabulary()
+    topics = [random.Random(topic).sample(vocabulary, 30) for topic in range(TOPIC_COUNT)]
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        topic = rng.choice(topics)
+        words = [rng.choice(topic) if rng.random() < 0.8 else rng.choice(vocabulary) for _ in range(rng.randint(8, 40))]
+        texts.append(" ".join(words))
+    return texts
+
+
+def insert_memories(db, texts):
+    rows = []
+    for content, embedding in zip(texts, create_embeddings(texts, None)):
+        embedding_blob, embedding_norm = encode_embedding(embedding)
+        rows.append({
+            "content": content,
+            "embedding": embedding_blob,
+            "embedding_norm": embedding_norm,
+            "significance_score": 8.0,
+        })
+    db.execute(insert(LongTermMemory), rows)
+    db.commit()
+
+
+@pytest.fixture(scope="module")
+def memories(scratch_database):
+    session = SessionLocal()
+    try:
+        insert_memories(session, topical_texts(MEMORY_COUNT, seed=0))
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture(scope="module")
+def queries():
+    return create_embeddings(topical_texts(QUERY_COUNT, seed=1), None)
+
+
+def index_recall(db, index, queries) -> float:
+    exact = [FlatIndex().search(db, query, TOP_K) for query in queries]
+    return recall_at_k([index.search(db, query, TOP_K) for query in queries], exact)
+
+
+@pytest.mark.parametrize(
+    "make_index, min_recall",
+    [
+        (lambda tmp_path: IVFIndex(path=str(tmp_path / "memory_index.npz"), min_train_rows=MIN_TRAIN_ROWS), 0.9),
+        (lambda tmp_path: Int8Index(min_train_rows=MIN_TRAIN_ROWS), 0.95),
+        (lambda tmp_path: PrefixIndex(), 0.85),
+    ],
+    ids=["ivf", "int8", "prefix"],
+)
+def test_index_recall_against_flat(memories, queries, tmp_path, make_index, min_recall):
+    index = make_index(tmp_path)
+    index.rebuild(memories)
+    assert len(index.ids) == MEMORY_COUNT
+    assert index_recall(memories, index, queries) >= min_recall
+
+
+def test_ivf_sync_applies_only_changed_memories(memories, queries, tmp_path):
+    path = str(tmp_path / "memory_index.npz")
+    index = IVFIndex(path=path, min_train_rows=MIN_TRAIN_ROWS)
+    index.rebuild(memories)
+
+    # Writes from outside store_memory: inserts, deletes and a re-embedded memory
+    insert_memories(memories, topical_texts(40, seed=2))
+    ids = [row.id for row in memories.query(LongTermMemory.id).order_by(LongTermMemory.id)]
+    memories.query(LongTermMemory).filter(LongTermMemory.id.in_(ids[:25])).delete(synchronize_session=False)
+    embedding_blob, embedding_norm = encode_embedding(create_embeddings(["a fresh memory about frogs"], None)[0])
+    memories.query(LongTermMemory).filter(LongTermMemory.id == ids[100]).update(
+        {"embedding": embedding_blob, "embedding_norm": embedding_norm}, synchronize_session=False
+    )
+    memories.commit()
+
+    reassigned = []
+    index.reassign = lambda db: reassigned.append(db)
+    assert index_recall(memories, index, queries) >= 0.9
+    assert not reassigned
+
+    current = load_memory_matrix(memories)
+    assert np.array_equal(index.ids, current.ids)
+    assert np.array_equal(index.lists, assign_lists(current.embeddings, index.centroids))
+
+    # A fresh process replays the journal on top of the saved index and ends up in the same state
+    reloaded = IVFIndex(path=path, min_train_rows=MIN_TRAIN_ROWS)
+    reloaded.load()
+    assert np.array_equal(reloaded.ids, index.ids)
+    assert np.array_equal(reloaded.lists, index.lists)
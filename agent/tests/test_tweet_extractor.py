@@ -0,0 +1,41 @@
+import pytest
+from engines.prompts import get_example_tweet_list
+from engines.tweet_extractor import extract_tweet, known_tweet_keys
+from evaluate_tweet_extractor import CASE_BUILDERS, seed_tweets, synthetic_cases
+
+
+@pytest.fixture(scope="module")
+def cases():
+    return synthetic_cases(seed_tweets(), per_kind=200, seed=0)
+
+
+@pytest.mark.parametrize("kind", sorted(CASE_BUILDERS))
+def test_no_wrong_extractions(cases, kind):
+    for case in (case for case in cases if case.kind == kind):
+        extraction = extract_tweet(case.output, finished=case.finished, known=known_tweet_keys(case.known))
+        if case.expected is None:
+            assert not extraction.confident, case.output
+        else:
+            # Anything the extractor is not sure of goes to the formatter, but a confident answer must be exact
+            assert not extraction.confident or extraction.tweet == case.expected, case.output
+
+
+def test_clean_cases_skip_the_formatter(cases):
+    plain = [case for case in cases if case.kind in ("plain", "finished", "label", "quoted")]
+    bypassed = sum(
+        extract_tweet(case.output, finished=case.finished, known=known_tweet_keys(case.known)).confident
+        for case in plain
+    )
+    assert bypassed == len(plain)
+
+
+def test_prompt_examples_are_never_picked():
+    example = get_example_tweet_list()[6]
+    extraction = extract_tweet(f"{example.upper()}\n--\nmy own frog thoughts today\n--\n")
+    assert extraction.tweet == "my own frog thoughts today"
+    assert extract_tweet(f"{example}\n").reason == "copied example"
+
+
+def test_growing_last_line_is_not_extracted():
+    assert not extract_tweet("a tweet that is still being").confident
+    assert extract_tweet("a tweet that is still being", finished=True).tweet == "a tweet that is still being"